@@ -0,0 +1,1079 @@
+"""
+Benchmarks do pipeline de dados (XMLs locais e CVM) com entradas sintéticas.
+
+Não depende do Google Drive nem da CVM: os arquivos são gerados num
+diretório temporário no formato real (arquivoposicao_4_01 e Galgo).
+
+Uso:
+    python benchmark.py xml                 # parse de XMLs (arquivos/s, pico de memória)
+    python benchmark.py xml --arquivos 500 --posicoes 200
+    python benchmark.py carga-xml --processos 4   # carregar_dados_xml serial x paralelo
+    python benchmark.py carga-xml --duplicatas 2  # com prévias (mesma data, PL menor)
+    python benchmark.py carga-xml --compactar     # meses em AAAA/MM.zip
+    python benchmark.py descoberta --latencia-ms 20   # índice de pastas frio x quente
+    python benchmark.py espelho --arquivos 500        # sincronização do espelho local
+    python benchmark.py montagem-xml --posicoes 2000000  # DataFrame de posições XML
+    python benchmark.py cvm --meses 36 --latencia-ms 300   # downloads CVM (servidor HTTP local)
+    python benchmark.py cda-blocos --meses 6               # blocos do CDA de um só download
+    python benchmark.py revalidacao --meses 6              # atualização diária com 304 (ETag)
+    python benchmark.py inf-diario --fundos 20000          # cotas/universo do inf_diario por row group
+    python benchmark.py cnpj --linhas 1000000              # normalização de CNPJ, chaves str x int64
+    python benchmark.py blc4 --linhas 200000               # classificação ativo/setor do BLC_4
+    python benchmark.py cache --meses 24                   # compactação anual e poda LRU do cache CVM
+    python benchmark.py cvm-memoria --cortes 2             # pico de RSS do download (memória x disco)
+    python benchmark.py csv-cvm --linhas 500000            # CSVs CVM: todas as colunas x esquema
+    python benchmark.py filtro-cvm --cnpjs 300             # filtro por CNPJ na leitura (pico de RSS)
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+# Garantir diretório correto
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ".")
+
+# Monkey-patch streamlit (mesmo esquema do export_data.py)
+import streamlit as st
+
+
+def _mock_cache_data(*args, **kwargs):
+    def decorator(func):
+        return func
+    if args and callable(args[0]):
+        return args[0]
+    return decorator
+
+
+st.cache_data = _mock_cache_data
+
+os.environ["FORCE_LOCAL_MODE"] = "1"
+
+import data_loader
+from data_loader import NS_GALGO, NS_DOC
+from fixtures_cvm import (_TICKERS, _cnpj_formatado, ServidorCVM, apontar_cvm_para,
+                          gerar_zip_cda, gerar_zip_inf_diario)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Geradores de XML sintético
+# ──────────────────────────────────────────────────────────────────────────────
+def gerar_xml_old(cnpj: str, data: datetime, n_posicoes: int, pl: float = 1e8) -> str:
+    """XML no formato arquivoposicao_4_01 com n_posicoes ações + cotas/títulos/caixa."""
+    partes = [
+        "<?xml version=\"1.0\" encoding=\"UTF-8\"?>",
+        "<arquivoposicao_4_01><fundo><header>",
+        f"<isin>BR0000000000</isin><cnpj>{cnpj}</cnpj><nome>FUNDO SINTETICO</nome>",
+        f"<dtposicao>{data:%Y%m%d}</dtposicao><patliq>{pl:.2f}</patliq>",
+        "</header>",
+    ]
+    for i in range(n_posicoes):
+        ticker = _TICKERS[i % len(_TICKERS)]
+        partes.append(
+            f"<acoes><isin>BR{i:010d}</isin><codativo>{ticker}</codativo>"
+            f"<qtdisponivel>{1000 + i}</qtdisponivel><valorfindisp>{10000.0 + i:.2f}</valorfindisp>"
+            f"<tributos>0</tributos></acoes>"
+        )
+    for i in range(max(1, n_posicoes // 10)):
+        partes.append(
+            f"<cotas><isin>BRCOTA{i:06d}</isin><cnpjfundo>{i:014d}</cnpjfundo>"
+            f"<qtdisponivel>{500 + i}</qtdisponivel><puposicao>1.2345</puposicao>"
+            f"<valorfindisp>0</valorfindisp></cotas>"
+        )
+        partes.append(
+            f"<titpublico><isin>BRSTN{i:07d}</isin><codativo>{760199 + i}</codativo>"
+            f"<dtvencimento>20300101</dtvencimento><valorfindisp>{5000.0 + i:.2f}</valorfindisp></titpublico>"
+        )
+    partes.append("<caixa><isininstituicao>BRCAIXA</isininstituicao><saldo>12345.67</saldo></caixa>")
+    partes.append("</fundo></arquivoposicao_4_01>")
+    return "".join(partes)
+
+
+def gerar_xml_galgo(cnpj: str, data: datetime, n_posicoes: int, pl: float = 1e8) -> str:
+    """XML no formato ISO 20022 / Galgo com n_posicoes BalForSubAcct."""
+    def _othr(id_val, cd=None, prtry=None):
+        tp = f"<Cd>{cd}</Cd>" if cd else f"<Prtry>{prtry}</Prtry>"
+        return f"<OthrId><Id>{id_val}</Id><Tp>{tp}</Tp></OthrId>"
+
+    partes = [
+        "<?xml version=\"1.0\" encoding=\"UTF-8\"?>",
+        f"<GalgoAssBalStmt xmlns=\"{NS_GALGO}\"><BsnsMsg>",
+        f"<Document xmlns=\"{NS_DOC}\"><SctiesBalAcctgRpt>",
+        f"<StmtGnlDtls><StmtDtTm><Dt>{data:%Y-%m-%d}</Dt></StmtDtTm></StmtGnlDtls>",
+        "<BalForAcct><FinInstrmId>", _othr(cnpj, cd="CNPJ"), "</FinInstrmId>",
+        f"<AcctBaseCcyAmts><HldgVal><Amt Ccy=\"BRL\">{pl:.2f}</Amt></HldgVal></AcctBaseCcyAmts>",
+        "</BalForAcct><SubAcctDtls>",
+    ]
+    for i in range(n_posicoes):
+        ticker = _TICKERS[i % len(_TICKERS)]
+        tipo = "LOAN" if i % 17 == 0 else "EQUI"
+        partes.append(
+            "<BalForSubAcct><FinInstrmId>"
+            + _othr(ticker, cd="BVMF") + _othr(tipo, prtry="TABELA NIVEL 1")
+            + "</FinInstrmId><AggtBal><ShrtLngInd>LONG</ShrtLngInd></AggtBal>"
+            + f"<AcctBaseCcyAmts><HldgVal><Amt Ccy=\"BRL\">{20000.0 + i:.2f}</Amt></HldgVal></AcctBaseCcyAmts>"
+            + "</BalForSubAcct>"
+        )
+    partes.append("</SubAcctDtls></SctiesBalAcctgRpt></Document></BsnsMsg></GalgoAssBalStmt>")
+    return "".join(partes)
+
+
+def gerar_arvore_xml(base: str, n_arquivos: int, n_posicoes: int, duplicatas: int = 0) -> list[str]:
+    """Cria n_arquivos XMLs (metade old, metade Galgo) em base/AAAA/MM.
+
+    duplicatas: prévias extras por arquivo (mesmo fundo e data, PL menor).
+    """
+    paths = []
+    inicio = datetime(2024, 1, 2)
+    for i in range(n_arquivos):
+        data = inicio + timedelta(days=i // 2)
+        pasta = os.path.join(base, f"{data:%Y}", f"{data:%m}")
+        os.makedirs(pasta, exist_ok=True)
+        cnpj = f"{11111111000100 + i % 7:014d}"
+        for k in range(duplicatas + 1):
+            sufixo = f"_PREVIA{k}" if k else ""
+            pl = 1e8 * (1 - 0.01 * k)
+            if i % 2 == 0:
+                path = os.path.join(pasta, f"{data:%Y%m%d}_FUNDO{i % 7}{sufixo}.xml")
+                conteudo = gerar_xml_old(cnpj, data, n_posicoes, pl)
+            else:
+                path = os.path.join(pasta, f"FD{cnpj}_{data:%Y%m%d}{sufixo}.xml")
+                conteudo = gerar_xml_galgo(cnpj, data, n_posicoes, pl)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(conteudo)
+            paths.append(path)
+    return paths
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# CVM sintética (geradores e servidor HTTP local em fixtures_cvm.py)
+# ──────────────────────────────────────────────────────────────────────────────
+def meses_cvm(meses: int) -> list[str]:
+    """Mesma lista de meses de carregar_dados_cvm."""
+    hoje = datetime.now()
+    return sorted({(hoje - timedelta(days=30 * i)).strftime("%Y%m") for i in range(1, meses + 1)})
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Benchmarks
+# ──────────────────────────────────────────────────────────────────────────────
+def _parse(path: str):
+    fmt = data_loader._detect_xml_format(path)
+    if fmt == "old":
+        return data_loader._parse_xml_old(path)
+    return data_loader._parse_xml_new(path)
+
+
+def bench_xml(n_arquivos: int, n_posicoes: int):
+    """Mede arquivos/s no parse e pico de memória por tamanho de arquivo."""
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = gerar_arvore_xml(tmp, n_arquivos, n_posicoes)
+        t0 = time.perf_counter()
+        for p in paths:
+            _parse(p)
+        dt = time.perf_counter() - t0
+        print(f"Parse: {n_arquivos} arquivos x {n_posicoes} posições em {dt:.2f}s "
+              f"-> {n_arquivos / dt:.1f} arquivos/s")
+
+        print("Memória por arquivo (tracemalloc; resultado retido = lista de posições):")
+        for n in (1_000, 10_000, 50_000):
+            for nome, gerador in (("old", gerar_xml_old), ("galgo", gerar_xml_galgo)):
+                path = os.path.join(tmp, f"grande_{nome}_{n}.xml")
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(gerador("11111111000100", datetime(2024, 1, 2), n))
+                tracemalloc.start()
+                resultado = _parse(path)
+                retido, pico = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                tam = os.path.getsize(path)
+                # pico - retido = memória transitória do parser (árvore, buffers)
+                print(f"  {nome:5s} {n:>6d} posições ({tam / 1e6:5.1f} MB): "
+                      f"pico {pico / 1e6:6.1f} MB, transitório {(pico - retido) / 1e6:6.1f} MB")
+                del resultado
+
+
+def bench_carga_xml(n_arquivos: int, n_posicoes: int, n_processos: int, duplicatas: int = 0,
+                    compactar: bool = False):
+    """carregar_dados_xml completo sobre uma árvore sintética: serial x paralelo.
+
+    compactar: empacota todos os meses em AAAA/MM.zip antes da carga.
+    """
+    with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory() as tmp_cache:
+        n_arquivos = len(gerar_arvore_xml(tmp, n_arquivos, n_posicoes, duplicatas))
+        data_loader.XML_BASE_PATH = tmp
+        data_loader.XML_MELLON_PATH = os.path.join(tmp, "mellon")
+        data_loader.CACHE_DIR = tmp_cache
+        cnpjs = tuple(f"{11111111000100 + i:014d}" for i in range(7))
+        if compactar:
+            meses = data_loader.compactar_meses_fechados(meses_abertos=0)
+            print(f"  {len(meses)} meses compactados: "
+                  f"{sum(m['bytes_soltos'] for m in meses.values()) / 1e6:.1f} MB -> "
+                  f"{sum(m['bytes_zip'] for m in meses.values()) / 1e6:.1f} MB")
+
+        resultados = {}
+        for n in (1, n_processos):
+            t0, cpu0 = time.perf_counter(), time.process_time()
+            resultados[n] = data_loader.carregar_dados_xml(cnpjs, n_processos=n)
+            dt, cpu = time.perf_counter() - t0, time.process_time() - cpu0
+            io_xml = data_loader.estatisticas_io_xml()
+            # CPU só do processo principal: com n > 1 o parse roda nos filhos
+            print(f"  {n:>2d} processo(s): {len(resultados[n])} registros em {dt:.2f}s "
+                  f"-> {n_arquivos / dt:.1f} arquivos/s" + (f" (CPU {cpu:.2f}s)" if n == 1 else ""))
+            print(f"     E/S: {io_xml['aberturas'].sum()} aberturas em {len(io_xml)} arquivos "
+                  f"(máx {io_xml['aberturas'].max()}/arquivo), {io_xml['bytes_lidos'].sum() / 1e6:.1f} MB lidos")
+        print(f"  Resultados idênticos: {resultados[1].equals(resultados[n_processos])}")
+
+
+def bench_descoberta(n_arquivos: int, latencia_ms: float):
+    """Descoberta de XMLs com índice de pastas frio, quente e após um arquivo novo.
+
+    latencia_ms simula a ida e volta do drive de rede em cada stat/listdir.
+    """
+    with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory() as tmp_cache:
+        gerar_arvore_xml(tmp, n_arquivos, 1)
+        data_loader.XML_BASE_PATH = tmp
+        data_loader.XML_MELLON_PATH = os.path.join(tmp, "mellon")
+        data_loader.CACHE_DIR = tmp_cache
+        cnpjs = tuple(f"{11111111000100 + i:014d}" for i in range(7))
+
+        listdir, stat = os.listdir, os.stat
+        if latencia_ms:
+            def _lento(func):
+                def wrapper(*args, **kwargs):
+                    time.sleep(latencia_ms / 1000)
+                    return func(*args, **kwargs)
+                return wrapper
+            os.listdir, os.stat = _lento(listdir), _lento(stat)
+        try:
+            def _medir(rotulo):
+                t0 = time.perf_counter()
+                data_loader._descobrir_xmls_por_cnpj(cnpjs)
+                dt = time.perf_counter() - t0
+                v = data_loader._VARREDURA_XML
+                print(f"  {rotulo:<16s} {dt:6.3f}s  ({v['listadas']} listdir em {v['pastas']} pastas)")
+
+            _medir("índice frio")
+            _medir("índice quente")
+            ultimo_mes = sorted(os.path.join(r, d) for r, ds, _ in os.walk(tmp) for d in ds)[-1]
+            with open(os.path.join(ultimo_mes, "99999999_NOVO.xml"), "w") as f:
+                f.write("<x/>")
+            _medir("1 pasta alterada")
+        finally:
+            os.listdir, os.stat = listdir, stat
+
+
+def bench_espelho(n_arquivos: int, n_posicoes: int):
+    """Sincronização do espelho: fria, sem mudanças, 1 alterado, retomada e remoção."""
+    import espelho_drive
+
+    with tempfile.TemporaryDirectory() as rede, tempfile.TemporaryDirectory() as local:
+        paths = gerar_arvore_xml(rede, n_arquivos, n_posicoes)
+
+        def _medir(rotulo):
+            t0 = time.perf_counter()
+            stats = espelho_drive.sincronizar_pasta(rede, local, (".xml",))
+            dt = time.perf_counter() - t0
+            print(f"  {rotulo:<18s} {dt:6.3f}s  {espelho_drive.formatar_stats('xml', stats)}")
+
+        _medir("fria")
+        _medir("sem mudanças")
+        with open(paths[0], "a", encoding="utf-8") as f:
+            f.write("\n")
+        _medir("1 alterado")
+        # Cópia interrompida: metade do arquivo já no .parcial
+        with open(paths[1], "a", encoding="utf-8") as f:
+            f.write("\n")
+        info = os.stat(paths[1])
+        destino = os.path.join(local, os.path.relpath(paths[1], rede))
+        with open(paths[1], "rb") as f_in, open(espelho_drive._parcial(destino, info), "wb") as f_out:
+            f_out.write(f_in.read(info.st_size // 2))
+        _medir("retomada")
+        os.remove(paths[2])
+        _medir("1 removido")
+
+
+def _montar_df_xml_registros(best_parses: dict):
+    """Montagem anterior (um dict por posição), mantida como referência."""
+    import pandas as pd
+    from sector_map import classificar_setor
+
+    records = []
+    for (cnpj, data), (pl, acoes) in best_parses.items():
+        for a in acoes:
+            pct = (a["valor"] / pl * 100) if pl > 0 else 0
+            records.append({
+                "cnpj_fundo": cnpj, "data": data, "ativo": a["ativo"], "valor": a["valor"],
+                "pl": pl, "pct_pl": pct, "setor": classificar_setor(a["ativo"]), "fonte": "XML",
+            })
+    df = pd.DataFrame(records)
+    df["data"] = pd.to_datetime(df["data"])
+    return df
+
+
+def bench_montagem_xml(n_posicoes: int, por_carteira: int):
+    """Montagem do DataFrame de carregar_dados_xml: registros x colunar."""
+    n_chaves = max(1, n_posicoes // por_carteira)
+    inicio = datetime(2020, 1, 2)
+    best_parses = {}
+    for k in range(n_chaves):
+        cnpj = f"{11111111000100 + k % 300:014d}"
+        data = inicio + timedelta(days=k // 300)
+        acoes = [{"ativo": _TICKERS[i % len(_TICKERS)] if i % 5 else f"FUNDO {i:014d}",
+                  "valor": 10000.0 + i} for i in range(por_carteira)]
+        best_parses[(cnpj, data)] = (1e8 + k, acoes)
+    total = n_chaves * por_carteira
+    print(f"  {total:,} posições em {n_chaves:,} carteiras")
+
+    resultados = {}
+    for nome, func in (("registros", _montar_df_xml_registros),
+                       ("colunar", data_loader._montar_df_xml)):
+        t0 = time.perf_counter()
+        df = func(best_parses)
+        dt = time.perf_counter() - t0
+        mem = df.memory_usage(deep=True).sum()
+        del df
+        tracemalloc.start()
+        resultados[nome] = func(best_parses)
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"  {nome:<10s} {dt:6.2f}s  pico {pico / 1e6:7.1f} MB  DataFrame {mem / 1e6:7.1f} MB")
+
+    iguais = resultados["colunar"].equals(resultados["registros"])
+    print(f"  Resultados idênticos: {iguais}")
+
+
+def bench_cvm(n_meses: int, n_fundos: int, latencia_ms: float, falhas: int, workers: int):
+    """carregar_dados_cvm contra o servidor local: 1 download por vez x paralelo."""
+    import shutil
+
+    cnpjs = [f"{22222222000100 + k:014d}" for k in range(n_fundos)]
+    with tempfile.TemporaryDirectory() as tmp:
+        fixtures = os.path.join(tmp, "cvm")
+        os.makedirs(fixtures)
+        for ym in meses_cvm(n_meses):
+            gerar_zip_cda(os.path.join(fixtures, f"cda_fi_{ym}.zip"), ym, cnpjs, 50)
+
+        data_loader.CVM_BACKOFF_BASE = 0.05
+        data_loader.CVM_INTERVALO_HOST = 0.0
+        resultados = {}
+        for n in (1, workers):
+            cache = os.path.join(tmp, f"cache_{n}")
+            shutil.rmtree(cache, ignore_errors=True)
+            with ServidorCVM(fixtures, latencia_ms, falhas) as srv:
+                apontar_cvm_para(srv.url, cache)
+                data_loader.CVM_DOWNLOADS_SIMULTANEOS = n
+                t0 = time.perf_counter()
+                resultados[n] = data_loader.carregar_dados_cvm(tuple(cnpjs), (), meses=n_meses)
+                dt = time.perf_counter() - t0
+            print(f"  {n:>2d} download(s) por vez: {len(resultados[n])} registros, "
+                  f"{srv.requisicoes} requisições em {dt:.2f}s")
+        print(f"  Resultados idênticos (e na ordem dos meses): "
+              f"{resultados[1].equals(resultados[workers])}")
+
+
+def bench_cda_blocos(n_meses: int, n_fundos: int, latencia_ms: float):
+    """buscar_carteiras_cvm_sob_demanda: blocos + PL de cada mês a partir de um
+    único download do ZIP combinado. Os fundos alvo só aparecem no mês mais
+    antigo, então a busca percorre todos os meses."""
+    alvos = [f"{33333333000100 + k:014d}" for k in range(n_fundos)]
+    outros = [f"{44444444000100 + k:014d}" for k in range(n_fundos)]
+    hoje = datetime.now()
+    meses = [(hoje - timedelta(days=30 * i)).strftime("%Y%m") for i in range(n_meses)]
+    with tempfile.TemporaryDirectory() as tmp:
+        fixtures = os.path.join(tmp, "cvm")
+        os.makedirs(fixtures)
+        for ym in meses:
+            cnpjs = alvos if ym == meses[-1] else outros
+            gerar_zip_cda(os.path.join(fixtures, f"cda_fi_{ym}.zip"), ym, cnpjs, 200)
+
+        data_loader.CVM_INTERVALO_HOST = 0.0
+        with ServidorCVM(fixtures, latencia_ms) as srv:
+            apontar_cvm_para(srv.url, os.path.join(tmp, "cache"))
+            t0 = time.perf_counter()
+            df = data_loader.buscar_carteiras_cvm_sob_demanda(tuple(alvos), meses_max=n_meses)
+            dt = time.perf_counter() - t0
+        io_cda = data_loader.estatisticas_cda()
+        blocos_por_mes = 6  # BLC_4, 2, 1, 5, 6 + PL
+        print(f"  {n_meses} meses, {len(df)} posições em {dt:.2f}s, {srv.requisicoes} requisições")
+        print(f"  ZIP combinado: {io_cda['downloads']} downloads "
+              f"({io_cda['bytes_baixados'] / 1e6:.2f} MB); "
+              f"antes: até {blocos_por_mes * n_meses} downloads")
+        print(f"  Deduplicação: {io_cda['bytes_evitados'] / 1e6:.2f} MB não baixados")
+
+
+def bench_indice_cda(n_meses: int, n_fundos: int, latencia_ms: float):
+    """Índice CNPJ -> meses do CDA na busca sob demanda. Os fundos alvo só
+    aparecem no mês mais antigo (entregas atrasadas/encerrados). A primeira
+    busca baixa todos os meses e monta o índice; depois os parquets saem do
+    cache (LRU) e a mesma busca, com o índice, só baixa os meses recentes (que
+    a CVM ainda republica) e o mês dos fundos."""
+    alvos = [f"{33333333000100 + k:014d}" for k in range(n_fundos)]
+    outros = [f"{44444444000100 + k:014d}" for k in range(n_fundos)]
+    hoje = datetime.now()
+    meses = [(hoje - timedelta(days=30 * i)).strftime("%Y%m") for i in range(n_meses)]
+    with tempfile.TemporaryDirectory() as tmp:
+        fixtures = os.path.join(tmp, "cvm")
+        os.makedirs(fixtures)
+        for ym in meses:
+            cnpjs = alvos if ym == meses[-1] else outros
+            gerar_zip_cda(os.path.join(fixtures, f"cda_fi_{ym}.zip"), ym, cnpjs, 200)
+
+        data_loader.CVM_INTERVALO_HOST = 0.0
+        resultados = {}
+        with ServidorCVM(fixtures, latencia_ms) as srv:
+            apontar_cvm_para(srv.url, os.path.join(tmp, "cache"))
+            for rodada in ("sem índice", "com índice"):
+                if rodada == "com índice":
+                    data_loader._remover_caches_cvm(data_loader._arquivos_cache_cvm())
+                antes, pulados = srv.requisicoes, data_loader.estatisticas_cda()["meses_pulados"]
+                t0 = time.perf_counter()
+                resultados[rodada] = data_loader.buscar_carteiras_cvm_sob_demanda(tuple(alvos), meses_max=n_meses)
+                dt = time.perf_counter() - t0
+                print(f"  {rodada}: {len(resultados[rodada])} posições em {dt:.2f}s, "
+                      f"{srv.requisicoes - antes} requisições, "
+                      f"{data_loader.estatisticas_cda()['meses_pulados'] - pulados} meses pulados")
+        print(f"  Resultados idênticos: {resultados['sem índice'].equals(resultados['com índice'])}")
+
+
+def _pico_rss_mb() -> float | None:
+    """Pico de RSS do processo (MB).
+
+    No Linux usa VmHWM (/proc/self/status): ru_maxrss é herdado do processo
+    pai no fork/exec e mediria o pico de quem gerou as fixtures.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for linha in f:
+                if linha.startswith("VmHWM:"):
+                    return int(linha.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 1e6
+        except Exception:
+            return None
+
+
+def _cda_mes_em_memoria(yyyymm: str):
+    """Referência: mesma separação por bloco de _bloco_cda_mes, mas com o ZIP
+    inteiro na memória (resp.content + ZipFile(BytesIO)), como antes."""
+    import io
+    import zipfile
+    import requests
+    import pandas as pd
+    resp = requests.get(data_loader.CVM_ZIP_URL.format(yyyymm=yyyymm), timeout=120)
+    os.makedirs(data_loader.CACHE_DIR, exist_ok=True)
+    df = None
+    with zipfile.ZipFile(io.BytesIO(resp.content)) as zf:
+        for nome in zf.namelist():
+            m = data_loader._RE_BLOCO_CDA.search(nome)
+            if not m or not nome.endswith(".csv"):
+                continue
+            with zf.open(nome) as csvfile:
+                df_bloco = pd.read_csv(csvfile, sep=";", encoding="latin-1", low_memory=False)
+            bloco = m.group(1).upper()
+            df_bloco.to_parquet(data_loader._cache_cvm_path(bloco, yyyymm), index=False)
+            if bloco == "BLC_4":
+                df = df_bloco
+    return df
+
+
+def _medir_download_filho(modo: str, url: str, cache_dir: str, ym: str):
+    """Executado num subprocesso (pico de RSS não zera dentro do processo)."""
+    apontar_cvm_para(url, cache_dir)
+    base = _pico_rss_mb()
+    t0 = time.perf_counter()
+    if modo == "memoria":
+        df = _cda_mes_em_memoria(ym)
+    else:
+        df = data_loader._download_cvm_blc(4, ym)
+    dt = time.perf_counter() - t0
+    print(f"{len(df)} {dt:.3f} {base:.1f} {_pico_rss_mb():.1f}")
+
+
+def bench_cvm_memoria(n_fundos: int, n_por_fundo: int, extra_mb: int, cortes: int):
+    """Pico de RSS de um download CDA: ZIP na memória (antes) x ZIP em disco.
+
+    extra_mb leva o ZIP ao tamanho de um mês real: com --extra-mb 0 e poucas
+    linhas, os buffers fixos da leitura em lotes dominam e a comparação não
+    representa o download da CVM."""
+    import subprocess
+    ym = meses_cvm(1)[0]
+    cnpjs = [f"{22222222000100 + k:014d}" for k in range(n_fundos)]
+    with tempfile.TemporaryDirectory() as tmp:
+        fixtures = os.path.join(tmp, "cvm")
+        os.makedirs(fixtures)
+        zip_path = os.path.join(fixtures, f"cda_fi_{ym}.zip")
+        gerar_zip_cda(zip_path, ym, cnpjs, n_por_fundo, extra_mb)
+        print(f"  ZIP: {os.path.getsize(zip_path) / 1e6:.1f} MB, "
+              f"{n_fundos * n_por_fundo} linhas no BLC_4")
+        execucoes = [("memoria", 0), ("disco", 0)] + ([("disco", cortes)] if cortes else [])
+        for modo, cortes_modo in execucoes:
+            with ServidorCVM(fixtures, cortes=cortes_modo) as srv:
+                saida = subprocess.run(
+                    [sys.executable, __file__, "cvm-memoria", "--filho", modo, "--url", srv.url,
+                     "--cache", os.path.join(tmp, f"cache_{modo}_{cortes_modo}"), "--ym", ym],
+                    capture_output=True, text=True, check=True).stdout.split()[-4:]
+            linhas, dt, base, pico = saida
+            rotulo = "ZIP na memória (antes)" if modo == "memoria" else (
+                f"ZIP em disco, {cortes_modo} quedas" if cortes_modo else "ZIP em disco")
+            print(f"  {rotulo:<28s}: {linhas} linhas em {float(dt):.2f}s, pico RSS {float(pico):.0f} MB "
+                  f"(+{float(pico) - float(base):.0f} MB sobre o processo carregado), "
+                  f"{srv.requisicoes} requisições")
+
+
+def bench_csv_cvm(n_linhas: int, n_fundos_inf: int):
+    """Leitura dos CSVs da CVM: todas as colunas (low_memory=False, antes) x
+    esquema com colunas e tipos (_ler_csv_cvm), nos dois layouts de CNPJ."""
+    import zipfile
+    import pandas as pd
+    ym = meses_cvm(1)[0]
+    with tempfile.TemporaryDirectory() as tmp:
+        for col_cnpj in ("CNPJ_FUNDO_CLASSE", "CNPJ_FUNDO"):
+            cda = os.path.join(tmp, f"cda_{col_cnpj}.zip")
+            inf = os.path.join(tmp, f"inf_{col_cnpj}.zip")
+            cnpjs = [f"{22222222000100 + k:014d}" for k in range(max(n_fundos_inf, 100))]
+            gerar_zip_cda(cda, ym, cnpjs[:100], n_linhas // 100, col_cnpj=col_cnpj)
+            gerar_zip_inf_diario(inf, ym, cnpjs[:n_fundos_inf], col_cnpj=col_cnpj)
+            for zip_path, membro, tipo in ((cda, f"cda_fi_BLC_4_{ym}.csv", "BLC_4"),
+                                           (inf, f"inf_diario_fi_{ym}.csv", "INF_DIARIO")):
+                with zipfile.ZipFile(zip_path) as zf:
+                    t0 = time.perf_counter()
+                    with zf.open(membro) as csvfile:
+                        antes = pd.read_csv(csvfile, sep=";", encoding="latin-1", low_memory=False)
+                    t_antes = time.perf_counter() - t0
+                    t0 = time.perf_counter()
+                    depois = data_loader._ler_csv_cvm(zf, membro, tipo)
+                    t_depois = time.perf_counter() - t0
+                mb_antes = antes.memory_usage(deep=True).sum() / 1e6
+                mb_depois = depois.memory_usage(deep=True).sum() / 1e6
+                cols = [c for c in depois.columns if c in antes.columns]
+                iguais = antes[cols].astype(str).equals(depois[cols].astype(str))
+                print(f"  {tipo:<10s} {col_cnpj:<17s} {len(antes):>8d} linhas: "
+                      f"{t_antes:.2f}s/{mb_antes:.0f} MB ({antes.shape[1]} colunas) -> "
+                      f"{t_depois:.2f}s/{mb_depois:.0f} MB ({depois.shape[1]} colunas); "
+                      f"valores iguais: {iguais}")
+
+
+def _medir_filtro_filho(modo: str, zip_path: str, tipo: str, n_alvo: int):
+    """Subprocesso do filtro-cvm: lê o CSV do ZIP e fica com n_alvo fundos."""
+    import zipfile
+    alvo = {f"{22222222000100 + k:014d}" for k in range(0, 10 * n_alvo, 10)}
+    base = _pico_rss_mb()
+    t0 = time.perf_counter()
+    with zipfile.ZipFile(zip_path) as zf:
+        nome = zf.namelist()[0] if tipo == "INF_DIARIO" else next(
+            n for n in zf.namelist() if "BLC_4" in n)
+        if modo == "antes":
+            df = data_loader._ler_csv_cvm(zf, nome, tipo)
+            df = df[df["cnpj_norm"].isin(alvo)]
+        else:
+            df = data_loader._ler_csv_cvm(zf, nome, tipo, alvo)
+    dt = time.perf_counter() - t0
+    print(f"{len(df)} {dt:.3f} {base:.1f} {_pico_rss_mb():.1f}")
+
+
+def bench_filtro_cvm(n_fundos: int, n_alvo: int):
+    """Mês nacional inteiro e depois filtro (antes) x filtro lote a lote na leitura.
+
+    O pico do filtro na leitura é o dos blocos do parser e não cresce com o
+    mês; a diferença só aparece quando o CSV passa desses blocos (use --fundos
+    600000 para um mês 10x maior que o padrão)."""
+    import subprocess
+    ym = meses_cvm(1)[0]
+    cnpjs = [f"{22222222000100 + k:014d}" for k in range(n_fundos)]
+    with tempfile.TemporaryDirectory() as tmp:
+        inf = os.path.join(tmp, "inf.zip")
+        cda = os.path.join(tmp, "cda.zip")
+        gerar_zip_inf_diario(inf, ym, cnpjs)
+        gerar_zip_cda(cda, ym, cnpjs[: n_fundos // 10], 100)
+        for tipo, zip_path in (("INF_DIARIO", inf), ("BLC_4", cda)):
+            for modo in ("antes", "depois"):
+                saida = subprocess.run(
+                    [sys.executable, __file__, "filtro-cvm", "--filho", modo, "--zip", zip_path,
+                     "--tipo", tipo, "--cnpjs", str(n_alvo)],
+                    capture_output=True, text=True, check=True).stdout.split()[-4:]
+                linhas, dt, base, pico = saida
+                rotulo = "lê tudo e filtra" if modo == "antes" else "filtra na leitura"
+                print(f"  {tipo:<10s} {rotulo:<18s}: {linhas} linhas em {float(dt):.2f}s, "
+                      f"pico RSS +{float(pico) - float(base):.0f} MB sobre o processo carregado")
+
+
+def bench_revalidacao(n_meses: int, n_fundos: int, latencia_ms: float):
+    """Atualização diária contra o servidor local: carga fria, dia seguinte sem
+    mudança na CVM (caches vencidos, pedidos condicionais) e dia seguinte com
+    um mês republicado. Antes, todo mês recente era baixado de novo a cada 24h."""
+    cnpjs = [f"{55555555000100 + k:014d}" for k in range(n_fundos)]
+    hoje = datetime.now()
+    meses_cda = meses_cvm(n_meses)
+    meses_inf = sorted({(hoje - timedelta(days=30 * i)).strftime("%Y%m") for i in range(n_meses + 1)})
+    with tempfile.TemporaryDirectory() as tmp:
+        fixtures = os.path.join(tmp, "cvm")
+        cache = os.path.join(tmp, "cache")
+        os.makedirs(fixtures)
+        for ym in meses_cda:
+            gerar_zip_cda(os.path.join(fixtures, f"cda_fi_{ym}.zip"), ym, cnpjs, 200)
+        for ym in meses_inf:
+            gerar_zip_inf_diario(os.path.join(fixtures, f"inf_diario_fi_{ym}.zip"), ym, cnpjs)
+
+        def recentes():
+            return [os.path.join(fixtures, f"{prefixo}{ym}.zip")
+                    for prefixo, meses in (("cda_fi_", meses_cda), ("inf_diario_fi_", meses_inf))
+                    for ym in meses if (hoje.year - int(ym[:4])) * 12 + hoje.month - int(ym[4:]) <= 3]
+
+        def envelhecer_cache():
+            with data_loader._LOCK_METADADOS:
+                for meta in data_loader._metadados_cvm().values():
+                    meta["verificado_em"] -= 25 * 3600
+
+        data_loader.CVM_INTERVALO_HOST = 0.0
+        resultados = []
+        with ServidorCVM(fixtures, latencia_ms) as srv:
+            apontar_cvm_para(srv.url, cache)
+            for rodada in ("fria", "sem mudança", "1 mês republicado"):
+                if rodada == "1 mês republicado":
+                    gerar_zip_cda(os.path.join(fixtures, f"cda_fi_{meses_cda[-1]}.zip"),
+                                  meses_cda[-1], cnpjs, 201)
+                if rodada != "fria":
+                    envelhecer_cache()
+                antes_rodada = (srv.requisicoes, srv.nao_modificados, srv.bytes_enviados)
+                t0 = time.perf_counter()
+                df = data_loader.carregar_dados_cvm(tuple(cnpjs), (), meses=n_meses)
+                cotas = data_loader.carregar_cotas_fundos(tuple(cnpjs), meses=n_meses)
+                dt = time.perf_counter() - t0
+                requisicoes, nao_modificados, enviados = (
+                    x - y for x, y in zip((srv.requisicoes, srv.nao_modificados, srv.bytes_enviados),
+                                          antes_rodada))
+                resultados.append((df, cotas))
+                print(f"  {rodada:<18s}: {requisicoes:3d} requisições, {nao_modificados:3d} x 304, "
+                      f"{enviados / 1e6:7.2f} MB baixados em {dt:.2f}s "
+                      f"({len(df)} posições, {len(cotas)} cotas)")
+        antes = sum(os.path.getsize(p) for p in recentes())
+        print(f"  Antes: {antes / 1e6:.2f} MB por dia (todos os meses recentes, sem revalidação)")
+        print(f"  Resultados iguais à carga fria (sem mudança): "
+              f"{resultados[1][0].equals(resultados[0][0]) and resultados[1][1].equals(resultados[0][1])}")
+
+
+def bench_inf_diario(n_meses: int, n_fundos: int, n_alvo: int):
+    """Cotas de dois conjuntos de fundos e o universo, dos mesmos arquivos
+    mensais do inf_diario (ordenados por CNPJ, lidos por row group). Antes:
+    um cache _filtered com os fundos do primeiro pedido (reusado, errado, pelo
+    segundo) e outro download do mês inteiro para o universo. Com poucos
+    fundos o mês tem poucos row groups e todos são lidos; a poda aparece num
+    mês do tamanho do real (--fundos 60000: 252 row groups)."""
+    import random
+    import pandas as pd
+    import pyarrow.parquet as pq
+
+    cnpjs = [f"{66666666000100 + 7 * k:014d}" for k in range(n_fundos)]
+    sorteio = random.Random(1)
+    alvo_a = tuple(sorteio.sample(cnpjs, n_alvo))
+    alvo_b = tuple(sorteio.sample(cnpjs, n_alvo))
+    hoje = datetime.now()
+    meses = sorted({(hoje - timedelta(days=30 * i)).strftime("%Y%m") for i in range(n_meses + 1)})
+    with tempfile.TemporaryDirectory() as tmp:
+        fixtures = os.path.join(tmp, "cvm")
+        os.makedirs(fixtures)
+        for ym in meses:
+            gerar_zip_inf_diario(os.path.join(fixtures, f"inf_diario_fi_{ym}.zip"), ym, cnpjs)
+
+        data_loader.CVM_INTERVALO_HOST = 0.0
+        with ServidorCVM(fixtures) as srv:
+            apontar_cvm_para(srv.url, os.path.join(tmp, "cache"))
+            for nome, func in (("cotas A", lambda: data_loader.carregar_cotas_fundos(alvo_a, meses=n_meses)),
+                               ("universo", lambda: data_loader.carregar_universo_stats(meses=n_meses)),
+                               ("cotas B", lambda: data_loader.carregar_cotas_fundos(alvo_b, meses=n_meses))):
+                antes = srv.requisicoes
+                t0 = time.perf_counter()
+                df = func()
+                dt = time.perf_counter() - t0
+                print(f"  {nome:<9s}: {len(df):7d} linhas em {dt:.2f}s, {srv.requisicoes - antes} downloads")
+        ok_b = set(df["cnpj_fundo"]) <= set(alvo_b) | set(data_loader.BENCHMARK_CNPJS.values())
+        print(f"  Cotas B só com os fundos de B: {ok_b} ({df['cnpj_fundo'].nunique()} fundos)")
+
+        path = data_loader._cache_cvm_path("INF_DIARIO", meses[-1])
+        pf = pq.ParquetFile(path)
+        for n in (20, n_alvo):
+            alvo = sorted(alvo_b[:n])
+            grupos = data_loader._row_groups_cnpjs(pf, alvo)
+            t0 = time.perf_counter()
+            for _ in range(5):
+                data_loader._ler_parquet_cnpjs(path, set(alvo))
+            t_idx = (time.perf_counter() - t0) / 5
+            t0 = time.perf_counter()
+            for _ in range(5):
+                pd.read_parquet(path, filters=[("cnpj_norm", "in", alvo)])
+            t_filtro = (time.perf_counter() - t0) / 5
+            print(f"  {n:4d} CNPJs num mês: {len(grupos)}/{pf.metadata.num_row_groups} row groups, "
+                  f"{t_idx * 1000:.0f} ms (filtro do read_parquet: {t_filtro * 1000:.0f} ms)")
+
+
+def bench_cache(n_meses: int, n_fundos: int, n_alvo: int):
+    """Governança do cache da CVM: n_meses de CDA (todos os blocos) e de
+    inf_diario, compactados num parquet por dataset e ano e depois podados por
+    LRU até metade do tamanho. Compara a leitura mês a mês (arquivos mensais x
+    anuais) e conta os downloads de quem volta a pedir os meses podados."""
+    import random
+
+    cnpjs = [f"{88888888000100 + 7 * k:014d}" for k in range(n_fundos)]
+    alvo = set(random.Random(1).sample(cnpjs, n_alvo))
+    hoje = datetime.now()
+    meses = sorted({(hoje - timedelta(days=30 * i)).strftime("%Y%m") for i in range(n_meses)})
+    with tempfile.TemporaryDirectory() as tmp:
+        fixtures = os.path.join(tmp, "cvm")
+        os.makedirs(fixtures)
+        for ym in meses:
+            gerar_zip_cda(os.path.join(fixtures, f"cda_fi_{ym}.zip"), ym, cnpjs[:n_fundos // 10], 20)
+            gerar_zip_inf_diario(os.path.join(fixtures, f"inf_diario_fi_{ym}.zip"), ym, cnpjs)
+
+        data_loader.CVM_INTERVALO_HOST = 0.0
+        data_loader.CVM_CACHE_LIMITE_MB = 0
+        with ServidorCVM(fixtures) as srv:
+            apontar_cvm_para(srv.url, os.path.join(tmp, "cache"))
+
+            def ler_meses():
+                t0 = time.perf_counter()
+                partes = [data_loader._download_cvm_inf_diario(ym, alvo) for ym in meses]
+                partes += [data_loader._bloco_cda_mes("BLC_4", ym, alvo) for ym in meses]
+                return partes, time.perf_counter() - t0
+
+            def uso(rotulo):
+                df = data_loader.estatisticas_cache_cvm()
+                print(f"  {rotulo:<22s}: {len(df):4d} arquivos, {df['bytes'].sum() / 1e6:7.2f} MB")
+                return df
+
+            ler_meses()
+            antes = uso("mensal")
+            mensal, t_mensal = ler_meses()
+            t0 = time.perf_counter()
+            data_loader.compactar_cache_cvm()
+            t_comp = time.perf_counter() - t0
+            uso(f"compactado ({t_comp:.1f}s)")
+            compactado, t_compactado = ler_meses()
+            iguais = all(a.reset_index(drop=True).equals(b.reset_index(drop=True))
+                         for a, b in zip(mensal, compactado))
+            print(f"  leitura de {n_alvo} fundos em {n_meses} meses: mensal {t_mensal * 1000:.0f} ms, "
+                  f"compactado {t_compactado * 1000:.0f} ms (resultados iguais: {iguais})")
+
+            limite = antes["bytes"].sum() / 2e6
+            r = data_loader.liberar_cache_cvm(limite)
+            uso(f"limite {limite:.1f} MB")
+            print(f"  LRU: {r['removidos']} arquivos removidos ({r['bytes_liberados'] / 1e6:.2f} MB)")
+            requisicoes = srv.requisicoes
+            ler_meses()
+            print(f"  releitura depois da poda: {srv.requisicoes - requisicoes} downloads")
+
+
+def bench_cnpj(n_linhas: int, n_fundos: int, n_alvo: int):
+    """Normalização de CNPJ de um mês nacional: .apply(_normalizar_cnpj) x
+    vetorizada (regex só nos distintos), e isin/merge com chave str x int64."""
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(1)
+    fundos = np.array([_cnpj_formatado(f"{77777777000100 + 7 * k:014d}") for k in range(n_fundos)])
+    serie = pd.Series(fundos[rng.integers(0, n_fundos, n_linhas)], dtype="str")
+    alvo = set(data_loader._cnpjs_normalizados(pd.Series(rng.choice(fundos, n_alvo))))
+
+    def medir(func, vezes=3):
+        t0 = time.perf_counter()
+        for _ in range(vezes):
+            r = func()
+        return (time.perf_counter() - t0) / vezes, r
+
+    t_apply, ref = medir(lambda: serie.apply(data_loader._normalizar_cnpj), vezes=1)
+    t_vet, norm = medir(lambda: data_loader._cnpjs_normalizados(serie))
+    t_int, chaves = medir(lambda: data_loader._cnpjs_normalizados(serie, inteiro=True))
+    print(f"  {n_linhas} linhas, {n_fundos} fundos distintos")
+    print(f"  .apply(_normalizar_cnpj): {t_apply * 1000:7.0f} ms")
+    print(f"  vetorizado (str):         {t_vet * 1000:7.0f} ms  iguais: {norm.equals(ref.astype('str'))}")
+    print(f"  vetorizado (int64):       {t_int * 1000:7.0f} ms")
+
+    alvo_int = {data_loader._cnpj_int(c) for c in alvo}
+    pl_str = pd.DataFrame({"cnpj": sorted(alvo), "pl": rng.random(len(alvo))})
+    pl_int = pl_str.assign(cnpj=pl_str["cnpj"].astype("int64"))
+    t_isin_s, m_s = medir(lambda: norm.isin(alvo))
+    t_isin_i, m_i = medir(lambda: chaves.isin(alvo_int))
+    t_merge_s, _ = medir(lambda: pd.DataFrame({"cnpj": norm}).merge(pl_str, on="cnpj"))
+    t_merge_i, _ = medir(lambda: pd.DataFrame({"cnpj": chaves}).merge(pl_int, on="cnpj"))
+    print(f"  isin  ({n_alvo} CNPJs): str {t_isin_s * 1000:5.0f} ms, int64 {t_isin_i * 1000:5.0f} ms "
+          f"(mesmas linhas: {m_s.equals(m_i)})")
+    print(f"  merge com PL:      str {t_merge_s * 1000:5.0f} ms, int64 {t_merge_i * 1000:5.0f} ms")
+
+
+def _ativo_setor_por_linha(row):
+    """Classificação do BLC_4 linha a linha (implementação anterior, referência)."""
+    import re
+    import pandas as pd
+    tp = str(row["TP_APLIC"]).strip() if pd.notna(row.get("TP_APLIC")) else ""
+    cd = str(row["CD_ATIVO"]).strip().upper() if pd.notna(row.get("CD_ATIVO")) else ""
+    ds = str(row["DS_ATIVO"]).strip() if pd.notna(row.get("DS_ATIVO")) else ""
+
+    is_stock = bool(re.search(
+        r"A.{1,3}es|Brazilian Depository|Certificado|Units", tp, re.IGNORECASE))
+    if is_stock and cd and len(cd) >= 4:
+        return cd, data_loader.classificar_setor(cd)
+    if re.search(r"Op..es|Termo|Futuro|Swap", tp, re.IGNORECASE):
+        return (f"DERIV {cd}" if cd else f"DERIV {ds[:20]}"), "Derivativos"
+    if cd and len(cd) >= 4:
+        return cd, data_loader.classificar_setor(cd)
+    return (f"OUTROS {ds[:25]}" if ds else f"OUTROS {tp[:20]}"), "Outros"
+
+
+def bench_blc4(n_linhas: int, n_fundos: int):
+    """Classificação ativo/setor do BLC_4: df.apply linha a linha x colunar
+    (regex nos TP_APLIC distintos, setor nos tickers distintos). O conjunto de
+    referência cruza tipos, códigos e descrições (nulos, espaços, minúsculas,
+    códigos curtos) e tem de sair idêntico."""
+    import itertools
+    import numpy as np
+    import pandas as pd
+
+    tipos = [None, "", " Ações ", "ações", "Ações e outros TVM cedidos em empréstimo",
+             "Brazilian Depository Receipt", "Certificado ou recibo de depósito de valores mobiliários",
+             "Units", "Opções - Posições titulares", "Opções - Posições lançadas",
+             "Mercado Futuro - Posições compradas", "Termo - Posições vendidas", "Swap - Diferencial a receber",
+             "Debêntures", "Outros valores mobiliários registrados na CVM", "Investimento no Exterior"]
+    codigos = [None, "", "PETR4", " vale3 ", "ITUB4", "ABC", "BOVA11", "XPTO11", "petr4x", "AB", "FUNDO X"]
+    descricoes = [None, "", "PETROBRAS PN EDJ N2 - DESCRIÇÃO LONGA DO ATIVO", " desc curta "]
+    referencia = pd.DataFrame(list(itertools.product(tipos, codigos, descricoes)),
+                              columns=["TP_APLIC", "CD_ATIVO", "DS_ATIVO"]).astype("str")
+    esperado = referencia.apply(_ativo_setor_por_linha, axis=1, result_type="expand")
+    ativo, setor = data_loader._classificar_ativos_blc4(referencia)
+    iguais = ativo.tolist() == esperado[0].tolist() and setor.tolist() == esperado[1].tolist()
+    print(f"  conjunto de referência: {len(referencia)} linhas, ativo/setor idênticos: {iguais}")
+
+    rng = np.random.default_rng(1)
+    fundos = [f"{55555555000100 + 7 * k:014d}" for k in range(n_fundos)]
+    tickers = [f"{t}{n}" for t in ("PETR", "VALE", "ITUB", "BBDC", "WEGE", "ABEV", "ZZZZ") for n in (3, 4, 11)]
+    amostra = referencia.iloc[rng.integers(0, len(referencia), n_linhas)].reset_index(drop=True)
+    sorteio = rng.integers(0, len(tickers), n_linhas)
+    amostra["CD_ATIVO"] = np.where(amostra["CD_ATIVO"].str.len() >= 4, np.array(tickers)[sorteio],
+                                   amostra["CD_ATIVO"])
+    df = amostra.assign(CNPJ_FUNDO_CLASSE=[_cnpj_formatado(fundos[i])
+                                          for i in rng.integers(0, n_fundos, n_linhas)],
+                        DT_COMPTC="2025-01-31", VL_MERC_POS_FINAL=rng.random(n_linhas) + 0.01)
+
+    t0 = time.perf_counter()
+    esperado = df.apply(_ativo_setor_por_linha, axis=1, result_type="expand")
+    t_apply = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    ativo, setor = data_loader._classificar_ativos_blc4(df)
+    t_col = time.perf_counter() - t0
+    iguais = ativo.tolist() == esperado[0].tolist() and setor.tolist() == esperado[1].tolist()
+    print(f"  {n_linhas} posições: df.apply {t_apply * 1000:7.0f} ms, colunar {t_col * 1000:5.0f} ms "
+          f"(idênticos: {iguais})")
+
+    t0 = time.perf_counter()
+    res = data_loader._processar_bloco_cnpjs(df, set(fundos), data_loader._BLOCOS_SOB_DEMANDA[4])
+    print(f"  _processar_bloco_cnpjs BLC_4 ({n_fundos} fundos): {(time.perf_counter() - t0) * 1000:.0f} ms, "
+          f"{len(res)} linhas, {res['setor'].nunique()} setores")
+
+
+def _pl_e_residuais_por_fundo(df_month, df_pl_cvm):
+    """PL e residual "OUTROS RF/CAIXA" fundo a fundo (implementação anterior,
+    referência): uma varredura do PL e das posições por CNPJ."""
+    import pandas as pd
+    month_found = set(df_month["cnpj_fundo"])
+    month_dfs = [df_month]
+    pl_map = {}
+    df_pl_cvm["_cnpj"] = data_loader._coluna_cnpj_norm(df_pl_cvm, "CNPJ_FUNDO_CLASSE")
+    for cnpj in month_found:
+        pl_rows = df_pl_cvm[df_pl_cvm["_cnpj"] == cnpj]
+        if not pl_rows.empty:
+            pl_map[cnpj] = float(pl_rows["VL_PATRIM_LIQ"].iloc[-1])
+    pl_approx = df_month.groupby("cnpj_fundo")["valor"].sum().to_dict()
+    for cnpj in month_found:
+        pl_total = pl_map.get(cnpj, 0)
+        if pl_total > 0:
+            soma_explicada = df_month[df_month["cnpj_fundo"] == cnpj]["valor"].sum()
+            residual = pl_total - soma_explicada
+            if residual > pl_total * 0.01:
+                dt_ref = df_month[df_month["cnpj_fundo"] == cnpj]["data"].iloc[0]
+                month_dfs.append(pd.DataFrame([{
+                    "cnpj_fundo": cnpj, "data": dt_ref,
+                    "ativo": "OUTROS RF/CAIXA", "valor": residual,
+                    "setor": "Caixa",
+                }]))
+    df_month = pd.concat(month_dfs, ignore_index=True)
+    df_month["pl"] = df_month["cnpj_fundo"].map(lambda c: pl_map.get(c, pl_approx.get(c, 0)))
+    return df_month
+
+
+def bench_pl_residuais(n_fundos: int, n_por_fundo: int):
+    """PL e residuais de um mês de buscar_carteiras_cvm_sob_demanda: loop por
+    CNPJ x groupby/índice. O arquivo PL tem fundos repetidos (vale o último),
+    fundos sem PL, PL nulo e PL abaixo da soma das posições."""
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(2)
+    fundos = [f"{66666666000100 + 3 * k:014d}" for k in range(n_fundos)]
+    n = n_fundos * n_por_fundo
+    df_month = pd.DataFrame({
+        "cnpj_fundo": np.repeat(fundos, n_por_fundo),
+        "data": np.where(rng.random(n) < 0.5, "2025-01-31", "2025-01-30"),
+        "ativo": [f"ATIVO{i % 97}" for i in range(n)],
+        "valor": rng.random(n) * 1e6,
+        "setor": "Outros",
+    }).sample(frac=1, random_state=3).reset_index(drop=True).astype({"cnpj_fundo": "str", "data": "str"})
+    com_pl = [f for f in fundos if rng.random() < 0.9]
+    soma = df_month.groupby("cnpj_fundo")["valor"].sum()
+    df_pl = pd.DataFrame({
+        "CNPJ_FUNDO_CLASSE": [_cnpj_formatado(f) for f in com_pl] * 2,
+        "VL_PATRIM_LIQ": np.concatenate([rng.random(len(com_pl)) * 1e6,
+                                         soma[com_pl].to_numpy() * rng.choice([0.5, 1.005, 1.3, np.nan],
+                                                                              len(com_pl))]),
+    }).astype({"CNPJ_FUNDO_CLASSE": "str"})
+
+    t0 = time.perf_counter()
+    esperado = _pl_e_residuais_por_fundo(df_month.copy(), df_pl.copy())
+    t_loop = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    obtido = data_loader._com_pl_e_residuais(df_month.copy(), df_pl.copy())
+    t_idx = time.perf_counter() - t0
+
+    colunas = ["cnpj_fundo", "data", "ativo", "valor", "setor", "pl"]
+    esperado, obtido = (d[colunas].sort_values(colunas[:4]).reset_index(drop=True)
+                        for d in (esperado, obtido))
+    # groupby soma com compensação: o residual pode diferir no último bit
+    iguais = (esperado[colunas[:3] + ["setor"]].equals(obtido[colunas[:3] + ["setor"]])
+              and all(np.allclose(esperado[c], obtido[c], rtol=1e-12, equal_nan=True) for c in ("valor", "pl")))
+    residuais = int((obtido["ativo"] == "OUTROS RF/CAIXA").sum())
+    print(f"  {n_fundos} fundos, {n} posições, {residuais} residuais: loop por CNPJ {t_loop * 1000:6.0f} ms, "
+          f"groupby/índice {t_idx * 1000:4.0f} ms (idênticos: {iguais})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="alvo", required=True)
+    p_xml = sub.add_parser("xml", help="Parse de XMLs de posição")
+    p_xml.add_argument("--arquivos", type=int, default=400)
+    p_xml.add_argument("--posicoes", type=int, default=150)
+    p_carga = sub.add_parser("carga-xml", help="carregar_dados_xml serial x paralelo")
+    p_carga.add_argument("--arquivos", type=int, default=2000)
+    p_carga.add_argument("--posicoes", type=int, default=150)
+    p_carga.add_argument("--processos", type=int, default=os.cpu_count() or 1)
+    p_carga.add_argument("--duplicatas", type=int, default=0,
+                         help="Prévias extras por (fundo, data), com PL menor")
+    p_carga.add_argument("--compactar", action="store_true",
+                         help="Lê os meses compactados em AAAA/MM.zip")
+    p_desc = sub.add_parser("descoberta", help="Descoberta de XMLs com índice de pastas")
+    p_desc.add_argument("--arquivos", type=int, default=2000)
+    p_desc.add_argument("--latencia-ms", type=float, default=0)
+    p_esp = sub.add_parser("espelho", help="Sincronização do espelho local do Drive")
+    p_esp.add_argument("--arquivos", type=int, default=500)
+    p_esp.add_argument("--posicoes", type=int, default=150)
+    p_mont = sub.add_parser("montagem-xml", help="Montagem do DataFrame de posições XML")
+    p_mont.add_argument("--posicoes", type=int, default=2_000_000)
+    p_mont.add_argument("--por-carteira", type=int, default=200)
+    p_cvm = sub.add_parser("cvm", help="Downloads CVM contra servidor HTTP local")
+    p_cvm.add_argument("--meses", type=int, default=36)
+    p_cvm.add_argument("--fundos", type=int, default=20)
+    p_cvm.add_argument("--latencia-ms", type=float, default=300)
+    p_cvm.add_argument("--falhas", type=int, default=1,
+                       help="503s por arquivo antes de servir (exercita o retry)")
+    p_cvm.add_argument("--workers", type=int, default=4)
+    p_cda = sub.add_parser("cda-blocos", help="Um download do CDA por mês para todos os blocos")
+    p_cda.add_argument("--meses", type=int, default=6)
+    p_cda.add_argument("--fundos", type=int, default=20)
+    p_cda.add_argument("--latencia-ms", type=float, default=100)
+    p_idx = sub.add_parser("indice-cda", help="Busca sob demanda com o índice CNPJ -> meses do CDA")
+    p_idx.add_argument("--meses", type=int, default=12)
+    p_idx.add_argument("--fundos", type=int, default=20)
+    p_idx.add_argument("--latencia-ms", type=float, default=100)
+    p_rev = sub.add_parser("revalidacao", help="Atualização diária com ETag/Last-Modified (304)")
+    p_rev.add_argument("--meses", type=int, default=6)
+    p_rev.add_argument("--fundos", type=int, default=200)
+    p_rev.add_argument("--latencia-ms", type=float, default=50)
+    p_inf = sub.add_parser("inf-diario", help="Cotas e universo do mesmo inf_diario ordenado por CNPJ")
+    p_inf.add_argument("--meses", type=int, default=3)
+    p_inf.add_argument("--fundos", type=int, default=20000)
+    p_inf.add_argument("--cnpjs", type=int, default=300, help="fundos em cada pedido de cotas")
+    p_cnpj = sub.add_parser("cnpj", help="Normalização de CNPJ vetorizada e chaves int64")
+    p_cnpj.add_argument("--linhas", type=int, default=1_000_000)
+    p_cnpj.add_argument("--fundos", type=int, default=20000)
+    p_cnpj.add_argument("--cnpjs", type=int, default=300)
+    p_blc4 = sub.add_parser("blc4", help="Classificação ativo/setor do BLC_4 (apply x colunar)")
+    p_blc4.add_argument("--linhas", type=int, default=200_000)
+    p_blc4.add_argument("--fundos", type=int, default=300)
+    p_pl = sub.add_parser("pl-residuais", help="PL e residuais do CDA sob demanda (loop x groupby)")
+    p_pl.add_argument("--cnpjs", type=int, default=500)
+    p_pl.add_argument("--por-fundo", type=int, default=40)
+    p_cache = sub.add_parser("cache", help="Compactação e orçamento (LRU) do cache da CVM")
+    p_cache.add_argument("--meses", type=int, default=24)
+    p_cache.add_argument("--fundos", type=int, default=5000)
+    p_cache.add_argument("--cnpjs", type=int, default=50)
+    p_mem = sub.add_parser("cvm-memoria", help="Pico de RSS do download CDA (memória x disco)")
+    p_mem.add_argument("--fundos", type=int, default=100)
+    p_mem.add_argument("--por-fundo", type=int, default=3000)
+    p_mem.add_argument("--extra-mb", type=int, default=150,
+                       help="MB de membros não usados no ZIP (tamanho de um mês real)")
+    p_mem.add_argument("--cortes", type=int, default=2,
+                       help="quedas de conexão por arquivo (retomadas via Range)")
+    p_mem.add_argument("--filho", choices=["memoria", "disco"], help=argparse.SUPPRESS)
+    p_mem.add_argument("--url", help=argparse.SUPPRESS)
+    p_mem.add_argument("--cache", help=argparse.SUPPRESS)
+    p_mem.add_argument("--ym", help=argparse.SUPPRESS)
+    p_csv = sub.add_parser("csv-cvm", help="Leitura de CSVs CVM: todas as colunas x esquema")
+    p_csv.add_argument("--linhas", type=int, default=500000, help="linhas do BLC_4")
+    p_csv.add_argument("--fundos-inf", type=int, default=20000, help="fundos no inf_diario")
+    p_filtro = sub.add_parser("filtro-cvm", help="CSVs CVM filtrados por CNPJ na leitura")
+    p_filtro.add_argument("--fundos", type=int, default=60000, help="fundos no inf_diario")
+    p_filtro.add_argument("--cnpjs", type=int, default=300, help="CNPJs de interesse")
+    p_filtro.add_argument("--filho", choices=["antes", "depois"], help=argparse.SUPPRESS)
+    p_filtro.add_argument("--zip", help=argparse.SUPPRESS)
+    p_filtro.add_argument("--tipo", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.alvo == "xml":
+        bench_xml(args.arquivos, args.posicoes)
+    elif args.alvo == "carga-xml":
+        bench_carga_xml(args.arquivos, args.posicoes, args.processos, args.duplicatas, args.compactar)
+    elif args.alvo == "descoberta":
+        bench_descoberta(args.arquivos, args.latencia_ms)
+    elif args.alvo == "espelho":
+        bench_espelho(args.arquivos, args.posicoes)
+    elif args.alvo == "montagem-xml":
+        bench_montagem_xml(args.posicoes, args.por_carteira)
+    elif args.alvo == "cvm":
+        bench_cvm(args.meses, args.fundos, args.latencia_ms, args.falhas, args.workers)
+    elif args.alvo == "cvm-memoria" and args.filho:
+        _medir_download_filho(args.filho, args.url, args.cache, args.ym)
+    elif args.alvo == "cvm-memoria":
+        bench_cvm_memoria(args.fundos, args.por_fundo, args.extra_mb, args.cortes)
+    elif args.alvo == "filtro-cvm" and args.filho:
+        _medir_filtro_filho(args.filho, args.zip, args.tipo, args.cnpjs)
+    elif args.alvo == "filtro-cvm":
+        bench_filtro_cvm(args.fundos, args.cnpjs)
+    elif args.alvo == "csv-cvm":
+        bench_csv_cvm(args.linhas, args.fundos_inf)
+    elif args.alvo == "cda-blocos":
+        bench_cda_blocos(args.meses, args.fundos, args.latencia_ms)
+    elif args.alvo == "indice-cda":
+        bench_indice_cda(args.meses, args.fundos, args.latencia_ms)
+    elif args.alvo == "inf-diario":
+        bench_inf_diario(args.meses, args.fundos, args.cnpjs)
+    elif args.alvo == "cnpj":
+        bench_cnpj(args.linhas, args.fundos, args.cnpjs)
+    elif args.alvo == "blc4":
+        bench_blc4(args.linhas, args.fundos)
+    elif args.alvo == "pl-residuais":
+        bench_pl_residuais(args.cnpjs, args.por_fundo)
+    elif args.alvo == "cache":
+        bench_cache(args.meses, args.fundos, args.cnpjs)
+    elif args.alvo == "revalidacao":
+        bench_revalidacao(args.meses, args.fundos, args.latencia_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Governança do cache da CVM (cache/cvm_*.parquet): uso, compactação e orçamento.
+
+Por mês o cache guarda os blocos do CDA (BLC_1..BLC_8), o PL e o inf_diario.
+Os meses permanentes (mais de CVM_MESES_RECENTES meses) podem ser compactados
+num parquet por dataset e ano, lido mês a mês sem perder o filtro por CNPJ. O
+orçamento (CVM_CACHE_LIMITE_MB, ou a variável de ambiente de mesmo nome) é
+aplicado por LRU depois de cada download; aqui ele pode ser aplicado à mão,
+com outro limite. O índice CNPJ -> meses do CDA (busca sob demanda) é
+atualizado a cada mês baixado; "indexar" inclui os meses que já estavam em
+cache antes dele.
+
+Uso:
+    python cache_cvm.py stats                       # uso por dataset e mês
+    python cache_cvm.py compactar                   # meses antigos -> um parquet por ano
+    python cache_cvm.py liberar                     # aplica CVM_CACHE_LIMITE_MB
+    python cache_cvm.py liberar --limite-mb 4000    # remove os menos usados até caber
+    python cache_cvm.py indexar                     # meses do CDA em cache -> índice de CNPJs
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import data_loader
+
+
+def _tamanho_pasta(pasta: str) -> int:
+    total = 0
+    for raiz, _, arquivos in os.walk(pasta):
+        for nome in arquivos:
+            try:
+                total += os.path.getsize(os.path.join(raiz, nome))
+            except OSError:
+                pass
+    return total
+
+
+def tabela_uso(df):
+    """MB por período (linhas; AAAA = ano compactado) e dataset (colunas)."""
+    tabela = df.pivot_table(index="periodo", columns="dataset", values="bytes",
+                            aggfunc="sum", fill_value=0) / 1e6
+    tabela["total"] = tabela.sum(axis=1)
+    return tabela.sort_index(ascending=False).round(1)
+
+
+def formatar_stats(df) -> str:
+    if df.empty:
+        return f"Nenhum parquet da CVM em {data_loader.CACHE_DIR}"
+    linhas = []
+    limite = data_loader.CVM_CACHE_LIMITE_MB
+    total_cvm = df["bytes"].sum()
+    total_dir = _tamanho_pasta(data_loader.CACHE_DIR)
+    linhas.append(f"Cache da CVM: {total_cvm / 1e6:.1f} MB em {len(df)} arquivos "
+                  f"(limite {f'{limite:.0f} MB' if limite > 0 else 'nenhum'}); "
+                  f"outros arquivos em cache/: {(total_dir - total_cvm) / 1e6:.1f} MB")
+    por_dataset = df.groupby("dataset").agg(arquivos=("arquivo", "size"), mb=("bytes", "sum"),
+                                            acesso=("acesso", "max"))
+    for r in por_dataset.itertuples():
+        linhas.append(f"  {r.Index:<12} {r.mb / 1e6:>9.1f} MB  {r.arquivos:>4} arquivos  "
+                      f"último acesso {time.strftime('%Y-%m-%d %H:%M', time.localtime(r.acesso))}")
+    filtrados = df[df["filtrado"]]
+    if len(filtrados):
+        linhas.append(f"  {len(filtrados)} inf_diario _filtered do formato anterior "
+                      f"({filtrados['bytes'].sum() / 1e6:.1f} MB; removidos por compactar)")
+    linhas.append("")
+    linhas.append("MB por mês (AAAA = ano compactado):")
+    linhas.append(tabela_uso(df).to_string())
+    return "\n".join(linhas)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("stats", help="uso do cache por dataset e mês")
+    sub.add_parser("compactar", help="junta os meses permanentes num parquet por dataset e ano")
+    p_liberar = sub.add_parser("liberar", help="remove os caches menos usados até caber no limite")
+    p_liberar.add_argument("--limite-mb", type=float, default=None,
+                           help=f"padrão: CVM_CACHE_LIMITE_MB ({data_loader.CVM_CACHE_LIMITE_MB:.0f})")
+    sub.add_parser("indexar", help="inclui no índice CNPJ -> meses do CDA os meses já em cache")
+    args = parser.parse_args()
+
+    t0 = time.time()
+    if args.comando == "stats":
+        print(formatar_stats(data_loader.estatisticas_cache_cvm()))
+    elif args.comando == "compactar":
+        resultado = data_loader.compactar_cache_cvm()
+        for nome, r in resultado.items():
+            print(f"  {nome}: {r['compactados']} meses compactados ({r['meses']} no arquivo), "
+                  f"{r['bytes_antes'] / 1e6:.1f} -> {r['bytes_depois'] / 1e6:.1f} MB")
+        if not resultado:
+            print("  Nenhum mês permanente para compactar")
+    elif args.comando == "indexar":
+        print(f"  {data_loader.indexar_cache_cda()} meses do CDA indexados")
+    else:
+        r = data_loader.liberar_cache_cvm(args.limite_mb)
+        print(f"  {r['removidos']} arquivos removidos, {r['bytes_liberados'] / 1e6:.1f} MB liberados, "
+              f"{r['bytes_total'] / 1e6:.1f} MB no cache da CVM")
+    print(f"  -> {time.time()-t0:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
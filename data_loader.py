@@ -11,8 +11,17 @@ from __future__ import annotations
 import os
 import re
 import io
+import time
+import random
 import zipfile
+import shutil
+import tempfile
+import bisect
+import threading
+import functools
 from datetime import datetime, timedelta
+from urllib.parse import urlparse
+from email.utils import parsedate_to_datetime
 from collections import defaultdict
 import xml.etree.ElementTree as ET
 
@@ -34,6 +43,7 @@ XML_MELLON_PATH = r"G:\Drives compartilhados\SisIntegra\AMBIENTE_PRODUCAO\Posica
 CACHE_DIR = os.path.join(_SCRIPT_DIR, "cache")
 CVM_ZIP_URL = "https://dados.cvm.gov.br/dados/FI/DOC/CDA/DADOS/cda_fi_{yyyymm}.zip"
 CVM_BLC4_ZIP_URL = "https://dados.cvm.gov.br/dados/FI/DOC/CDA/DADOS/cda_fi_BLC_4_{yyyymm}.zip"
+CVM_BLC_ZIP_URL = "https://dados.cvm.gov.br/dados/FI/DOC/CDA/DADOS/cda_fi_BLC_{blc_num}_{yyyymm}.zip"
 CVM_INF_DIARIO_URL = "https://dados.cvm.gov.br/dados/FI/DOC/INF_DIARIO/DADOS/inf_diario_fi_{yyyymm}.zip"
 
 BENCHMARK_CNPJS = {
@@ -62,6 +72,50 @@ def _normalizar_cnpj(cnpj: str) -> str:
     return re.sub(r'\D', '', str(cnpj)).zfill(14)
 
 
+def _cnpjs_arrow(valores, inteiro: bool = False):
+    """_normalizar_cnpj sobre um array do pyarrow. A expressão regular roda só
+    nos CNPJs distintos: num mês do CDA cada fundo se repete milhares de vezes.
+    inteiro=True: chaves int64 (CNPJ inválido vira 0)."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    if isinstance(valores, pa.ChunkedArray):
+        valores = valores.combine_chunks()
+    codigos = pc.dictionary_encode(pc.fill_null(valores, ""))
+    digitos = pc.utf8_lpad(pc.replace_substring_regex(codigos.dictionary, r"\D", ""), 14, "0")
+    if inteiro:
+        valido = pc.equal(pc.utf8_length(digitos), 14)
+        digitos = pc.cast(pc.if_else(valido, digitos, "0"), pa.int64())
+    return digitos.take(codigos.indices)
+
+
+def _cnpjs_normalizados(serie: pd.Series, inteiro: bool = False) -> pd.Series:
+    """_normalizar_cnpj vetorizado (só dígitos, 14 posições).
+
+    inteiro=True devolve chaves int64 (14 dígitos cabem) em vez de strings:
+    o merge/groupby por CNPJ numa tabela grande fica bem mais rápido.
+    """
+    import pyarrow as pa
+    if serie.dtype != "str":
+        serie = serie.fillna("").astype(str)
+    norm = _cnpjs_arrow(pa.array(serie), inteiro)
+    # set_axis, não pd.Series(..., index=): o construtor reindexaria pelos rótulos
+    return norm.to_pandas().set_axis(serie.index).rename(serie.name)
+
+
+def _cnpj_int(cnpj: str) -> int:
+    """Chave int64 de um CNPJ (ver _cnpjs_normalizados(..., inteiro=True))."""
+    norm = _normalizar_cnpj(cnpj)
+    return int(norm) if len(norm) == 14 and norm.isdigit() else 0
+
+
+def _coluna_cnpj_norm(df: pd.DataFrame, cnpj_col: str) -> pd.Series:
+    """cnpj_norm do DataFrame: o dos caches da CVM (normalizado na leitura do
+    CSV, da mesma coluna CNPJ_FUNDO_CLASSE/CNPJ_FUNDO) ou calculado."""
+    if "cnpj_norm" in df.columns:
+        return df["cnpj_norm"]
+    return _cnpjs_normalizados(df[cnpj_col])
+
+
 # ──────────────────────────────────────────────────────────────────────────────
 # Fundos TAG adicionais (custódia Mellon — não estão na Base Geral)
 # ──────────────────────────────────────────────────────────────────────────────
@@ -147,9 +201,8 @@ def carregar_fundos_rv() -> pd.DataFrame:
 # ──────────────────────────────────────────────────────────────────────────────
 # Detectar formato XML
 # ──────────────────────────────────────────────────────────────────────────────
-def _detect_xml_format(filepath: str) -> str:
-    with open(filepath, "r", encoding="utf-8", errors="ignore") as f:
-        head = f.read(1000)
+def _formato_xml(head: str) -> str:
+    """Formato a partir dos primeiros 1000 caracteres do arquivo."""
     if "arquivoposicao_4_01" in head:
         return "old"
     if "GalgoAssBalStmt" in head or "semt.003.001" in head:
@@ -157,63 +210,117 @@ def _detect_xml_format(filepath: str) -> str:
     return "unknown"
 
 
+def _detect_xml_format(filepath: str) -> str:
+    with open(filepath, "r", encoding="utf-8", errors="ignore") as f:
+        head = f.read(1000)
+    return _formato_xml(head)
+
+
 # ──────────────────────────────────────────────────────────────────────────────
 # Parse XML formato antigo (arquivoposicao_4_01)
 # ──────────────────────────────────────────────────────────────────────────────
-def _parse_xml_old(filepath: str) -> dict | None:
-    try:
-        tree = ET.parse(filepath)
-        root = tree.getroot()
-        fundo = root.find("fundo")
-        if fundo is None:
-            return None
-        header = fundo.find("header")
-        if header is None:
-            return None
+# Os parsers usam ET.iterparse: cada bloco (<acoes>, <BalForSubAcct>, ...) é
+# convertido assim que fecha e removido da árvore, então a memória não cresce
+# com o tamanho do arquivo. A semântica é a mesma de find/findall na árvore
+# completa: só o primeiro <fundo> conta e a ordem de saída é por tipo de bloco.
+def _old_acao(el: ET.Element) -> dict | None:
+    cod = el.findtext("codativo", "")
+    valor = float(el.findtext("valorfindisp", "0") or "0")
+    if cod and valor > 0:
+        return {"ativo": cod.strip().upper(), "valor": valor, "tipo": "acao"}
+    return None
+
+
+def _old_cota(el: ET.Element) -> dict | None:
+    # Cotas de fundos investidos (qtd * pu quando valorfindisp=0)
+    cnpj_fundo_inv = el.findtext("cnpjfundo", "")
+    isin = el.findtext("isin", "")
+    valorfindisp = float(el.findtext("valorfindisp", "0") or "0")
+    qtd = float(el.findtext("qtdisponivel", "0") or "0")
+    pu = float(el.findtext("puposicao", "0") or "0")
+    valor = valorfindisp if valorfindisp > 0 else qtd * pu
+    if valor > 0:
+        nome = f"FUNDO {cnpj_fundo_inv}" if cnpj_fundo_inv else isin
+        return {"ativo": nome, "valor": valor, "tipo": "cota",
+                "cnpj_investido": cnpj_fundo_inv, "isin": isin}
+    return None
+
+
+def _old_titpublico(el: ET.Element) -> dict | None:
+    cod = el.findtext("codativo", "")
+    isin = el.findtext("isin", "")
+    venc = el.findtext("dtvencimento", "")
+    valor = float(el.findtext("valorfindisp", "0") or "0")
+    if valor > 0:
+        nome = f"TITPUB {isin}" if isin else f"TITPUB {cod}"
+        if venc:
+            nome += f" ({venc[:4]})"
+        return {"ativo": nome, "valor": valor, "tipo": "titpublico"}
+    return None
+
+
+def _old_caixa(el: ET.Element) -> dict | None:
+    saldo = float(el.findtext("saldo", "0") or "0")
+    if saldo > 0:
+        return {"ativo": "CAIXA", "valor": saldo, "tipo": "caixa"}
+    return None
+
+
+# Ordem de saída: ações, cotas, títulos públicos, caixa
+_OLD_BLOCOS = {
+    "acoes": _old_acao,
+    "cotas": _old_cota,
+    "titpublico": _old_titpublico,
+    "caixa": _old_caixa,
+}
 
-        cnpj = _normalizar_cnpj(header.findtext("cnpj", ""))
-        dt_str = header.findtext("dtposicao", "")
-        pl = float(header.findtext("patliq", "0") or "0")
-        dt = datetime.strptime(dt_str, "%Y%m%d") if dt_str else None
-
-        acoes = []
-        for acao in fundo.findall("acoes"):
-            cod = acao.findtext("codativo", "")
-            valor = float(acao.findtext("valorfindisp", "0") or "0")
-            if cod and valor > 0:
-                acoes.append({"ativo": cod.strip().upper(), "valor": valor, "tipo": "acao"})
-
-        # Cotas de fundos investidos (qtd * pu quando valorfindisp=0)
-        for cota in fundo.findall("cotas"):
-            cnpj_fundo_inv = cota.findtext("cnpjfundo", "")
-            isin = cota.findtext("isin", "")
-            valorfindisp = float(cota.findtext("valorfindisp", "0") or "0")
-            qtd = float(cota.findtext("qtdisponivel", "0") or "0")
-            pu = float(cota.findtext("puposicao", "0") or "0")
-            valor = valorfindisp if valorfindisp > 0 else qtd * pu
-            if valor > 0:
-                nome = f"FUNDO {cnpj_fundo_inv}" if cnpj_fundo_inv else isin
-                acoes.append({"ativo": nome, "valor": valor, "tipo": "cota",
-                              "cnpj_investido": cnpj_fundo_inv, "isin": isin})
-
-        # Títulos públicos
-        for tp in fundo.findall("titpublico"):
-            cod = tp.findtext("codativo", "")
-            isin = tp.findtext("isin", "")
-            venc = tp.findtext("dtvencimento", "")
-            valor = float(tp.findtext("valorfindisp", "0") or "0")
-            if valor > 0:
-                nome = f"TITPUB {isin}" if isin else f"TITPUB {cod}"
-                if venc:
-                    nome += f" ({venc[:4]})"
-                acoes.append({"ativo": nome, "valor": valor, "tipo": "titpublico"})
-
-        # Caixa
-        for cx in fundo.findall("caixa"):
-            saldo = float(cx.findtext("saldo", "0") or "0")
-            if saldo > 0:
-                acoes.append({"ativo": "CAIXA", "valor": saldo, "tipo": "caixa"})
 
+def _parse_xml_old(filepath: str | io.IOBase, somente_cabecalho: bool = False) -> dict | None:
+    """Parse incremental do formato antigo. Aceita path ou arquivo binário.
+
+    somente_cabecalho: para de ler ao fechar o <header> (acoes fica vazia).
+    """
+    try:
+        pilha = []
+        fundo = None
+        header = None
+        blocos = {tag: [] for tag in _OLD_BLOCOS}
+
+        for evento, el in ET.iterparse(filepath, events=("start", "end")):
+            if evento == "start":
+                if len(pilha) == 1 and fundo is None and el.tag == "fundo":
+                    fundo = el
+                pilha.append(el)
+                continue
+
+            pilha.pop()
+            pai = pilha[-1] if pilha else None
+            if pai is None:
+                continue
+            if somente_cabecalho and el is fundo:
+                break
+            if pai is fundo:
+                if el.tag == "header":
+                    if header is None:
+                        cnpj = _normalizar_cnpj(el.findtext("cnpj", ""))
+                        dt_str = el.findtext("dtposicao", "")
+                        pl = float(el.findtext("patliq", "0") or "0")
+                        dt = datetime.strptime(dt_str, "%Y%m%d") if dt_str else None
+                        header = (cnpj, dt, pl)
+                        if somente_cabecalho:
+                            break
+                elif el.tag in _OLD_BLOCOS:
+                    item = _OLD_BLOCOS[el.tag](el)
+                    if item is not None:
+                        blocos[el.tag].append(item)
+                pai.remove(el)
+            elif len(pilha) == 1 and el is not fundo:
+                pai.remove(el)
+
+        if fundo is None or header is None:
+            return None
+        cnpj, dt, pl = header
+        acoes = [item for tag in _OLD_BLOCOS for item in blocos[tag]]
         return {"cnpj": cnpj, "data": dt, "pl": pl, "acoes": acoes}
     except Exception:
         return None
@@ -222,157 +329,510 @@ def _parse_xml_old(filepath: str) -> dict | None:
 # ──────────────────────────────────────────────────────────────────────────────
 # Parse XML formato novo (ISO 20022 / Galgo)
 # ──────────────────────────────────────────────────────────────────────────────
-def _parse_xml_new(filepath: str) -> dict | None:
+_NS_XML = {"g": NS_GALGO, "d": NS_DOC}
+_TAG_BSNS = f"{{{NS_GALGO}}}BsnsMsg"
+_TAG_DOC = f"{{{NS_DOC}}}Document"
+_TAG_RPT = f"{{{NS_DOC}}}SctiesBalAcctgRpt"
+_TAG_GNL = f"{{{NS_DOC}}}StmtGnlDtls"
+_TAG_BAL = f"{{{NS_DOC}}}BalForAcct"
+_TAG_SUB = f"{{{NS_DOC}}}BalForSubAcct"
+_TAG_SAD = f"{{{NS_DOC}}}SubAcctDtls"
+
+
+def _galgo_cabecalho(bal_acct: ET.Element) -> tuple[str, str]:
+    """CNPJ e texto do PL do fundo a partir do BalForAcct."""
+    ns = _NS_XML
+    cnpj = ""
+    fin_id = bal_acct.find("d:FinInstrmId", ns)
+    if fin_id is not None:
+        for othr in fin_id.findall("d:OthrId", ns):
+            tp_cd = othr.findtext("d:Tp/d:Cd", "", ns)
+            if tp_cd == "CNPJ":
+                cnpj = _normalizar_cnpj(othr.findtext("d:Id", "", ns))
+                break
+
+    pl_text = ""
+    acct_amts = bal_acct.find("d:AcctBaseCcyAmts", ns)
+    if acct_amts is not None:
+        amt_el = acct_amts.find("d:HldgVal/d:Amt", ns)
+        if amt_el is not None:
+            pl_text = amt_el.text or ""
+    return cnpj, pl_text
+
+
+def _galgo_posicao(sub: ET.Element) -> dict | None:
+    """Converte um BalForSubAcct em posição (só ações diretas LONG)."""
+    ns = _NS_XML
+    fin = sub.find("d:FinInstrmId", ns)
+    if fin is None:
+        return None
+
+    # Verificar se é ação direta (EQUI na TABELA NIVEL 1, sem ser LOAN)
+    ticker = ""
+    is_equi = False
+    is_loan = False
+    for othr in fin.findall("d:OthrId", ns):
+        tp_cd = othr.findtext("d:Tp/d:Cd", "", ns)
+        tp_prtry = othr.findtext("d:Tp/d:Prtry", "", ns)
+        id_val = othr.findtext("d:Id", "", ns)
+
+        if tp_cd == "BVMF":
+            ticker = id_val.strip().upper()
+        if tp_prtry == "TABELA NIVEL 1" and id_val == "EQUI":
+            is_equi = True
+        if tp_prtry == "TABELA NIVEL 1" and id_val == "LOAN":
+            is_loan = True
+        if tp_prtry == "CONTRATO BTC":
+            is_loan = True
+
+    if not ticker or not is_equi or is_loan:
+        return None
+
+    # Verificar LONG
+    lng = sub.findtext("d:AggtBal/d:ShrtLngInd", "", ns)
+    if lng != "LONG":
+        return None
+
+    # Valor
+    sub_amts = sub.find("d:AcctBaseCcyAmts", ns)
+    if sub_amts is None:
+        return None
+    amt_el = sub_amts.find("d:HldgVal/d:Amt", ns)
+    valor = float(amt_el.text) if amt_el is not None and amt_el.text else 0.0
+
+    if valor > 0:
+        return {"ativo": ticker, "valor": valor}
+    return None
+
+
+def _parse_xml_new(filepath: str | io.IOBase, somente_cabecalho: bool = False) -> dict | None:
+    """Parse incremental do formato Galgo. Aceita path ou arquivo binário.
+
+    Navega BsnsMsg/Document/SctiesBalAcctgRpt (primeiro de cada). Posições
+    vêm de BalForSubAcct direto no relatório e dentro de SubAcctDtls.
+    somente_cabecalho: para de ler assim que data e BalForAcct são conhecidos.
+    """
     try:
-        tree = ET.parse(filepath)
-        root = tree.getroot()
+        pilha = []
+        bsns = doc = rpt = None
+        dt_text = None
+        cabecalho = None
+        subs_diretos = []
+        subs_detalhe = []
+
+        for evento, el in ET.iterparse(filepath, events=("start", "end")):
+            if evento == "start":
+                nivel = len(pilha)
+                if nivel == 1 and bsns is None and el.tag == _TAG_BSNS:
+                    bsns = el
+                elif nivel == 2 and doc is None and pilha[-1] is bsns and el.tag == _TAG_DOC:
+                    doc = el
+                elif nivel == 3 and rpt is None and pilha[-1] is doc and el.tag == _TAG_RPT:
+                    rpt = el
+                pilha.append(el)
+                continue
 
-        ns = {"g": NS_GALGO, "d": NS_DOC}
+            pilha.pop()
+            pai = pilha[-1] if pilha else None
+            if pai is None:
+                continue
+            if somente_cabecalho and el is rpt:
+                break
+            if rpt is not None and pai is rpt:
+                if el.tag == _TAG_GNL:
+                    if dt_text is None:
+                        dt_text = el.findtext("d:StmtDtTm/d:Dt", None, _NS_XML)
+                elif el.tag == _TAG_BAL:
+                    if cabecalho is None:
+                        cabecalho = _galgo_cabecalho(el)
+                elif el.tag == _TAG_SUB:
+                    pos = _galgo_posicao(el)
+                    if pos is not None:
+                        subs_diretos.append(pos)
+                pai.remove(el)
+                if somente_cabecalho and cabecalho is not None and dt_text is not None:
+                    break
+            elif (rpt is not None and len(pilha) == 5 and pilha[-2] is rpt
+                  and pai.tag == _TAG_SAD):
+                if el.tag == _TAG_SUB:
+                    pos = _galgo_posicao(el)
+                    if pos is not None:
+                        subs_detalhe.append(pos)
+                pai.remove(el)
+            elif len(pilha) <= 3 and el is not bsns and el is not doc and el is not rpt:
+                pai.remove(el)
 
-        # Navegar: BsnsMsg/Document/SctiesBalAcctgRpt
-        bsns = root.find("g:BsnsMsg", ns)
-        if bsns is None:
-            return None
-        doc = bsns.find("d:Document", ns)
-        if doc is None:
-            return None
-        rpt = doc.find("d:SctiesBalAcctgRpt", ns)
         if rpt is None:
             return None
-
-        # Data
-        dt_text = rpt.findtext("d:StmtGnlDtls/d:StmtDtTm/d:Dt", "", ns)
         dt = datetime.strptime(dt_text, "%Y-%m-%d") if dt_text else None
-
-        # PL e CNPJ do fundo: BalForAcct
-        bal_acct = rpt.find("d:BalForAcct", ns)
-        if bal_acct is None:
+        if cabecalho is None:
             return None
+        cnpj, pl_text = cabecalho
+        pl = float(pl_text) if pl_text else 0.0
+        return {"cnpj": cnpj, "data": dt, "pl": pl, "acoes": subs_diretos + subs_detalhe}
+    except Exception:
+        return None
 
-        # CNPJ do fundo
-        cnpj = ""
-        fin_id = bal_acct.find("d:FinInstrmId", ns)
-        if fin_id is not None:
-            for othr in fin_id.findall("d:OthrId", ns):
-                tp_cd = othr.findtext("d:Tp/d:Cd", "", ns)
-                if tp_cd == "CNPJ":
-                    cnpj = _normalizar_cnpj(othr.findtext("d:Id", "", ns))
-                    break
 
-        # PL
-        pl_text = ""
-        acct_amts = bal_acct.find("d:AcctBaseCcyAmts", ns)
-        if acct_amts is not None:
-            amt_el = acct_amts.find("d:HldgVal/d:Amt", ns)
-            if amt_el is not None:
-                pl_text = amt_el.text or ""
-        pl = float(pl_text) if pl_text else 0.0
+# ──────────────────────────────────────────────────────────────────────────────
+# Índice das pastas de XML (mtime da pasta -> nomes já listados)
+# ──────────────────────────────────────────────────────────────────────────────
+# listdir no drive compartilhado é lento e quase todas as pastas (meses
+# fechados, dias antigos do Mellon) não mudam entre execuções. O mtime de uma
+# pasta muda quando um arquivo é criado, removido ou renomeado nela, então um
+# stat basta para saber se a listagem anterior ainda vale.
+def _xml_indice_pastas_path() -> str:
+    return os.path.join(CACHE_DIR, "xml_indice_pastas.parquet")
 
-        # Posições em ações: BalForSubAcct (dentro de SubAcctDtls)
-        acoes = []
-        all_subs = []
-        # Podem estar direto no rpt ou dentro de SubAcctDtls
-        all_subs.extend(rpt.findall("d:BalForSubAcct", ns))
-        for sad in rpt.findall("d:SubAcctDtls", ns):
-            all_subs.extend(sad.findall("d:BalForSubAcct", ns))
-
-        for sub in all_subs:
-            fin = sub.find("d:FinInstrmId", ns)
-            if fin is None:
-                continue
 
-            # Verificar se é ação direta (EQUI na TABELA NIVEL 1, sem ser LOAN)
-            ticker = ""
-            is_equi = False
-            is_loan = False
-            for othr in fin.findall("d:OthrId", ns):
-                tp_cd = othr.findtext("d:Tp/d:Cd", "", ns)
-                tp_prtry = othr.findtext("d:Tp/d:Prtry", "", ns)
-                id_val = othr.findtext("d:Id", "", ns)
-
-                if tp_cd == "BVMF":
-                    ticker = id_val.strip().upper()
-                if tp_prtry == "TABELA NIVEL 1" and id_val == "EQUI":
-                    is_equi = True
-                if tp_prtry == "TABELA NIVEL 1" and id_val == "LOAN":
-                    is_loan = True
-                if tp_prtry == "CONTRATO BTC":
-                    is_loan = True
-
-            if not ticker or not is_equi or is_loan:
-                continue
+_VARREDURA_XML = {"pastas": 0, "listadas": 0}  # contadores da última descoberta
+
+
+def _carregar_indice_pastas() -> dict:
+    """Retorna {pasta: (mtime_ns, [nomes])} da última varredura."""
+    try:
+        df = pd.read_parquet(_xml_indice_pastas_path())
+    except Exception:
+        return {}
+    indice = {}
+    for pasta, mtime_ns, nome in zip(df["pasta"], df["mtime_ns"], df["nome"]):
+        nomes = indice.setdefault(pasta, (int(mtime_ns), []))[1]
+        if nome:
+            nomes.append(nome)
+    return indice
+
+
+def _salvar_indice_pastas(indice: dict) -> None:
+    """Persiste o índice (uma linha por nome; pasta vazia -> nome "")."""
+    linhas = [(pasta, mtime_ns, nome)
+              for pasta, (mtime_ns, nomes) in indice.items()
+              for nome in (nomes or [""])]
+    df = pd.DataFrame(linhas, columns=["pasta", "mtime_ns", "nome"])
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        df.to_parquet(_xml_indice_pastas_path(), index=False)
+    except Exception:
+        pass
+
+
+def _consolidar_indice_pastas(anterior: dict, atual: dict, raizes: tuple) -> dict:
+    """Índice a salvar: pastas visitadas agora + as não visitadas (podadas
+    pela janela de datas) que ainda constam na listagem da pasta-pai."""
+    indice = {**anterior, **atual}
+    vivas = {}
+    for pasta in sorted(indice, key=len):  # pais antes dos filhos
+        pai, nome = os.path.split(pasta)
+        if pasta in raizes or (pai in vivas and nome in vivas[pai][1]):
+            vivas[pasta] = indice[pasta]
+    return vivas
+
+
+def _listar_pasta(pasta: str, filtro, anterior: dict, atual: dict,
+                  listar=os.listdir) -> list[str]:
+    """Nomes da pasta aceitos por filtro(pasta, nome).
+
+    Se o mtime da pasta é o mesmo do índice anterior, reaproveita a listagem
+    (só um stat). O mtime é lido antes do listdir: uma mudança durante a
+    listagem aparece como pasta alterada na próxima execução. listar: para
+    um mês compactado, _listar_membros_zip (o zip só é aberto se mudou).
+    """
+    try:
+        mtime_ns = os.stat(pasta).st_mtime_ns
+    except OSError:
+        return []
+    _VARREDURA_XML["pastas"] += 1
+    entrada = anterior.get(pasta)
+    if entrada is not None and entrada[0] == mtime_ns:
+        nomes = entrada[1]
+    else:
+        try:
+            nomes = [n for n in listar(pasta) if filtro(pasta, n)]
+        except (OSError, zipfile.BadZipFile):
+            return []
+        _VARREDURA_XML["listadas"] += 1
+    atual[pasta] = (mtime_ns, nomes)
+    return nomes
+
+
+def _eh_xml(pasta: str, nome: str) -> bool:
+    return nome.lower().endswith(".xml") and not nome.startswith("~")
+
+
+def _eh_subpasta(pasta: str, nome: str) -> bool:
+    return os.path.isdir(os.path.join(pasta, nome))
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Meses compactados (AAAA/MM.zip no lugar da pasta AAAA/MM)
+# ──────────────────────────────────────────────────────────────────────────────
+# Um mês fechado compactado vira um único arquivo no drive. Os XMLs dentro do
+# zip são tratados como arquivos de uma pasta: o path de um membro é
+# "AAAA/MM.zip/<nome>.xml", e listagem, janela de datas, agrupamento e parse
+# funcionam igual. A leitura é feita direto do membro (sem extrair) e o zip
+# fica aberto enquanto os membros são lidos: uma abertura por mês.
+_ZIPS_ABERTOS = {}  # zip_path -> (pid, ZipFile); por processo (fd não é compartilhável após fork)
+_MAX_ZIPS_ABERTOS = 4
+
+
+def _membro_zip(path: str) -> tuple[str, str] | None:
+    """(zip_path, nome do membro) se path aponta para dentro de um .zip."""
+    i = path.lower().find(".zip" + os.sep)
+    if i < 0:
+        return None
+    return path[:i + 4], path[i + 5:].replace(os.sep, "/")
+
+
+def _abrir_zip(zip_path: str) -> tuple[zipfile.ZipFile, int]:
+    """ZipFile já aberto neste processo (ou abre agora). Retorna (zip, aberturas)."""
+    entrada = _ZIPS_ABERTOS.get(zip_path)
+    if entrada is not None and entrada[0] == os.getpid():
+        return entrada[1], 0
+    if len(_ZIPS_ABERTOS) >= _MAX_ZIPS_ABERTOS:
+        _fechar_zips()
+    zf = zipfile.ZipFile(zip_path)
+    _ZIPS_ABERTOS[zip_path] = (os.getpid(), zf)
+    return zf, 1
+
+
+def _fechar_zips() -> None:
+    for pid, zf in _ZIPS_ABERTOS.values():
+        if pid == os.getpid():
+            zf.close()
+    _ZIPS_ABERTOS.clear()
+
+
+def _abrir_xml(path: str):
+    """Abre um XML solto ou membro de zip.
+
+    Retorna (arquivo, aberturas no drive, bytes comprimidos | None).
+    """
+    membro = _membro_zip(path)
+    if membro is None:
+        return open(path, "rb"), 1, None
+    zf, aberturas = _abrir_zip(membro[0])
+    info = zf.getinfo(membro[1])
+    return zf.open(info), aberturas, info.compress_size
+
+
+def _listar_membros_zip(zip_path: str) -> list[str]:
+    with zipfile.ZipFile(zip_path) as zf:
+        return [n.replace("/", os.sep) for n in zf.namelist() if not n.endswith("/")]
 
-            # Verificar LONG
-            lng = sub.findtext("d:AggtBal/d:ShrtLngInd", "", ns)
-            if lng != "LONG":
-                continue
 
-            # Valor
-            sub_amts = sub.find("d:AcctBaseCcyAmts", ns)
-            if sub_amts is None:
+def _eh_mes(pasta: str, nome: str) -> bool:
+    return nome.lower().endswith(".zip") or _eh_subpasta(pasta, nome)
+
+
+def compactar_mes_xml(mes_path: str, remover_soltos: bool = True) -> dict:
+    """Compacta a pasta AAAA/MM em AAAA/MM.zip (deflate).
+
+    Se o zip já existe, os XMLs soltos (chegadas tardias) são incorporados e
+    substituem membros de mesmo nome. O zip é escrito em .tmp, verificado e só
+    então renomeado; com remover_soltos, os XMLs que foram para o zip (e não
+    mudaram durante a compactação) são apagados da pasta.
+    Retorna {"arquivos", "bytes_soltos", "bytes_zip", "removidos"}.
+    """
+    zip_path = mes_path.rstrip("\\/") + ".zip"
+    stats = {"arquivos": 0, "bytes_soltos": 0, "bytes_zip": 0, "removidos": 0}
+    try:
+        soltos = {f: os.stat(os.path.join(mes_path, f))
+                  for f in os.listdir(mes_path) if _eh_xml(mes_path, f)}
+    except OSError:
+        return stats
+    if not soltos:
+        return stats
+
+    tmp_path = zip_path + ".tmp"
+    with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as novo:
+        if os.path.exists(zip_path):
+            with zipfile.ZipFile(zip_path) as antigo:
+                for info in antigo.infolist():
+                    if info.filename not in soltos:
+                        novo.writestr(info, antigo.read(info))
+                        stats["arquivos"] += 1
+        for nome, info in sorted(soltos.items()):
+            novo.write(os.path.join(mes_path, nome), arcname=nome)
+            stats["arquivos"] += 1
+            stats["bytes_soltos"] += info.st_size
+    with zipfile.ZipFile(tmp_path) as verificar:
+        if verificar.testzip() is not None:
+            os.remove(tmp_path)
+            raise zipfile.BadZipFile(f"Falha ao verificar {tmp_path}")
+    _fechar_zips()
+    os.replace(tmp_path, zip_path)
+    stats["bytes_zip"] = os.path.getsize(zip_path)
+
+    if remover_soltos:
+        for nome, info in soltos.items():
+            path = os.path.join(mes_path, nome)
+            try:
+                atual = os.stat(path)
+                if (atual.st_size, atual.st_mtime_ns) == (info.st_size, info.st_mtime_ns):
+                    os.remove(path)
+                    stats["removidos"] += 1
+            except OSError:
+                pass
+        try:
+            os.rmdir(mes_path)
+        except OSError:
+            pass
+    return stats
+
+
+def compactar_meses_fechados(meses_abertos: int = 2, remover_soltos: bool = True) -> dict:
+    """Compacta as pastas de mês de XML_BASE_PATH anteriores aos últimos
+    meses_abertos meses (o mês corrente conta como 1). Retorna {mes_path: stats}.
+
+    Opcional (export_data.py --compactar-xml): no drive de rede o mês vira
+    uma abertura e ~1/18 dos bytes; em disco local não há ganho de E/S e a
+    descompressão custa CPU (na mesma ordem do parse, ver benchmark.py
+    carga-xml --compactar), então num espelho local pode não compensar.
+    """
+    hoje = datetime.now()
+    limite = hoje.year * 12 + hoje.month - meses_abertos  # último mês considerado fechado
+    resultado = {}
+    if not os.path.exists(XML_BASE_PATH):
+        return resultado
+    for ano in sorted(d for d in os.listdir(XML_BASE_PATH) if d.isdigit() and len(d) == 4):
+        ano_path = os.path.join(XML_BASE_PATH, ano)
+        try:
+            meses = sorted(os.listdir(ano_path))
+        except OSError:
+            continue
+        for mes in meses:
+            m = re.match(r'(\d{1,2})(?!\d)', mes)
+            mes_path = os.path.join(ano_path, mes)
+            if not m or not os.path.isdir(mes_path) or int(ano) * 12 + int(m.group(1)) > limite:
                 continue
-            amt_el = sub_amts.find("d:HldgVal/d:Amt", ns)
-            valor = float(amt_el.text) if amt_el is not None and amt_el.text else 0.0
+            stats = compactar_mes_xml(mes_path, remover_soltos)
+            if stats["arquivos"]:
+                resultado[mes_path] = stats
+    return resultado
 
-            if valor > 0:
-                acoes.append({"ativo": ticker, "valor": valor})
 
-        return {"cnpj": cnpj, "data": dt, "pl": pl, "acoes": acoes}
-    except Exception:
+# ──────────────────────────────────────────────────────────────────────────────
+# Janela de datas (poda de pastas/arquivos antes de qualquer leitura)
+# ──────────────────────────────────────────────────────────────────────────────
+# A data no nome (pasta AAAA/MM, prefixo AAAAMMDD_, pasta do Mellon) pode
+# diferir alguns dias do dtposicao do conteúdo: a poda pelo nome usa uma folga
+# e o corte exato é feito depois, sobre a data parseada.
+_FOLGA_JANELA_XML = timedelta(days=7)
+
+
+def _janela_xml(data_inicio=None, data_fim=None) -> tuple | None:
+    """(inicio, fim) como Timestamps (fim inclusivo no dia), ou None sem janela."""
+    if data_inicio is None and data_fim is None:
+        return None
+    inicio = pd.Timestamp(data_inicio).normalize() if data_inicio is not None else None
+    fim = pd.Timestamp(data_fim).normalize() if data_fim is not None else None
+    return inicio, fim
+
+
+def _na_janela(data, janela: tuple | None) -> bool:
+    """Corte exato sobre a data do conteúdo do XML."""
+    if janela is None:
+        return True
+    inicio, fim = janela
+    return (inicio is None or data >= inicio) and (fim is None or data <= fim)
+
+
+def _periodo_fora_da_janela(inicio_periodo, fim_periodo, janela: tuple | None) -> bool:
+    """True se [inicio_periodo, fim_periodo] (data do nome) está fora da janela + folga."""
+    if janela is None:
+        return False
+    inicio, fim = janela
+    return ((inicio is not None and fim_periodo + _FOLGA_JANELA_XML < inicio)
+            or (fim is not None and inicio_periodo - _FOLGA_JANELA_XML > fim))
+
+
+def _data_no_nome(nome: str) -> datetime | None:
+    """Data AAAAMMDD isolada no nome (prefixo do formato antigo, sufixo Galgo, pasta Mellon)."""
+    m = re.search(r'(?<!\d)(\d{8})(?!\d)', nome)
+    if not m:
         return None
+    try:
+        return datetime.strptime(m.group(1), "%Y%m%d")
+    except ValueError:
+        return None
+
+
+def _nome_fora_da_janela(nome: str, janela: tuple | None) -> bool:
+    data = _data_no_nome(nome) if janela is not None else None
+    return data is not None and _periodo_fora_da_janela(data, data, janela)
+
+
+def _mes_fora_da_janela(ano: str, mes: str, janela: tuple | None) -> bool:
+    """Pasta AAAA/MM fora da janela (nomes de mês não numéricos nunca são podados)."""
+    m = re.match(r'(\d{1,2})(?!\d)', mes)
+    if janela is None or not m or not 1 <= int(m.group(1)) <= 12:
+        return False
+    inicio_mes = datetime(int(ano), int(m.group(1)), 1)
+    fim_mes = (inicio_mes + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return _periodo_fora_da_janela(inicio_mes, fim_mes, janela)
 
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Descobrir e mapear XMLs por CNPJ
 # ──────────────────────────────────────────────────────────────────────────────
-def _listar_xmls() -> list[str]:
-    """Lista todos os XMLs da pasta de fechamento (otimizado para rede)."""
+def _listar_xmls(anterior: dict | None = None, atual: dict | None = None,
+                 janela: tuple | None = None) -> list[str]:
+    """Lista todos os XMLs da pasta de fechamento (otimizado para rede).
+
+    anterior/atual: índice de pastas (_listar_pasta); sem índice, lista tudo.
+    janela: (inicio, fim) de _janela_xml; anos, meses e arquivos AAAAMMDD_
+    fora dela nem são listados/lidos.
+    """
+    anterior = {} if anterior is None else anterior
+    atual = {} if atual is None else atual
     xmls = []
     if not os.path.exists(XML_BASE_PATH):
         return xmls
     # Iterar por ano -> mês (evita walk profundo)
-    try:
-        anos = [d for d in os.listdir(XML_BASE_PATH) if d.isdigit() and len(d) == 4]
-    except OSError:
-        return xmls
+    anos = _listar_pasta(XML_BASE_PATH, lambda p, d: d.isdigit() and len(d) == 4, anterior, atual)
     for ano in sorted(anos):
-        ano_path = os.path.join(XML_BASE_PATH, ano)
-        try:
-            meses = os.listdir(ano_path)
-        except OSError:
+        if _periodo_fora_da_janela(datetime(int(ano), 1, 1), datetime(int(ano), 12, 31), janela):
             continue
-        for mes in sorted(meses):
-            mes_path = os.path.join(ano_path, mes)
-            if not os.path.isdir(mes_path):
-                continue
-            try:
-                for f in os.listdir(mes_path):
-                    if f.lower().endswith(".xml") and not f.startswith("~"):
-                        xmls.append(os.path.join(mes_path, f))
-            except OSError:
+        ano_path = os.path.join(XML_BASE_PATH, ano)
+        # Mês compactado (MM.zip) e pasta solta (MM) convivem: o arquivo solto
+        # de mesmo nome (chegada tardia/reprocessamento) vence o membro do zip
+        por_mes = {}
+        for mes in sorted(_listar_pasta(ano_path, _eh_mes, anterior, atual),
+                          key=lambda m: not m.lower().endswith(".zip")):
+            if _mes_fora_da_janela(ano, mes, janela):
                 continue
+            mes_path = os.path.join(ano_path, mes)
+            compactado = mes.lower().endswith(".zip")
+            arquivos = por_mes.setdefault(mes[:-4] if compactado else mes, {})
+            nomes = _listar_pasta(mes_path, _eh_xml, anterior, atual,
+                                  _listar_membros_zip if compactado else os.listdir)
+            for f in nomes:
+                if not _nome_fora_da_janela(f, janela):
+                    arquivos[os.path.basename(f)] = os.path.join(mes_path, f)
+        for mes in sorted(por_mes):
+            xmls.extend(por_mes[mes].values())
     return xmls
 
 
-def _listar_xmls_mellon() -> list[str]:
+def _listar_xmls_mellon(anterior: dict | None = None, atual: dict | None = None,
+                        janela: tuple | None = None) -> list[str]:
     """Lista XMLs da pasta Mellon (estrutura YYYYMMDD/arquivos)."""
+    anterior = {} if anterior is None else anterior
+    atual = {} if atual is None else atual
     xmls = []
     if not os.path.exists(XML_MELLON_PATH):
         return xmls
-    try:
-        pastas = [d for d in os.listdir(XML_MELLON_PATH) if d.isdigit() and len(d) == 8]
-    except OSError:
-        return xmls
+    pastas = _listar_pasta(
+        XML_MELLON_PATH,
+        lambda p, d: d.isdigit() and len(d) == 8 and _eh_subpasta(p, d),
+        anterior, atual,
+    )
     for pasta in sorted(pastas):
-        pasta_path = os.path.join(XML_MELLON_PATH, pasta)
-        if not os.path.isdir(pasta_path):
-            continue
-        try:
-            for f in os.listdir(pasta_path):
-                if f.lower().endswith(".xml") and not f.startswith("~"):
-                    xmls.append(os.path.join(pasta_path, f))
-        except OSError:
+        if _nome_fora_da_janela(pasta, janela):
             continue
+        pasta_path = os.path.join(XML_MELLON_PATH, pasta)
+        for f in _listar_pasta(pasta_path, _eh_xml, anterior, atual):
+            if not _nome_fora_da_janela(f, janela):
+                xmls.append(os.path.join(pasta_path, f))
     return xmls
 
 
@@ -386,393 +846,1798 @@ def _cnpj_from_filename(filename: str) -> str:
 
 
 @st.cache_data(ttl=3600, show_spinner="Mapeando XMLs locais...")
-def _descobrir_xmls_por_cnpj(cnpjs_interesse: tuple) -> dict:
+def _descobrir_xmls_por_cnpj(cnpjs_interesse: tuple, data_inicio=None,
+                             data_fim=None) -> tuple[dict, list]:
     """
-    Retorna {cnpj_norm: [lista de paths XML]} para CNPJs de interesse.
+    Retorna ({cnpj_norm: [lista de paths XML]}, [paths a identificar]).
+
+    O primeiro dict traz os arquivos cujo CNPJ de interesse está no nome.
+    Os "a identificar" são XMLs do formato antigo (YYYYMMDD_NAME.xml): o CNPJ
+    só aparece no <cnpj> do cabeçalho, lido junto com o parse (_ler_grupo_xml)
+    para não abrir o arquivo duas vezes.
+
+    A listagem usa o índice de pastas em cache: só pastas com mtime alterado
+    desde a última varredura são relistadas. data_inicio/data_fim podam
+    pastas e arquivos pela data no nome (com folga de alguns dias).
     """
     cnpjs_set = set(cnpjs_interesse)
-    all_xmls = _listar_xmls() + _listar_xmls_mellon()
+    _VARREDURA_XML.update(pastas=0, listadas=0)
+    anterior = _carregar_indice_pastas()
+    atual = {}
+    janela = _janela_xml(data_inicio, data_fim)
+    all_xmls = (_listar_xmls(anterior, atual, janela)
+                + _listar_xmls_mellon(anterior, atual, janela))
+    atual = _consolidar_indice_pastas(anterior, atual, (XML_BASE_PATH, XML_MELLON_PATH))
+    if atual != anterior:
+        _salvar_indice_pastas(atual)
 
-    # Primeiro: tentar extrair CNPJ do filename (rápido)
     cnpj_to_files = defaultdict(list)
-    unmatched = []
-
+    a_identificar = []
     for path in all_xmls:
         cnpj_fn = _cnpj_from_filename(path)
         if cnpj_fn and cnpj_fn in cnpjs_set:
             cnpj_to_files[cnpj_fn].append(path)
-        else:
-            unmatched.append(path)
+        elif re.match(r'^\d{8}_', os.path.basename(path)):
+            a_identificar.append(path)
 
-    # Segundo: para não-matched do formato antigo (YYYYMMDD_NAME.xml),
-    # tentar leitura rápida do header só se o arquivo parece ser formato antigo
-    # Limitar a um número razoável para evitar lentidão em rede
-    old_format_unmatched = [p for p in unmatched if re.match(r'^\d{8}_', os.path.basename(p))]
-    for path in old_format_unmatched:
-        try:
-            with open(path, "r", encoding="utf-8", errors="ignore") as f:
-                head = f.read(2000)
-            m = re.search(r'<cnpj>(\d{10,14})</cnpj>', head)
-            if m:
-                cnpj = m.group(1).zfill(14)
-                if cnpj in cnpjs_set:
-                    cnpj_to_files[cnpj].append(path)
-        except Exception:
-            pass
+    return dict(cnpj_to_files), a_identificar
+
+
+def _mapear_xmls_por_cnpj(por_nome: dict, a_identificar: list, cnpj_cabecalho: dict,
+                          cnpjs_set: set) -> dict:
+    """Junta os casados pelo nome com os identificados pelo <cnpj> do cabeçalho."""
+    cnpj_to_files = defaultdict(list)
+    for cnpj, paths in por_nome.items():
+        cnpj_to_files[cnpj].extend(paths)
+    for path in a_identificar:
+        cnpj = cnpj_cabecalho.get(path, "")
+        if cnpj and cnpj in cnpjs_set:
+            cnpj_to_files[cnpj].append(path)
 
     # Ordenar por data no filename
     for cnpj in cnpj_to_files:
         cnpj_to_files[cnpj].sort()
-
     return dict(cnpj_to_files)
 
 
+# ──────────────────────────────────────────────────────────────────────────────
+# Leitura dos XMLs com uma única abertura por arquivo (serial ou em pool)
+# ──────────────────────────────────────────────────────────────────────────────
+# Cada open no Google Drive é uma ida e volta na rede. Os arquivos são lidos
+# em grupos de prováveis duplicatas (mesma pasta + mesma data no nome, ou
+# mesma pasta do Mellon + mesmo fundo): cada arquivo é aberto uma vez, os
+# primeiros 8 KB dão CNPJ, formato e cabeçalho (data, PL) e, se o arquivo tem
+# o maior PL do seu (cnpj, data) até ali, o parse completo continua a leitura
+# do mesmo arquivo aberto, em streaming. Só o melhor parse de cada (cnpj, data)
+# fica em memória; arquivos superados param de ser lidos no cabeçalho.
+_XML_BLOCO_INICIO = 8 * 1024
+_IO_XML = {}  # path -> [aberturas, bytes lidos] da última carga
+
+
+def _chave_grupo_xml(cnpj: str, path: str) -> tuple:
+    """Pasta + data AAAAMMDD no nome (+ CNPJ do nome, se houver)."""
+    m = re.search(r'(?<!\d)(\d{8})(?!\d)', os.path.basename(path))
+    return os.path.dirname(path), m.group(1) if m else "", cnpj
+
+
+class _ReleituraXml:
+    """Arquivo aberto uma vez e relido do início por mais de um parser.
+
+    O que já foi lido do arquivo (a sondagem de 8 KB e o que o parse do
+    cabeçalho pedir além dela) fica num prefixo em memória; depois de
+    do_inicio(guardar=False), o resto do arquivo passa direto, sem ser
+    guardado.
+    """
+
+    def __init__(self, arquivo):
+        self._arquivo = arquivo
+        self._prefixo = bytearray()
+        self._pos = 0
+        self._guardar = True
+        self.bytes_lidos = 0
+
+    def read(self, n: int = -1) -> bytes:
+        if self._pos < len(self._prefixo):
+            fim = len(self._prefixo) if n is None or n < 0 else self._pos + n
+            dados = bytes(self._prefixo[self._pos:fim])
+        else:
+            dados = self._arquivo.read(n)
+            self.bytes_lidos += len(dados)
+            if self._guardar:
+                self._prefixo += dados
+        self._pos += len(dados)
+        return dados
+
+    def do_inicio(self, guardar: bool = True) -> "_ReleituraXml":
+        self._pos = 0
+        self._guardar = guardar
+        return self
+
+
+def _parser_xml(inicio: bytes):
+    """_parse_xml_old/_parse_xml_new pelo início do arquivo; None se desconhecido."""
+    fmt = _formato_xml(inicio[:1000].decode("utf-8", errors="ignore"))
+    if fmt == "unknown":
+        return None
+    return _parse_xml_old if fmt == "old" else _parse_xml_new
+
+
+def _ler_grupo_xml(tarefas: list[tuple[str, str]], cnpjs_aceitos: frozenset) -> list[dict]:
+    """Lê um grupo de arquivos [(cnpj, path)], abrindo cada um uma única vez.
+
+    cnpj "" = identificar pelo <cnpj> do cabeçalho; se não estiver em
+    cnpjs_aceitos, a leitura para no cabeçalho (completo=False).
+    Retorna, na ordem de tarefas, {"parsed", "completo", "cnpj_cabecalho",
+    "aberturas", "bytes_lidos"}. completo=False: só o cabeçalho foi parseado
+    (outro arquivo do grupo teve PL maior na mesma data).
+    """
+    leituras = []
+    cabecalhos = {}   # ordem -> parse do cabeçalho
+    vigentes = {}     # (cnpj, data) -> (-pl, ordem) do parse completo mantido
+    falhas = defaultdict(list)  # (cnpj, data) -> [(-pl, ordem)] com parse completo falho
+
+    def ler(arquivo: _ReleituraXml, cnpj: str, ordem: int, leitura: dict) -> None:
+        inicio = arquivo.read(_XML_BLOCO_INICIO)
+        m = re.search(r'<cnpj>(\d{10,14})</cnpj>', inicio[:2000].decode("utf-8", errors="ignore"))
+        if m:
+            leitura["cnpj_cabecalho"] = m.group(1).zfill(14)
+        parser = _parser_xml(inicio)
+        if parser is None:
+            return
+        cab = parser(arquivo.do_inicio(), somente_cabecalho=True)
+        leitura["parsed"] = cab
+        if not cnpj and leitura["cnpj_cabecalho"] not in cnpjs_aceitos:
+            # Fora do universo: só o cabeçalho, para o manifesto; sem ranking
+            leitura["completo"] = False
+            return
+        if cab is None or cab["data"] is None:
+            # Cabeçalho inválido/sem data: o arquivo nunca entra no merge
+            return
+        cabecalhos[ordem] = cab
+        chave = (cnpj or leitura["cnpj_cabecalho"], cab["data"])
+        posto = (-cab["pl"], ordem)
+        vigente = vigentes.get(chave)
+        if vigente is not None and vigente < posto:
+            leitura["completo"] = False
+            return
+        # Maior PL até aqui: parse completo continuando a leitura do arquivo
+        parsed = parser(arquivo.do_inicio(guardar=False))
+        leitura["parsed"] = parsed
+        if parsed is None or parsed["data"] is None:
+            falhas[chave].append(posto)
+            return
+        if vigente is not None:
+            leituras[vigente[1]].update(parsed=cabecalhos[vigente[1]], completo=False)
+        vigentes[chave] = posto
+
+    for ordem, (cnpj, path) in enumerate(tarefas):
+        leitura = {"parsed": None, "completo": True, "cnpj_cabecalho": "",
+                   "aberturas": 0, "bytes_lidos": 0}
+        leituras.append(leitura)
+        try:
+            f, leitura["aberturas"], comprimido = _abrir_xml(path)
+            with f:
+                arquivo = _ReleituraXml(f)
+                try:
+                    ler(arquivo, cnpj, ordem, leitura)
+                finally:
+                    leitura["bytes_lidos"] = arquivo.bytes_lidos
+            if comprimido is not None:
+                # Membro de zip: o que trafega no drive é o comprimido
+                leitura["bytes_lidos"] = min(comprimido, leitura["bytes_lidos"])
+        except (OSError, zipfile.BadZipFile, KeyError):
+            leitura["parsed"] = None
+
+    # Candidatos com parse falho abaixo do vencedor nunca seriam tentados no
+    # merge sequencial: ficam como só cabeçalho
+    for chave, postos in falhas.items():
+        vigente = vigentes.get(chave)
+        for posto in postos:
+            if vigente is not None and vigente < posto:
+                leituras[posto[1]].update(parsed=cabecalhos[posto[1]], completo=False)
+    return leituras
+
+
+def _ler_grupos_xml(grupos: list[list[tuple[str, str]]], cnpjs_aceitos: frozenset,
+                    n_processos: int = 1):
+    """Gera (tarefas do grupo, leituras) na ordem de grupos (serial ou em pool)."""
+    aceitos = [cnpjs_aceitos] * len(grupos)
+    if n_processos > 1 and len(grupos) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        chunksize = max(1, len(grupos) // (n_processos * 8))
+        with ProcessPoolExecutor(max_workers=n_processos) as pool:
+            yield from zip(grupos, pool.map(_ler_grupo_xml, grupos, aceitos, chunksize=chunksize))
+    else:
+        yield from zip(grupos, map(_ler_grupo_xml, grupos, aceitos))
+
+
+def _registrar_io_xml(path: str, leitura: dict) -> None:
+    io_path = _IO_XML.setdefault(path, [0, 0])
+    io_path[0] += leitura["aberturas"]
+    io_path[1] += leitura["bytes_lidos"]
+
+
+def estatisticas_io_xml() -> pd.DataFrame:
+    """Aberturas e bytes lidos por arquivo na última carga de XMLs."""
+    return pd.DataFrame(
+        [(p, a, b) for p, (a, b) in _IO_XML.items()],
+        columns=["path", "aberturas", "bytes_lidos"],
+    )
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Manifesto de parse dos XMLs (path, tamanho, mtime -> resultado do parse)
+# ──────────────────────────────────────────────────────────────────────────────
+# Caminhos montados na chamada: export_data e fixtures_cvm trocam CACHE_DIR
+def _xml_manifesto_path() -> str:
+    return os.path.join(CACHE_DIR, "xml_manifesto.parquet")
+
+
+def _xml_manifesto_posicoes_path() -> str:
+    return os.path.join(CACHE_DIR, "xml_manifesto_posicoes.parquet")
+
+
+def _assinatura_arquivo(path: str) -> tuple[int, int] | None:
+    """(tamanho, mtime em ns) do arquivo, ou None se inacessível.
+
+    Membro de zip: (tamanho descomprimido, CRC32), lidos do diretório do zip.
+    """
+    membro = _membro_zip(path)
+    try:
+        if membro is not None:
+            info = _abrir_zip(membro[0])[0].getinfo(membro[1])
+            return info.file_size, info.CRC
+        info = os.stat(path)
+    except (OSError, zipfile.BadZipFile, KeyError):
+        return None
+    return info.st_size, info.st_mtime_ns
+
+
+def _carregar_manifesto_xml() -> dict:
+    """Retorna {path: ((tamanho, mtime_ns), parsed | None, completo, cnpj_cabecalho)}.
+
+    completo=False: só o cabeçalho foi lido (arquivo superado por outro com
+    maior PL na mesma data, ou de CNPJ fora do universo); parsed["acoes"]
+    fica vazia.
+    cnpj_cabecalho: <cnpj> lido no início do arquivo (identifica os XMLs
+    YYYYMMDD_NAME.xml sem reabri-los, inclusive os de fundos não acompanhados).
+    """
+    try:
+        df_arq = pd.read_parquet(_xml_manifesto_path())
+        df_pos = pd.read_parquet(_xml_manifesto_posicoes_path())
+    except Exception:
+        return {}
+    if "completo" not in df_arq.columns:
+        df_arq["completo"] = True
+    if "cnpj_cabecalho" not in df_arq.columns:
+        df_arq["cnpj_cabecalho"] = ""
+
+    posicoes = defaultdict(list)
+    for path, ativo, valor in zip(df_pos["path"], df_pos["ativo"], df_pos["valor"]):
+        posicoes[path].append({"ativo": ativo, "valor": float(valor)})
+
+    manifesto = {}
+    for row in df_arq.itertuples(index=False):
+        parsed = None
+        if row.valido:
+            parsed = {
+                "cnpj": row.cnpj,
+                "data": row.data.to_pydatetime() if pd.notna(row.data) else None,
+                "pl": float(row.pl),
+                "acoes": posicoes.get(row.path, []),
+            }
+        manifesto[row.path] = ((int(row.tamanho), int(row.mtime_ns)), parsed, bool(row.completo),
+                               row.cnpj_cabecalho)
+    return manifesto
+
+
+def _salvar_manifesto_xml(manifesto: dict) -> None:
+    """Persiste o manifesto (arquivos + posições apontando para o path)."""
+    arquivos = []
+    posicoes = []
+    for path, ((tamanho, mtime_ns), parsed, completo, cnpj_cabecalho) in manifesto.items():
+        arquivos.append({
+            "path": path, "tamanho": tamanho, "mtime_ns": mtime_ns,
+            "valido": parsed is not None, "completo": completo,
+            "cnpj_cabecalho": cnpj_cabecalho,
+            "cnpj": parsed["cnpj"] if parsed else "",
+            "data": parsed["data"] if parsed else None,
+            "pl": parsed["pl"] if parsed else 0.0,
+        })
+        if parsed:
+            posicoes.extend({"path": path, "ativo": a["ativo"], "valor": a["valor"]}
+                            for a in parsed["acoes"])
+
+    df_arq = pd.DataFrame(arquivos, columns=["path", "tamanho", "mtime_ns", "valido", "completo",
+                                             "cnpj_cabecalho", "cnpj", "data", "pl"])
+    df_arq["data"] = pd.to_datetime(df_arq["data"])
+    df_pos = pd.DataFrame(posicoes, columns=["path", "ativo", "valor"])
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    df_arq.to_parquet(_xml_manifesto_path(), index=False)
+    df_pos.to_parquet(_xml_manifesto_posicoes_path(), index=False)
+
+
 # ──────────────────────────────────────────────────────────────────────────────
 # Carregar todos os dados XML
 # ──────────────────────────────────────────────────────────────────────────────
 @st.cache_data(ttl=3600, show_spinner="Processando XMLs locais...")
-def carregar_dados_xml(cnpjs_interesse: tuple) -> pd.DataFrame:
+def carregar_dados_xml(cnpjs_interesse: tuple, n_processos: int = 1,
+                       usar_manifesto: bool = False, data_inicio=None,
+                       data_fim=None) -> pd.DataFrame:
     """Parseia todos os XMLs e retorna DataFrame unificado.
 
     Deduplicação: para cada (cnpj, data), mantém apenas o XML com maior PL
-    (que tende a ser o arquivo mais completo/final vs prévia).
+    (que tende a ser o arquivo mais completo/final vs prévia). Cada arquivo
+    é aberto uma única vez: formato, CNPJ do cabeçalho, data e PL saem dos
+    primeiros 8 KB, e o parse completo (em streaming, no mesmo arquivo
+    aberto) só é feito no vencedor de cada (cnpj, data). Se o vencedor falhar no parse, o próximo candidato é
+    tentado, como no merge sequencial original. estatisticas_io_xml() traz
+    as aberturas e bytes lidos por arquivo.
+
+    n_processos > 1 distribui a leitura entre processos (grupos de arquivos);
+    n_processos = 1 mantém o parse serial (útil para depuração). Os
+    resultados voltam na ordem dos arquivos, então o merge é idêntico.
+
+    usar_manifesto: reaproveita o parse de arquivos cujo (tamanho, mtime)
+    não mudou desde a última execução; só arquivos novos/alterados são lidos.
+
+    data_inicio/data_fim (inclusivos): só posições nessa janela. Pastas e
+    arquivos são podados pela data no nome antes de qualquer leitura; o corte
+    exato usa a data do XML.
     """
-    cnpj_xmls = _descobrir_xmls_por_cnpj(cnpjs_interesse)
+    _IO_XML.clear()
+    cnpjs_set = frozenset(cnpjs_interesse)
+    janela = _janela_xml(data_inicio, data_fim)
+    por_nome, a_identificar = _descobrir_xmls_por_cnpj(cnpjs_interesse, data_inicio, data_fim)
+    candidatos = [(cnpj, path) for cnpj, paths in por_nome.items() for path in paths]
+    candidatos += [("", path) for path in a_identificar]
+
+    manifesto = _carregar_manifesto_xml() if usar_manifesto else {}
+    assinaturas = {}
+    cabecalhos = {}      # path -> parse do cabeçalho (ou completo) | None
+    completos = {}       # path -> parse completo | None
+    cnpj_cabecalho = {}  # path -> <cnpj> do cabeçalho (arquivos a identificar)
+    pendentes = []
+    for cnpj, path in candidatos:
+        if usar_manifesto:
+            assinaturas[path] = _assinatura_arquivo(path)
+            entrada = manifesto.get(path)
+            if entrada is not None and entrada[0] == assinaturas[path]:
+                cabecalhos[path] = entrada[1]
+                if entrada[2]:
+                    completos[path] = entrada[1]
+                cnpj_cabecalho[path] = entrada[3]
+                continue
+        pendentes.append((cnpj, path))
+
+    # 1ª passada: uma abertura por arquivo novo; dentro de cada grupo de
+    # prováveis duplicatas só o vencedor é parseado por completo
+    grupos = defaultdict(list)
+    for cnpj, path in sorted(pendentes, key=lambda t: t[1]):
+        grupos[_chave_grupo_xml(cnpj, path)].append((cnpj, path))
+    lidos = set()
+    for tarefas_grupo, leituras in _ler_grupos_xml(list(grupos.values()), cnpjs_set, n_processos):
+        for (cnpj, path), leitura in zip(tarefas_grupo, leituras):
+            _registrar_io_xml(path, leitura)
+            cnpj_cabecalho[path] = leitura["cnpj_cabecalho"]
+            # Também os de CNPJ fora do universo: no manifesto, a próxima
+            # execução os identifica sem abrir (e _mapear_xmls_por_cnpj os
+            # deixa fora do ranking)
+            lidos.add(path)
+            cabecalhos[path] = leitura["parsed"]
+            if leitura["completo"]:
+                completos[path] = leitura["parsed"]
+
+    cnpj_xmls = _mapear_xmls_por_cnpj(por_nome, a_identificar, cnpj_cabecalho, cnpjs_set)
+    tarefas = [(cnpj, path) for cnpj, paths in cnpj_xmls.items() for path in paths]
+
+    # Ranking por (cnpj, data): maior PL primeiro, empate -> ordem original
+    ranking = defaultdict(list)
+    for ordem, (cnpj, path) in enumerate(tarefas):
+        cab = cabecalhos[path]
+        if cab is None or cab["data"] is None or not _na_janela(cab["data"], janela):
+            continue
+        ranking[(cnpj, cab["data"])].append((-cab["pl"], ordem, path))
+    for candidatos_key in ranking.values():
+        candidatos_key.sort()
 
-    # Parsear todos os XMLs, agrupando por (cnpj, data)
-    # Manter apenas o parse com maior PL para cada (cnpj, data)
+    # 2ª passada: vencedores ainda sem parse completo (só cabeçalho no
+    # manifesto, ou vencedor de um grupo que perdeu para outro grupo)
     best_parses = {}  # (cnpj, data) -> (pl, acoes_list)
-
-    for cnpj, paths in cnpj_xmls.items():
-        for path in paths:
-            fmt = _detect_xml_format(path)
-            if fmt == "old":
-                parsed = _parse_xml_old(path)
-            elif fmt == "new":
-                parsed = _parse_xml_new(path)
+    posicao = {key: 0 for key in ranking}
+    while posicao:
+        faltando = [ranking[key][i][2] for key, i in posicao.items()
+                    if ranking[key][i][2] not in completos]
+        grupos_faltando = [[("-", path)] for path in faltando]
+        for [(_, path)], [leitura] in _ler_grupos_xml(grupos_faltando, cnpjs_set, n_processos):
+            _registrar_io_xml(path, leitura)
+            completos[path] = leitura["parsed"]
+        lidos.update(faltando)
+        for key, i in list(posicao.items()):
+            parsed = completos[ranking[key][i][2]]
+            if parsed is not None and parsed["data"] is not None:
+                best_parses[key] = (parsed["pl"], parsed["acoes"])
+                del posicao[key]
+            elif i + 1 < len(ranking[key]):
+                posicao[key] = i + 1
             else:
+                del posicao[key]
+    # Mesma ordem de chaves do merge sequencial (primeira ocorrência)
+    best_parses = {key: best_parses[key] for key in ranking if key in best_parses}
+    _fechar_zips()
+
+    if usar_manifesto and lidos:
+        for path in lidos:
+            if assinaturas.get(path) is None:
                 continue
+            if path in completos:
+                manifesto[path] = (assinaturas[path], completos[path], True, cnpj_cabecalho[path])
+            else:
+                manifesto[path] = (assinaturas[path], cabecalhos[path], False, cnpj_cabecalho[path])
+        _salvar_manifesto_xml(manifesto)
 
-            if parsed is None or parsed["data"] is None:
-                continue
+    return _montar_df_xml(best_parses)
 
-            key = (cnpj, parsed["data"])
-            pl = parsed["pl"]
-            # Manter o parse com maior PL (mais completo)
-            if key not in best_parses or pl > best_parses[key][0]:
-                best_parses[key] = (pl, parsed["acoes"])
-
-    # Converter para records
-    records = []
-    for (cnpj, data), (pl, acoes) in best_parses.items():
-        for a in acoes:
-            pct = (a["valor"] / pl * 100) if pl > 0 else 0
-            records.append({
-                "cnpj_fundo": cnpj,
-                "data": data,
-                "ativo": a["ativo"],
-                "valor": a["valor"],
-                "pl": pl,
-                "pct_pl": pct,
-                "setor": classificar_setor(a["ativo"]),
-                "fonte": "XML",
-            })
-
-    if not records:
-        return pd.DataFrame(columns=["cnpj_fundo", "data", "ativo", "valor", "pl", "pct_pl", "setor", "fonte"])
 
-    df = pd.DataFrame(records)
-    df["data"] = pd.to_datetime(df["data"])
-    return df
+_COLUNAS_XML = ["cnpj_fundo", "data", "ativo", "valor", "pl", "pct_pl", "setor", "fonte"]
+
+
+def _texto_por_codigo(unicos, codigos: np.ndarray):
+    """Coluna de texto a partir dos valores distintos e dos códigos de cada
+    linha, no dtype de texto padrão do pandas (sem objeto Python por linha)."""
+    return pd.Series(list(unicos), dtype=object).infer_objects().array.take(codigos)
+
+
+def _montar_df_xml(best_parses: dict) -> pd.DataFrame:
+    """Monta o DataFrame de posições a partir de {(cnpj, data): (pl, acoes)}.
+
+    Colunar: cnpj/data/PL entram uma vez por (cnpj, data) e são repetidos
+    com np.repeat; valor vai direto para um array float64; pct_pl é
+    vetorizado e o setor é classificado uma vez por ativo distinto. Os
+    códigos de ativo/setor ficam só aqui dentro: as colunas de texto saem
+    com o dtype de texto padrão, como no DataFrame montado por registros.
+    """
+    n_por_chave = np.fromiter((len(acoes) for _, acoes in best_parses.values()),
+                              dtype=np.int64, count=len(best_parses))
+    total = int(n_por_chave.sum())
+    if total == 0:
+        return pd.DataFrame(columns=_COLUNAS_XML)
+
+    chaves = list(best_parses)
+    cnpjs = [cnpj for cnpj, _ in chaves]
+    datas = pd.to_datetime([data for _, data in chaves])
+    pls = np.fromiter((pl for pl, _ in best_parses.values()), dtype=np.float64, count=len(chaves))
+
+    ativos = [a["ativo"] for _, acoes in best_parses.values() for a in acoes]
+    valores = np.fromiter((a["valor"] for _, acoes in best_parses.values() for a in acoes),
+                          dtype=np.float64, count=total)
+    pl_col = np.repeat(pls, n_por_chave)
+    pct = np.zeros(total, dtype=np.float64)
+    np.divide(valores, pl_col, out=pct, where=pl_col > 0)
+    pct *= 100
+
+    codigos_ativo, ativos_unicos = pd.factorize(pd.Series(ativos, dtype=object))
+    setores = [classificar_setor(a) for a in ativos_unicos]
+    return pd.DataFrame({
+        "cnpj_fundo": _texto_por_codigo(cnpjs, np.repeat(np.arange(len(chaves)), n_por_chave)),
+        "data": np.repeat(datas.values, n_por_chave),
+        "ativo": _texto_por_codigo(ativos_unicos, codigos_ativo),
+        "valor": valores,
+        "pl": pl_col,
+        "pct_pl": pct,
+        "setor": _texto_por_codigo(setores, codigos_ativo),
+        "fonte": _texto_por_codigo(["XML"], np.zeros(total, dtype=np.intp)),
+    })
 
 
 # ──────────────────────────────────────────────────────────────────────────────
-# Download e parse CVM BLC_4
+# Downloads CVM: meses em paralelo, limite de taxa por host e retry
 # ──────────────────────────────────────────────────────────────────────────────
-def _download_cvm_blc4(yyyymm: str) -> pd.DataFrame | None:
-    """Baixa e cacheia um mês de dados CVM BLC_4."""
-    os.makedirs(CACHE_DIR, exist_ok=True)
-    cache_path = os.path.join(CACHE_DIR, f"cvm_blc4_{yyyymm}.parquet")
-
-    # Verificar cache
-    if os.path.exists(cache_path):
-        age_hours = (datetime.now() - datetime.fromtimestamp(os.path.getmtime(cache_path))).total_seconds() / 3600
-        # Meses antigos (>3 meses): cache permanente. Recentes: revalidar a cada 24h
-        today = datetime.now()
-        ref_date = datetime(int(yyyymm[:4]), int(yyyymm[4:6]), 1)
-        months_old = (today.year - ref_date.year) * 12 + today.month - ref_date.month
-        if months_old > 3 or age_hours < 24:
-            try:
-                return pd.read_parquet(cache_path)
-            except Exception:
-                pass
+# Cada mês é um download independente (60-200 MB no CDA); em série, 36+ meses
+# com timeout de 120-180s estouram o tempo do CI. Os meses são baixados por um
+# pool limitado de threads (E/S de rede), com intervalo mínimo entre requisições
+# ao mesmo host e novas tentativas com backoff exponencial para falhas
+# transitórias. Os resultados voltam sempre na ordem dos meses.
+CVM_DOWNLOADS_SIMULTANEOS = 4
+CVM_INTERVALO_HOST = 0.25      # segundos entre inícios de requisição ao mesmo host
+CVM_TENTATIVAS = 4
+CVM_BACKOFF_BASE = 2.0         # segundos; dobra a cada tentativa (+ jitter)
+_HTTP_STATUS_RETRY = {429, 500, 502, 503, 504}
+
+
+class _LimitadorHost:
+    """Intervalo mínimo entre requisições ao mesmo host (compartilhado entre threads)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._proximo = {}
+
+    def esperar(self, host: str, intervalo: float) -> None:
+        with self._lock:
+            agora = time.monotonic()
+            inicio = max(agora, self._proximo.get(host, 0.0))
+            self._proximo[host] = inicio + intervalo
+        if inicio > agora:
+            time.sleep(inicio - agora)
+
+
+_LIMITADOR_HOST = _LimitadorHost()
+
 
-    # Tentar primeiro o ZIP combinado (formato novo), depois o individual (formato antigo)
-    df = None
-    for url in [
-        CVM_ZIP_URL.format(yyyymm=yyyymm),
-        CVM_BLC4_ZIP_URL.format(yyyymm=yyyymm),
-    ]:
+def _http_get(url: str, timeout: float, **kwargs) -> requests.Response:
+    """requests.get com limite por host e retry/backoff em falhas transitórias.
+
+    Repete em erro de conexão/timeout e em 429/5xx (respeitando Retry-After);
+    outras respostas (200, 404...) voltam direto. Na última tentativa, a
+    exceção ou a resposta de erro é devolvida ao chamador como antes.
+    kwargs (headers, stream...) vão para requests.get.
+    """
+    host = urlparse(url).netloc
+    for tentativa in range(CVM_TENTATIVAS):
+        _LIMITADOR_HOST.esperar(host, CVM_INTERVALO_HOST)
+        espera = CVM_BACKOFF_BASE * 2 ** tentativa * (1 + random.random() / 2)
         try:
-            resp = requests.get(url, timeout=120)
-            if resp.status_code != 200:
-                continue
-            with zipfile.ZipFile(io.BytesIO(resp.content)) as zf:
-                csv_names = [n for n in zf.namelist() if "BLC_4" in n and n.endswith(".csv")]
-                if not csv_names:
+            resp = requests.get(url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if tentativa == CVM_TENTATIVAS - 1:
+                raise
+        else:
+            if resp.status_code not in _HTTP_STATUS_RETRY or tentativa == CVM_TENTATIVAS - 1:
+                return resp
+            retry_after = resp.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                espera = max(espera, float(retry_after))
+            resp.close()
+        time.sleep(espera)
+
+
+def _baixar_em_ordem(func, itens: list, max_workers: int | None = None):
+    """Gera (item, func(item)) na ordem de itens (meses, blocos), com até
+    max_workers downloads em andamento (padrão CVM_DOWNLOADS_SIMULTANEOS)."""
+    max_workers = max_workers or CVM_DOWNLOADS_SIMULTANEOS
+    if max_workers <= 1 or len(itens) <= 1:
+        for item in itens:
+            yield item, func(item)
+        return
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        yield from zip(itens, pool.map(func, itens))
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ZIPs da CVM baixados para o disco
+# ──────────────────────────────────────────────────────────────────────────────
+# resp.content + ZipFile(BytesIO) mantinham o ZIP inteiro (60-200 MB no CDA)
+# na memória junto com o CSV descomprimido, o que estourava o processo do
+# Streamlit numa busca sob demanda. O ZIP vai em blocos para um arquivo
+# temporário e os CSVs são lidos do ZIP em disco. Se a conexão cair no meio, o
+# download continua do último byte gravado com um pedido Range. O pico passa a
+# depender só do CSV lido, não do ZIP (benchmark.py cvm-memoria: ZIP de 165 MB,
+# +367 -> +160 MB; de 427 MB, +820 -> +160 MB). Com um ZIP de poucas centenas
+# de KB, os buffers fixos do leitor em lotes e do ParquetWriter (~20 MB) pesam
+# mais que o próprio ZIP e o disco fica um pouco acima da memória.
+_BLOCO_DOWNLOAD = 64 * 1024
+_ERROS_CONEXAO = (requests.ConnectionError, requests.Timeout,
+                  requests.exceptions.ChunkedEncodingError)
+
+
+def _total_resposta(resp: requests.Response, inicio: int) -> int | None:
+    """Tamanho total do arquivo (Content-Range em 206, Content-Length em 200)."""
+    if resp.status_code == 206:
+        total = resp.headers.get("Content-Range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    tamanho = resp.headers.get("Content-Length", "")
+    return int(tamanho) + inicio if tamanho.isdigit() else None
+
+
+def _baixar_para_disco(url: str, timeout: float,
+                       condicional: dict | None = None) -> tuple[str | None, tuple]:
+    """Baixa url em blocos para um arquivo temporário em CACHE_DIR.
+
+    Retorna (caminho, validadores): o chamador remove o caminho com
+    _remover_download; caminho None se o servidor não tem o arquivo e
+    _NAO_MODIFICADO se respondeu 304 aos cabeçalhos de condicional.
+    validadores = (etag, last_modified, tamanho) da versão baixada. Quedas de
+    conexão retomam via Range (com If-Range, para não emendar versões).
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="cvm_", suffix=".zip.parcial", dir=CACHE_DIR)
+    os.close(fd)
+    gravados, total, validadores = 0, None, ("", "", None)
+    try:
+        for _ in range(CVM_TENTATIVAS):
+            if gravados:
+                headers = {"Range": f"bytes={gravados}-"}
+                versao = validadores[0] if not validadores[0].startswith("W/") else validadores[1]
+                if versao:
+                    headers["If-Range"] = versao
+            else:
+                headers = dict(condicional or {})
+            with _http_get(url, timeout=timeout, headers=headers, stream=True) as resp:
+                if resp.status_code == 304 and condicional and not gravados:
+                    _remover_download(path)
+                    return _NAO_MODIFICADO, validadores
+                if resp.status_code == 200:
+                    gravados = 0  # servidor ignorou o Range: recomeça do zero
+                    validadores = (resp.headers.get("ETag", ""), resp.headers.get("Last-Modified", ""), None)
+                elif resp.status_code != 206 or not gravados:
+                    _remover_download(path)
+                    return None, validadores
+                total = _total_resposta(resp, gravados)
+                try:
+                    with open(path, "ab" if gravados else "wb") as f:
+                        for bloco in resp.iter_content(_BLOCO_DOWNLOAD):
+                            f.write(bloco)
+                            gravados += len(bloco)
+                except _ERROS_CONEXAO:
                     continue
-                with zf.open(csv_names[0]) as csvfile:
-                    df = pd.read_csv(csvfile, sep=";", encoding="latin-1", low_memory=False)
-            break
+            if total is None or gravados >= total:
+                return path, validadores[:2] + (gravados,)
+    except Exception:
+        _remover_download(path)
+        raise
+    _remover_download(path)
+    raise requests.ConnectionError(f"download incompleto: {url} ({gravados}/{total} bytes)")
+
+
+def _remover_download(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Esquemas dos CSVs da CVM (colunas usadas e tipos)
+# ──────────────────────────────────────────────────────────────────────────────
+# Dos CSVs do CDA e do inf_diario o pipeline usa poucas colunas; ler todas com
+# low_memory=False custava tempo e memória em colunas que nunca são usadas.
+# Cada tipo de arquivo lista as colunas que usa e seus tipos, e só elas são
+# decodificadas, já com o tipo certo (leitor CSV do pyarrow quando disponível).
+# O CNPJ vem como CNPJ_FUNDO_CLASSE (layout RCVM 175) ou CNPJ_FUNDO (antigo):
+# as duas estão nos esquemas e só as presentes no cabeçalho são lidas.
+_COLS_CNPJ_CVM = {"CNPJ_FUNDO_CLASSE": str, "CNPJ_FUNDO": str}
+_COLS_ATIVO_CVM = {"DT_COMPTC": str, "CD_ATIVO": str, "DS_ATIVO": str, "VL_MERC_POS_FINAL": "float64"}
+_ESQUEMAS_CSV_CVM = {
+    "BLC_1": {**_COLS_ATIVO_CVM, "CD_SELIC": str},
+    "BLC_2": {**_COLS_ATIVO_CVM, "CNPJ_FUNDO_COTA": str, "CNPJ_FUNDO_INVEST": str, "NM_FUNDO_COTA": str},
+    "BLC_4": {**_COLS_ATIVO_CVM, "TP_APLIC": str},
+    "BLC": _COLS_ATIVO_CVM,  # demais blocos (3, 5, 6, 7, 8)
+    "PL": {"DT_COMPTC": str, "VL_PATRIM_LIQ": "float64"},
+    "INF_DIARIO": {"DT_COMPTC": str, "VL_QUOTA": "float64", "VL_PATRIM_LIQ": "float64"},
+}
+
+
+# Os CSVs são lidos em lotes e cada lote já sai com cnpj_norm (14 dígitos) e,
+# se pedido, filtrado pelos CNPJs de interesse: o mês nacional inteiro (todos
+# os fundos) não chega a existir como DataFrame. Os caches por bloco são
+# gravados lote a lote (um row group por lote) e lidos com filtro em cnpj_norm.
+# O pico de memória fica no dos blocos do parser (~100 MB) qualquer que seja o
+# tamanho do mês; ler tudo e filtrar depois cresce com o mês (benchmark.py
+# filtro-cvm: com 60k fundos, +240 MB; com 600k, +1,7 GB). Num CSV pequeno,
+# menor que os blocos, os dois caminhos ficam iguais.
+_BLOCO_CSV = 1024 * 1024        # bytes de CSV por lote no leitor do pyarrow (o pico
+                                # de memória do parser é várias vezes o bloco)
+_LINHAS_LOTE_CSV = 50_000       # linhas por lote no motor C (reserva)
+_LINHAS_ROW_GROUP = 200_000     # lotes pequenos são juntados até isso no parquet
+
+
+def _colunas_csv_cvm(zf: zipfile.ZipFile, nome: str, tipo: str) -> dict:
+    """{coluna: tipo} do esquema do tipo que existem no cabeçalho do CSV
+    ('BLC_4', 'PL', 'INF_DIARIO'...; blocos sem esquema próprio usam 'BLC')."""
+    with zf.open(nome) as csvfile:
+        cabecalho = csvfile.readline().decode("latin-1").strip().split(";")
+    cabecalho = {c.strip().strip('"') for c in cabecalho}
+    esquema = {**_COLS_CNPJ_CVM, **_ESQUEMAS_CSV_CVM.get(tipo, _ESQUEMAS_CSV_CVM["BLC"])}
+    return {col: tp for col, tp in esquema.items() if col in cabecalho}
+
+
+def _lotes_pyarrow(csvfile, dtype: dict, cnpj_col: str | None, cnpjs: set | None):
+    """Leitor CSV em streaming do pyarrow, com os tipos já na conversão; CNPJ
+    normalizado e filtro feitos no lote do arrow, antes de virar DataFrame."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    tipos = {col: pa.string() if tp is str else pa.float64() for col, tp in dtype.items()}
+    leitor = pa_csv.open_csv(
+        csvfile,
+        read_options=pa_csv.ReadOptions(encoding="latin-1", block_size=_BLOCO_CSV),
+        parse_options=pa_csv.ParseOptions(delimiter=";"),
+        convert_options=pa_csv.ConvertOptions(include_columns=list(dtype), column_types=tipos,
+                                              strings_can_be_null=True),
+    )
+    alvo = pa.array(sorted(cnpjs), pa.string()) if cnpjs is not None else None
+    for lote in leitor:
+        tabela = pa.Table.from_batches([lote])
+        if cnpj_col:
+            cnpj_norm = _cnpjs_arrow(lote.column(cnpj_col))
+            tabela = tabela.append_column("cnpj_norm", cnpj_norm)
+            if alvo is not None:
+                tabela = tabela.filter(pc.is_in(cnpj_norm, value_set=alvo))
+        yield tabela.to_pandas()
+
+
+def _lotes_csv_cvm(zf: zipfile.ZipFile, nome: str, tipo: str, cnpjs: set | None = None,
+                   motor: str = "pyarrow"):
+    """Gera DataFrames do CSV em lotes, com as colunas do esquema, cnpj_norm e,
+    se cnpjs, só as linhas desses CNPJs."""
+    dtype = _colunas_csv_cvm(zf, nome, tipo)
+    cnpj_col = next((c for c in _COLS_CNPJ_CVM if c in dtype), None)
+    with zf.open(nome) as csvfile:
+        if motor == "pyarrow":
+            yield from _lotes_pyarrow(csvfile, dtype, cnpj_col, cnpjs)
+            return
+        for lote in pd.read_csv(csvfile, sep=";", encoding="latin-1", usecols=list(dtype),
+                                dtype=dtype, chunksize=_LINHAS_LOTE_CSV):
+            if cnpj_col:
+                lote["cnpj_norm"] = _cnpjs_normalizados(lote[cnpj_col])
+                if cnpjs is not None:
+                    lote = lote[lote["cnpj_norm"].isin(cnpjs)]
+            yield lote
+
+
+def _com_motor_reserva(func):
+    """Roda func(motor) com o pyarrow e, se falhar (sem pyarrow, ou linha
+    malformada: o leitor do pyarrow é mais estrito), de novo com o motor C."""
+    try:
+        return func("pyarrow")
+    except Exception:
+        return func("c")
+
+
+def _ler_csv_cvm(zf: zipfile.ZipFile, nome: str, tipo: str, cnpjs: set | None = None) -> pd.DataFrame:
+    """Lê o CSV nome do ZIP com as colunas e tipos do esquema do tipo,
+    filtrando por cnpjs lote a lote."""
+    def ler(motor):
+        lotes = list(_lotes_csv_cvm(zf, nome, tipo, cnpjs, motor))
+        if not lotes:  # só cabeçalho
+            colunas = list(_colunas_csv_cvm(zf, nome, tipo))
+            if any(c in _COLS_CNPJ_CVM for c in colunas):
+                colunas.append("cnpj_norm")
+            return pd.DataFrame(columns=colunas)
+        return pd.concat(lotes, ignore_index=True)
+    return _com_motor_reserva(ler)
+
+
+def _gravar_csv_cvm_parquet(zf: zipfile.ZipFile, nome: str, tipo: str, destino: str) -> None:
+    """Grava o CSV nome do ZIP em parquet lote a lote (row groups de até
+    _LINHAS_ROW_GROUP linhas), sem montar o DataFrame inteiro. Escrita
+    atômica (tmp + os.replace)."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tmp = _caminho_temporario(destino)
+
+    def gravar(motor):
+        writer, pendentes, n_pendentes = None, [], 0
+
+        def descarregar():
+            nonlocal writer, pendentes, n_pendentes
+            tabela = pa.concat_tables(pendentes)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp, tabela.schema)
+            writer.write_table(tabela)
+            pendentes, n_pendentes = [], 0
+
+        try:
+            for lote in _lotes_csv_cvm(zf, nome, tipo, motor=motor):
+                esquema = writer.schema if writer else (pendentes[0].schema if pendentes else None)
+                pendentes.append(pa.Table.from_pandas(lote, preserve_index=False, schema=esquema))
+                n_pendentes += len(lote)
+                if n_pendentes >= _LINHAS_ROW_GROUP:
+                    descarregar()
+            if pendentes:
+                descarregar()
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None:  # só cabeçalho
+            _ler_csv_cvm(zf, nome, tipo).to_parquet(tmp, index=False)
+        os.replace(tmp, destino)
+
+    try:
+        _com_motor_reserva(gravar)
+    finally:
+        _remover_download(tmp)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Cache da CVM: chaves, metadados, prazo e escrita atômica
+# ──────────────────────────────────────────────────────────────────────────────
+# Todo parquet de cache da CVM (blocos do CDA, PL, inf_diario) passa por
+# _cache_cvm: lê o cache se ainda vale; senão, sob o lock da URL (dois workers
+# nunca baixam o mesmo arquivo ao mesmo tempo), baixa o ZIP ou revalida com
+# If-None-Match / If-Modified-Since e grava os parquets em arquivo temporário
+# + os.replace. Uma escrita interrompida, ou duas sessões do Streamlit
+# gravando juntas, nunca deixam um parquet truncado no lugar do cache.
+#
+# Os metadados ficam em cache/cvm_validadores.parquet, um registro por arquivo
+# de cache: URL e validadores (ETag, Last-Modified) da versão do ZIP que o
+# gerou, tamanho do ZIP e a hora da última verificação na CVM. O prazo conta
+# dessa verificação (mtime só para caches anteriores aos metadados): meses
+# antigos são permanentes; recentes são revalidados a cada CVM_PRAZO_CACHE_HORAS.
+# Os metadados são por arquivo de cache e não por URL: um ZIP gera vários
+# caches (os blocos do CDA) e um bloco pode vir do ZIP combinado ou do próprio.
+CVM_PRAZO_CACHE_HORAS = 24
+CVM_MESES_RECENTES = 3         # meses com mais que isso: cache permanente
+_NAO_MODIFICADO = object()
+_METADADOS_CVM = {}  # CACHE_DIR -> {nome do parquet: metadados}
+_LOCK_METADADOS = threading.Lock()
+_LOCKS_URL_CVM = defaultdict(threading.Lock)  # url -> lock do download
+_LOCK_LOCKS_URL = threading.Lock()
+_IO_REVALIDACAO = {"nao_modificados": 0, "bytes_evitados": 0}
+# Pasta onde cada ZIP baixado da CVM é copiado (fixtures para reprodução
+# offline, ver fixtures_cvm.py); vazio = não grava
+CVM_FIXTURES_GRAVAR = os.environ.get("CVM_FIXTURES_GRAVAR", "")
+
+
+def _cache_cvm_path(bloco: str, yyyymm: str, sufixo: str = "") -> str:
+    """'BLC_4' -> cache/cvm_blc4_AAAAMM.parquet; 'PL' -> cache/cvm_pl_AAAAMM.parquet;
+    'INF_DIARIO' -> cache/cvm_inf_diario_AAAAMM{sufixo}.parquet."""
+    nome = bloco.lower() if bloco == "INF_DIARIO" else bloco.lower().replace("_", "")
+    return os.path.join(CACHE_DIR, f"cvm_{nome}_{yyyymm}{sufixo}.parquet")
+
+
+def _metadados_cvm() -> dict:
+    """Metadados do CACHE_DIR atual (chamar com _LOCK_METADADOS)."""
+    if CACHE_DIR not in _METADADOS_CVM:
+        dados = {}
+        try:
+            df = pd.read_parquet(os.path.join(CACHE_DIR, "cvm_validadores.parquet"))
+            if "verificado_em" not in df.columns:
+                df["verificado_em"] = np.nan  # gravado antes do prazo nos metadados
+            for r in df.itertuples(index=False):
+                dados[r.arquivo] = {"url": r.url, "etag": r.etag, "last_modified": r.last_modified,
+                                    "tamanho": int(r.tamanho), "verificado_em": float(r.verificado_em)}
         except Exception:
-            continue
+            pass
+        _METADADOS_CVM[CACHE_DIR] = dados
+    return _METADADOS_CVM[CACHE_DIR]
 
-    if df is None:
-        return None
 
-    # Salvar cache
-    df.to_parquet(cache_path, index=False)
+def _caminho_temporario(destino: str) -> str:
+    return f"{destino}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _gravar_parquet_atomico(df: pd.DataFrame, destino: str) -> None:
+    """to_parquet em arquivo temporário + os.replace (nunca um parquet pela metade)."""
+    tmp = _caminho_temporario(destino)
+    try:
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, destino)
+    finally:
+        _remover_download(tmp)
+
+
+def _salvar_metadados_cvm() -> None:
+    """Persiste os metadados do CACHE_DIR atual (chamar com _LOCK_METADADOS)."""
+    dados = _metadados_cvm()
+    df = pd.DataFrame([{"arquivo": arq, **meta} for arq, meta in dados.items()],
+                      columns=["arquivo", "url", "etag", "last_modified", "tamanho", "verificado_em"])
+    try:
+        _gravar_parquet_atomico(df, os.path.join(CACHE_DIR, "cvm_validadores.parquet"))
+    except Exception:
+        pass
+
+
+def _meses_desde(yyyymm: str) -> int:
+    today = datetime.now()
+    return (today.year - int(yyyymm[:4])) * 12 + today.month - int(yyyymm[4:6])
+
+
+def _cache_cvm_vencido(cache_path: str, yyyymm: str) -> bool:
+    """True se o cache existe mas passou do prazo (mês recente não verificado
+    na CVM nas últimas CVM_PRAZO_CACHE_HORAS)."""
+    if not os.path.exists(cache_path):
+        return False
+    if _meses_desde(yyyymm) > CVM_MESES_RECENTES:
+        return False
+    with _LOCK_METADADOS:
+        meta = _metadados_cvm().get(os.path.basename(cache_path))
+    verificado_em = meta["verificado_em"] if meta else np.nan
+    if np.isnan(verificado_em):
+        verificado_em = os.path.getmtime(cache_path)
+    return time.time() - verificado_em >= CVM_PRAZO_CACHE_HORAS * 3600
+
+
+def _ler_cache_cvm(cache_path: str, yyyymm: str, cnpjs: set | None = None) -> pd.DataFrame | None:
+    """Lê o parquet de cache se ainda vale para o mês; senão None.
+
+    Com cnpjs, só as linhas desses fundos (filtro em cnpj_norm aplicado na
+    leitura do parquet; caches antigos, sem a coluna, são filtrados depois).
+    Um cache ilegível é apagado junto com os metadados, para ser baixado de
+    novo em vez de ignorado a cada execução. Sem o parquet do mês, procura o
+    mês no parquet anual compactado (compactar_cache_cvm).
+    """
+    if not os.path.exists(cache_path):
+        return _ler_cache_cvm_compactado(cache_path, yyyymm, cnpjs)
+    if _cache_cvm_vencido(cache_path, yyyymm):
+        return None
+    try:
+        if cnpjs is None:
+            df = pd.read_parquet(cache_path)
+        else:
+            df = _ler_parquet_cnpjs(cache_path, cnpjs)
+    except Exception:
+        _invalidar_cache_cvm(cache_path)
+        return None
+    _ACESSOS_CVM[cache_path] = time.time()
     return df
 
 
-def _download_cvm_pl(yyyymm: str) -> pd.DataFrame | None:
-    """Baixa dados de PL (Patrimonio Liquido) do arquivo CDA PL da CVM."""
-    os.makedirs(CACHE_DIR, exist_ok=True)
-    cache_path = os.path.join(CACHE_DIR, f"cvm_pl_{yyyymm}.parquet")
-
-    # Verificar cache
-    if os.path.exists(cache_path):
-        age_hours = (datetime.now() - datetime.fromtimestamp(os.path.getmtime(cache_path))).total_seconds() / 3600
-        today = datetime.now()
-        ref_date = datetime(int(yyyymm[:4]), int(yyyymm[4:6]), 1)
-        months_old = (today.year - ref_date.year) * 12 + today.month - ref_date.month
-        if months_old > 3 or age_hours < 24:
-            try:
-                return pd.read_parquet(cache_path)
-            except Exception:
-                pass
+def _row_groups_cnpjs(pf, cnpjs: list, grupos: list | None = None) -> list | None:
+    """Row groups de um parquet ordenado por cnpj_norm que podem ter algum dos
+    cnpjs (ordenados), pelo mín/máx de cada row group; None se o arquivo não
+    está ordenado por cnpj_norm ou não tem estatísticas.
 
-    # PL está dentro do ZIP combinado
-    url = CVM_ZIP_URL.format(yyyymm=yyyymm)
+    Com grupos, só entre esses row groups (um mês do parquet anual compactado,
+    ordenado dentro do mês). O filtro "in" do read_parquet não usa essas
+    estatísticas para pular row groups; com o arquivo ordenado, o índice sai
+    de graça do rodapé.
+    """
+    meta = pf.metadata
+    col = pf.schema_arrow.get_field_index("cnpj_norm")
+    if col < 0:
+        return None
+    if grupos is None:
+        grupos = list(range(meta.num_row_groups))
     try:
-        resp = requests.get(url, timeout=120)
-        if resp.status_code != 200:
-            return None
+        stats = [meta.row_group(i).column(col).statistics for i in grupos]
+        minimos = [estat.min for estat in stats]
+        maximos = [estat.max for estat in stats]
+    except Exception:
+        return None
+    if any(prox_min < max_ant for max_ant, prox_min in zip(maximos, minimos[1:])):
+        return None
+    selecionados = set()
+    for cnpj in cnpjs:
+        i = bisect.bisect_left(maximos, cnpj)
+        while i < len(minimos) and minimos[i] <= cnpj:  # fundo dividido entre row groups
+            selecionados.add(grupos[i])
+            i += 1
+    return sorted(selecionados)
+
+
+def _ler_parquet_cnpjs(path: str, cnpjs: set) -> pd.DataFrame:
+    """Linhas de um parquet da CVM só para os cnpjs (cnpj_norm).
+
+    Em arquivo ordenado por cnpj_norm (inf_diario), lê só os row groups que
+    podem ter esses fundos.
+    """
+    alvo = sorted(cnpjs)
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+        pf = pq.ParquetFile(path)
+        grupos = _row_groups_cnpjs(pf, alvo)
+        if grupos is not None:
+            tabela = pf.read_row_groups(grupos) if grupos else pf.schema_arrow.empty_table()
+            tabela = tabela.filter(pc.is_in(tabela["cnpj_norm"], value_set=pa.array(alvo, pa.string())))
+            return tabela.to_pandas()
+    except Exception:
+        pass
+    try:
+        return pd.read_parquet(path, filters=[("cnpj_norm", "in", alvo)])
+    except Exception:
+        pass  # cache anterior sem cnpj_norm
+    df = pd.read_parquet(path)
+    cnpj_col = next((c for c in _COLS_CNPJ_CVM if c in df.columns), None)
+    if cnpj_col is None:
+        return df.iloc[0:0]
+    df["cnpj_norm"] = _cnpjs_normalizados(df[cnpj_col])
+    return df[df["cnpj_norm"].isin(cnpjs)].reset_index(drop=True)
+
+
+def _invalidar_cache_cvm(cache_path: str) -> None:
+    _remover_download(cache_path)
+    with _LOCK_METADADOS:
+        if _metadados_cvm().pop(os.path.basename(cache_path), None) is not None:
+            _salvar_metadados_cvm()
+
+
+def _registrar_cache_cvm(cache_paths: list, url: str, validadores: tuple) -> None:
+    """Associa a cada cache gravado a versão de url que o gerou."""
+    if not cache_paths:
+        return
+    etag, modificado, tamanho = validadores
+    agora = time.time()
+    with _LOCK_METADADOS:
+        dados = _metadados_cvm()
+        for path in cache_paths:
+            dados[os.path.basename(path)] = {"url": url, "etag": etag, "last_modified": modificado,
+                                             "tamanho": tamanho or 0, "verificado_em": agora}
+        _salvar_metadados_cvm()
+
+
+def _condicional_cache_cvm(cache_path: str, url: str, yyyymm: str) -> dict:
+    """Cabeçalhos If-None-Match / If-Modified-Since para revalidar um cache
+    vencido contra a versão de url que o gerou ({} se não há o que revalidar)."""
+    if not _cache_cvm_vencido(cache_path, yyyymm):
+        return {}
+    with _LOCK_METADADOS:
+        meta = _metadados_cvm().get(os.path.basename(cache_path))
+    condicional = {}
+    if meta and meta["url"] == url:
+        if meta["etag"]:
+            condicional["If-None-Match"] = meta["etag"]
+        if meta["last_modified"]:
+            condicional["If-Modified-Since"] = meta["last_modified"]
+    return condicional
+
+
+def _renovar_cache_cvm(cache_path: str) -> None:
+    """Depois de um 304: marca como verificados agora todos os caches gerados
+    da mesma versão (todos os blocos do mês, no CDA)."""
+    agora = time.time()
+    with _LOCK_METADADOS:
+        dados = _metadados_cvm()
+        meta = dados[os.path.basename(cache_path)]
+        versao = (meta["url"], meta["etag"], meta["last_modified"])
+        for outro in dados.values():
+            if (outro["url"], outro["etag"], outro["last_modified"]) == versao:
+                outro["verificado_em"] = agora
+        _salvar_metadados_cvm()
+    _IO_REVALIDACAO["nao_modificados"] += 1
+    _IO_REVALIDACAO["bytes_evitados"] += meta["tamanho"]
+
+
+def _gravar_fixture_cvm(url: str, zip_path: str, validadores: tuple) -> None:
+    """Copia o ZIP baixado para CVM_FIXTURES_GRAVAR com o nome da URL e, como
+    mtime, o Last-Modified da CVM (o servidor de reprodução o devolve)."""
+    try:
+        os.makedirs(CVM_FIXTURES_GRAVAR, exist_ok=True)
+        destino = os.path.join(CVM_FIXTURES_GRAVAR, os.path.basename(urlparse(url).path))
+        tmp = _caminho_temporario(destino)
+        try:
+            shutil.copyfile(zip_path, tmp)
+            if validadores[1]:
+                modificado = parsedate_to_datetime(validadores[1]).timestamp()
+                os.utime(tmp, (modificado, modificado))
+            os.replace(tmp, destino)
+        finally:
+            _remover_download(tmp)
+    except Exception:
+        pass
 
-        with zipfile.ZipFile(io.BytesIO(resp.content)) as zf:
-            pl_names = [n for n in zf.namelist() if "_PL_" in n and n.endswith(".csv")]
-            if not pl_names:
-                return None
-            with zf.open(pl_names[0]) as csvfile:
-                df = pd.read_csv(csvfile, sep=";", encoding="latin-1", low_memory=False)
 
-        df.to_parquet(cache_path, index=False)
+def _cache_cvm(cache_path: str, yyyymm: str, url: str, timeout: float, gravar,
+               cnpjs: set | None = None) -> pd.DataFrame | None:
+    """DataFrame do cache_path (com cnpjs, só esses fundos), baixando url se
+    o cache não existe ou venceu.
+
+    gravar(zip_path) grava os caches a partir do ZIP baixado (com escrita
+    atômica) e devolve a lista dos caminhos gravados; um ZIP pode alimentar
+    vários caches (os blocos do CDA). None se a CVM não tem o arquivo ou o
+    cache pedido não saiu do ZIP.
+    """
+    df = _ler_cache_cvm(cache_path, yyyymm, cnpjs)
+    if df is not None:
         return df
+    with _LOCK_LOCKS_URL:
+        lock = _LOCKS_URL_CVM[url]
+    with lock:
+        df = _ler_cache_cvm(cache_path, yyyymm, cnpjs)  # gravado por outro worker enquanto esperava
+        if df is not None:
+            return df
+
+        zip_path = None
+        try:
+            zip_path, validadores = _baixar_para_disco(url, timeout,
+                                                       _condicional_cache_cvm(cache_path, url, yyyymm))
+            if zip_path is _NAO_MODIFICADO:
+                zip_path = None
+                _renovar_cache_cvm(cache_path)
+                df = _ler_cache_cvm(cache_path, yyyymm, cnpjs)
+                if df is not None:
+                    return df
+                zip_path, validadores = _baixar_para_disco(url, timeout)  # cache ilegível
+            if zip_path is None:
+                return None
+            if CVM_FIXTURES_GRAVAR:
+                _gravar_fixture_cvm(url, zip_path, validadores)
+            gravados = gravar(zip_path)
+        except Exception:
+            return None
+        finally:
+            if zip_path:
+                _remover_download(zip_path)
+
+        _registrar_cache_cvm(gravados, url, validadores)
+        df = _ler_cache_cvm(cache_path, yyyymm, cnpjs) if cache_path in gravados else None
+    if _limite_cache_cvm_excedido(gravados):
+        liberar_cache_cvm()
+    return df
+
+
+def estatisticas_revalidacao() -> dict:
+    """Arquivos da CVM que responderam 304 e os bytes que não foram baixados."""
+    return dict(_IO_REVALIDACAO)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Orçamento do cache da CVM: LRU e compactação dos meses antigos
+# ──────────────────────────────────────────────────────────────────────────────
+# Com 120 meses de inf_diario e 36 de CDA (oito blocos + PL por mês), o
+# cache/ cresce sem limite. Dois mecanismos o mantêm num orçamento:
+#
+# - LRU: cada leitura de cache anota a hora do acesso (persistida em
+#   cache/cvm_acessos.parquet nas operações de governança; sem registro, vale o
+#   mtime). Se o total dos parquets da CVM passa de CVM_CACHE_LIMITE_MB, os
+#   menos usados são apagados até caber; os blocos que o ZIP combinado grava e
+#   ninguém lê (fora de _BLOCOS_SOB_DEMANDA: BLC_3, BLC_7, BLC_8) são os
+#   primeiros a sair. Um cache apagado só volta a ser baixado se for pedido de
+#   novo. Depois de um download, a varredura da pasta só roda se o total
+#   conhecido (última varredura + parquets gravados desde então) passou do
+#   limite; o export aplica o limite uma vez no fim, em _governar_cache_cvm.
+# - Compactação: os meses com mais de CVM_MESES_RECENTES meses não mudam mais
+#   (cache permanente); os de um mesmo dataset e ano viram um único parquet,
+#   cvm_{dataset}_{AAAA}.parquet, com os row groups de cada mês contíguos e
+#   o índice mês -> (row groups, colunas) nos metadados do esquema. A leitura
+#   de um mês compactado lê só os row groups dele (e, no inf_diario, ordenado
+#   por cnpj_norm dentro do mês, só os dos fundos pedidos).
+CVM_CACHE_LIMITE_MB = float(os.environ.get("CVM_CACHE_LIMITE_MB", 10_000))  # 0 = sem limite
+_RE_CACHE_CVM = re.compile(r"^cvm_(blc\d+|pl|inf_diario)_(\d{6}|\d{4})(_filtered)?\.parquet$")
+_CHAVE_MESES_COMPACTADOS = b"cvm_meses"
+_ACESSOS_CVM = {}  # caminho do parquet -> último acesso neste processo
+_BYTES_CACHE_CVM = {}  # CACHE_DIR -> total conhecido dos parquets da CVM
+_LOCK_GOVERNANCA = threading.Lock()
+
+
+def _acessos_cvm() -> dict:
+    """{nome do parquet: último acesso}: o persistido mais os deste processo."""
+    acessos = {}
+    try:
+        df = pd.read_parquet(os.path.join(CACHE_DIR, "cvm_acessos.parquet"))
+        acessos = dict(zip(df["arquivo"], df["acesso"].astype(float)))
     except Exception:
-        return None
+        pass
+    for path, quando in list(_ACESSOS_CVM.items()):
+        if os.path.dirname(path) == CACHE_DIR:
+            nome = os.path.basename(path)
+            acessos[nome] = max(acessos.get(nome, 0.0), quando)
+    return acessos
+
+
+def _arquivos_cache_cvm() -> list[dict]:
+    """Um dict por parquet de cache da CVM em CACHE_DIR: arquivo, path,
+    dataset, periodo (AAAAMM; AAAA se compactado), filtrado (formato
+    anterior), bytes e acesso (último acesso; mtime se nunca lido)."""
+    acessos = _acessos_cvm()
+    arquivos = []
+    try:
+        with os.scandir(CACHE_DIR) as it:
+            entradas = list(it)
+    except OSError:
+        return arquivos
+    for entrada in entradas:
+        m = _RE_CACHE_CVM.match(entrada.name)
+        if not m:
+            continue
+        try:
+            info = entrada.stat()
+        except OSError:
+            continue
+        arquivos.append({"arquivo": entrada.name, "path": entrada.path, "dataset": m.group(1),
+                         "periodo": m.group(2), "filtrado": bool(m.group(3)), "bytes": info.st_size,
+                         "acesso": max(acessos.get(entrada.name, 0.0), info.st_mtime)})
+    return arquivos
 
 
-def _download_cvm_blc(blc_num: int, yyyymm: str) -> pd.DataFrame | None:
-    """Baixa e cacheia um mês de dados CVM BLC_{blc_num} (genérico)."""
-    if blc_num == 4:
-        return _download_cvm_blc4(yyyymm)
+def _salvar_acessos_cvm(arquivos: list[dict]) -> None:
+    df = pd.DataFrame({"arquivo": [a["arquivo"] for a in arquivos],
+                       "acesso": [a["acesso"] for a in arquivos]})
+    try:
+        _gravar_parquet_atomico(df, os.path.join(CACHE_DIR, "cvm_acessos.parquet"))
+    except Exception:
+        pass
 
-    os.makedirs(CACHE_DIR, exist_ok=True)
-    cache_path = os.path.join(CACHE_DIR, f"cvm_blc{blc_num}_{yyyymm}.parquet")
-
-    if os.path.exists(cache_path):
-        age_hours = (datetime.now() - datetime.fromtimestamp(
-            os.path.getmtime(cache_path))).total_seconds() / 3600
-        today = datetime.now()
-        ref_date = datetime(int(yyyymm[:4]), int(yyyymm[4:6]), 1)
-        months_old = (today.year - ref_date.year) * 12 + today.month - ref_date.month
-        if months_old > 3 or age_hours < 24:
-            try:
-                return pd.read_parquet(cache_path)
-            except Exception:
-                pass
 
-    blc_tag = f"BLC_{blc_num}"
-    df = None
-    # Tentar ZIP individual (menor) primeiro, depois combinado
-    for url in [
-        f"https://dados.cvm.gov.br/dados/FI/DOC/CDA/DADOS/cda_fi_BLC_{blc_num}_{yyyymm}.zip",
-        CVM_ZIP_URL.format(yyyymm=yyyymm),
-    ]:
+def _remover_caches_cvm(arquivos: list[dict]) -> int:
+    """Apaga os parquets e seus metadados; retorna os bytes liberados."""
+    liberados = 0
+    removidos = []
+    for a in arquivos:
+        try:
+            os.remove(a["path"])
+        except OSError:
+            continue
+        liberados += a["bytes"]
+        removidos.append(a["arquivo"])
+        _ACESSOS_CVM.pop(a["path"], None)
+    if removidos:
+        with _LOCK_METADADOS:
+            dados = _metadados_cvm()
+            if any([dados.pop(nome, None) is not None for nome in removidos]):
+                _salvar_metadados_cvm()
+    return liberados
+
+
+def _limite_cache_cvm_excedido(gravados: list) -> bool:
+    """Soma os parquets recém-gravados ao total conhecido do cache; True se o
+    total passou de CVM_CACHE_LIMITE_MB ou ainda não foi medido neste processo
+    (um cache reescrito conta de novo: no pior caso, uma varredura a mais)."""
+    if CVM_CACHE_LIMITE_MB <= 0 or not gravados:
+        return False
+    novos = 0
+    for path in gravados:
         try:
-            resp = requests.get(url, timeout=180)
-            if resp.status_code != 200:
+            novos += os.path.getsize(path)
+        except OSError:
+            pass
+    with _LOCK_GOVERNANCA:
+        total = _BYTES_CACHE_CVM.get(CACHE_DIR)
+        if total is None:
+            return True
+        _BYTES_CACHE_CVM[CACHE_DIR] = total + novos
+        return total + novos > CVM_CACHE_LIMITE_MB * 1e6
+
+
+def _cache_cvm_sem_leitor(dataset: str) -> bool:
+    """Bloco do CDA que o ZIP combinado grava mas nenhuma leitura usa."""
+    return dataset.startswith("blc") and int(dataset[3:]) not in _BLOCOS_SOB_DEMANDA
+
+
+def liberar_cache_cvm(limite_mb: float | None = None) -> dict:
+    """Apaga os parquets de cache da CVM menos usados até o total caber em
+    limite_mb (padrão CVM_CACHE_LIMITE_MB; 0 = sem limite).
+
+    Retorna {"removidos", "bytes_liberados", "bytes_total"}.
+    """
+    limite = (CVM_CACHE_LIMITE_MB if limite_mb is None else limite_mb) * 1e6
+    with _LOCK_GOVERNANCA:
+        arquivos = _arquivos_cache_cvm()
+        total = sum(a["bytes"] for a in arquivos)
+        vitimas = []
+        if limite > 0 and total > limite:
+            excesso = total - limite
+            # Blocos sem leitor primeiro; dentro de cada grupo, o menos usado
+            for a in sorted(arquivos, key=lambda a: (not _cache_cvm_sem_leitor(a["dataset"]), a["acesso"])):
+                if excesso <= 0:
+                    break
+                vitimas.append(a)
+                excesso -= a["bytes"]
+        liberados = _remover_caches_cvm(vitimas)
+        removidos = {a["arquivo"] for a in vitimas}
+        _salvar_acessos_cvm([a for a in arquivos if a["arquivo"] not in removidos])
+        _BYTES_CACHE_CVM[CACHE_DIR] = total - liberados
+    return {"removidos": len(vitimas), "bytes_liberados": liberados, "bytes_total": total - liberados}
+
+
+def _meses_compactados(pf) -> dict:
+    """Índice {AAAAMM: {"row_groups": [início, fim), "colunas": [...]}} de um
+    parquet anual compactado."""
+    import json
+    meta = pf.schema_arrow.metadata or {}
+    return json.loads(meta[_CHAVE_MESES_COMPACTADOS]) if _CHAVE_MESES_COMPACTADOS in meta else {}
+
+
+@functools.lru_cache(maxsize=64)
+def _rodape_compactado(path: str, mtime_ns: int, tamanho: int) -> tuple:
+    """(FileMetaData, índice de meses) de um parquet anual; a chave inclui
+    mtime e tamanho, então uma recompactação invalida a entrada."""
+    import pyarrow.parquet as pq
+    pf = pq.ParquetFile(path)
+    return pf.metadata, _meses_compactados(pf)
+
+
+def _ler_cache_cvm_compactado(cache_path: str, yyyymm: str, cnpjs: set | None = None) -> pd.DataFrame | None:
+    """O mês de cache_path lido do parquet anual do dataset; None se o mês não
+    foi compactado. Devolve as colunas do parquet mensal original."""
+    m = _RE_CACHE_CVM.match(os.path.basename(cache_path))
+    if not m or m.group(3):
+        return None
+    anual = os.path.join(CACHE_DIR, f"cvm_{m.group(1)}_{yyyymm[:4]}.parquet")
+    if not os.path.exists(anual):
+        return None
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+        info_arq = os.stat(anual)
+        meta, meses = _rodape_compactado(anual, info_arq.st_mtime_ns, info_arq.st_size)
+        info = meses.get(yyyymm)
+        if info is None:
+            return None
+        pf = pq.ParquetFile(anual, metadata=meta)
+        colunas = info["colunas"]
+        grupos = list(range(*info["row_groups"]))
+        if cnpjs is not None and "cnpj_norm" in colunas:
+            alvo = sorted(cnpjs)
+            selecionados = _row_groups_cnpjs(pf, alvo, grupos)
+            if selecionados is not None:
+                grupos = selecionados
+        if grupos:
+            tabela = pf.read_row_groups(grupos, columns=colunas)
+        else:
+            tabela = pf.schema_arrow.empty_table().select(colunas)
+        if cnpjs is not None and "cnpj_norm" in colunas:
+            tabela = tabela.filter(pc.is_in(tabela["cnpj_norm"], value_set=pa.array(alvo, pa.string())))
+        df = tabela.to_pandas()
+    except Exception:
+        return None
+    if cnpjs is not None and "cnpj_norm" not in colunas:  # mês gravado antes de cnpj_norm
+        cnpj_col = next((c for c in _COLS_CNPJ_CVM if c in df.columns), None)
+        if cnpj_col is None:
+            return df.iloc[0:0]
+        df["cnpj_norm"] = _cnpjs_normalizados(df[cnpj_col])
+        df = df[df["cnpj_norm"].isin(cnpjs)].reset_index(drop=True)
+    _ACESSOS_CVM[anual] = time.time()
+    return df
+
+
+def _compactar_ano(destino: str, dataset: str, mensais: list[dict]) -> int:
+    """Grava destino com os meses de mensais mais os que já estavam nele
+    (o parquet mensal prevalece); retorna o número de meses no arquivo."""
+    import json
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # mês -> (esquema, linhas, colunas originais, leitor da tabela)
+    fontes = {}
+    if os.path.exists(destino):
+        pf_antigo = pq.ParquetFile(destino)
+        for mes, info in _meses_compactados(pf_antigo).items():
+            grupos = list(range(*info["row_groups"]))
+            linhas = sum(pf_antigo.metadata.row_group(i).num_rows for i in grupos)
+            fontes[mes] = (pf_antigo.schema_arrow.remove_metadata(), linhas, info["colunas"],
+                           lambda g=grupos, c=info["colunas"]:
+                               pf_antigo.read_row_groups(g, columns=c) if g
+                               else pf_antigo.schema_arrow.empty_table().select(c))
+    for a in mensais:
+        pf = pq.ParquetFile(a["path"])
+        fontes[a["periodo"]] = (pf.schema_arrow.remove_metadata(), pf.metadata.num_rows,
+                                pf.schema_arrow.names, lambda path=a["path"]: pq.read_table(path))
+
+    esquema = pa.unify_schemas([f[0] for f in fontes.values()], promote_options="permissive")
+    por_grupo = _LINHAS_ROW_GROUP_INF if dataset == "inf_diario" else _LINHAS_ROW_GROUP
+    indice, inicio = {}, 0
+    for mes in sorted(fontes):
+        n_grupos = -(-fontes[mes][1] // por_grupo)
+        indice[mes] = {"row_groups": [inicio, inicio + n_grupos], "colunas": fontes[mes][2]}
+        inicio += n_grupos
+    esquema = esquema.with_metadata({_CHAVE_MESES_COMPACTADOS: json.dumps(indice)})
+
+    tmp = _caminho_temporario(destino)
+    try:
+        with pq.ParquetWriter(tmp, esquema) as writer:
+            for mes in sorted(fontes):
+                tabela = fontes[mes][3]()
+                for campo in esquema:
+                    if campo.name not in tabela.column_names:
+                        tabela = tabela.append_column(campo.name, pa.nulls(len(tabela), campo.type))
+                tabela = tabela.select(esquema.names).cast(esquema)
+                if len(tabela):
+                    writer.write_table(tabela, row_group_size=por_grupo)
+        if pq.read_metadata(tmp).num_row_groups != inicio:
+            raise ValueError(f"{destino}: row groups fora do índice")
+        os.replace(tmp, destino)
+    finally:
+        _remover_download(tmp)
+    return len(indice)
+
+
+def compactar_cache_cvm() -> dict:
+    """Junta os meses permanentes (mais de CVM_MESES_RECENTES meses) de cada
+    dataset num parquet por ano e apaga os mensais; apaga também os
+    inf_diario _filtered do formato anterior.
+
+    Retorna {arquivo anual: {"meses", "compactados", "bytes_antes", "bytes_depois"}}.
+    """
+    resultado = {}
+    with _LOCK_GOVERNANCA:
+        arquivos = _arquivos_cache_cvm()
+        _remover_caches_cvm([a for a in arquivos if a["filtrado"]])
+        anos = defaultdict(list)
+        for a in arquivos:
+            if (not a["filtrado"] and len(a["periodo"]) == 6
+                    and _meses_desde(a["periodo"]) > CVM_MESES_RECENTES):
+                anos[(a["dataset"], a["periodo"][:4])].append(a)
+        for (dataset, ano), mensais in sorted(anos.items()):
+            nome = f"cvm_{dataset}_{ano}.parquet"
+            destino = os.path.join(CACHE_DIR, nome)
+            antes = sum(a["bytes"] for a in mensais)
+            antes += os.path.getsize(destino) if os.path.exists(destino) else 0
+            try:
+                meses = _compactar_ano(destino, dataset, mensais)
+            except Exception:
                 continue
-            with zipfile.ZipFile(io.BytesIO(resp.content)) as zf:
-                csv_names = [n for n in zf.namelist()
-                             if blc_tag in n and n.endswith(".csv")]
-                if not csv_names:
+            _remover_caches_cvm(mensais)
+            _ACESSOS_CVM[destino] = max(a["acesso"] for a in mensais)
+            resultado[nome] = {"meses": meses, "compactados": len(mensais),
+                               "bytes_antes": antes, "bytes_depois": os.path.getsize(destino)}
+        _salvar_acessos_cvm(_arquivos_cache_cvm())
+    return resultado
+
+
+def estatisticas_cache_cvm() -> pd.DataFrame:
+    """Uso do cache da CVM: uma linha por parquet, com dataset, periodo
+    (AAAAMM; AAAA se compactado), filtrado, bytes e acesso."""
+    arquivos = _arquivos_cache_cvm()
+    return pd.DataFrame(arquivos, columns=["arquivo", "dataset", "periodo", "filtrado", "bytes", "acesso"])
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# CDA: um download por mês alimenta o cache de todos os blocos
+# ──────────────────────────────────────────────────────────────────────────────
+# O ZIP combinado cda_fi_AAAAMM.zip traz todos os blocos (BLC_1..BLC_8) e o PL.
+# Cada bloco pedido (e o PL) baixava o mesmo arquivo de novo; agora o primeiro
+# pedido do mês baixa o ZIP uma vez e grava o parquet de cada bloco. Pedidos
+# simultâneos do mesmo mês (blocos em paralelo) esperam esse download no lock
+# da URL (_cache_cvm) e leem do cache.
+_RE_BLOCO_CDA = re.compile(r"_(BLC_\d+|PL)_", re.I)
+_MESES_CDA_BAIXADOS = {}  # yyyymm -> [tamanho do ZIP, blocos gravados ainda não pedidos]
+_IO_CDA = {"downloads": 0, "bytes_baixados": 0, "bytes_evitados": 0, "meses_pulados": 0}
+
+
+def _registrar_uso_cda(bloco: str, yyyymm: str) -> None:
+    """Conta como economizado o ZIP do mês que este bloco baixaria sozinho."""
+    mes = _MESES_CDA_BAIXADOS.get(yyyymm)
+    if mes and bloco in mes[1]:
+        mes[1].discard(bloco)
+        _IO_CDA["bytes_evitados"] += mes[0]
+
+
+def _bloco_cda_mes(bloco: str, yyyymm: str, cnpjs: set | None = None) -> pd.DataFrame | None:
+    """DataFrame do bloco ('BLC_4', 'PL'...) do mês, do cache ou do ZIP combinado.
+
+    O ZIP é baixado no máximo uma vez por mês e processo; todos os CSVs de
+    bloco dele vão para o cache, um parquet por bloco. Com cnpjs, devolve só
+    as linhas desses fundos.
+    """
+    baixado = []
+
+    def gravar(zip_path):
+        gravados = set()
+        with zipfile.ZipFile(zip_path) as zf:
+            for nome in zf.namelist():
+                m = _RE_BLOCO_CDA.search(nome)
+                if not m or not nome.endswith(".csv"):
                     continue
-                with zf.open(csv_names[0]) as csvfile:
-                    df = pd.read_csv(csvfile, sep=";", encoding="latin-1",
-                                     low_memory=False)
-            break
+                bloco_zip = m.group(1).upper()
+                _gravar_csv_cvm_parquet(zf, nome, bloco_zip, _cache_cvm_path(bloco_zip, yyyymm))
+                gravados.add(bloco_zip)
+        _indexar_mes_cda(yyyymm, {b: _cache_cvm_path(b, yyyymm) for b in gravados})
+        tamanho_zip = os.path.getsize(zip_path)
+        _IO_CDA["downloads"] += 1
+        _IO_CDA["bytes_baixados"] += tamanho_zip
+        _MESES_CDA_BAIXADOS[yyyymm] = [tamanho_zip, gravados - {bloco}]
+        baixado.append(bloco)
+        return [_cache_cvm_path(b, yyyymm) for b in gravados]
+
+    df = _cache_cvm(_cache_cvm_path(bloco, yyyymm), yyyymm, CVM_ZIP_URL.format(yyyymm=yyyymm),
+                    180, gravar, cnpjs)
+    if df is not None and not baixado:
+        _registrar_uso_cda(bloco, yyyymm)
+    return df
+
+
+def estatisticas_cda() -> dict:
+    """Downloads do ZIP combinado do CDA e bytes que deixaram de ser baixados
+    por bloco (cada bloco servido pelo download de outro conta um ZIP)."""
+    return dict(_IO_CDA)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Índice CNPJ -> meses do CDA
+# ──────────────────────────────────────────────────────────────────────────────
+# Quais fundos têm posição em cada mês do CDA já baixado, nos blocos lidos pela
+# busca sob demanda (cache/cvm_indice_cda.parquet: yyyymm + chave int64 do
+# CNPJ, ver _cnpjs_normalizados). Atualizado sempre que o ZIP combinado de um
+# mês é gravado no cache. Com ele a busca pula os meses em que nenhum fundo
+# pendente aparece e vai direto ao último mês de cada um, mesmo que o parquet
+# do mês já tenha saído do cache. Mês fora do índice (nunca baixado, ou no
+# formato antigo de um ZIP por bloco) segue sendo baixado; mês recente só vale
+# enquanto o cache dele está em dia, porque a CVM ainda republica esses meses
+# com fundos que entregaram atrasado.
+_ARQUIVO_INDICE_CDA = "cvm_indice_cda.parquet"
+_INDICE_CDA = {}  # CACHE_DIR -> {yyyymm: np.ndarray int64 ordenado}
+_LOCK_INDICE_CDA = threading.Lock()
+
+
+def _blocos_indice_cda() -> list[str]:
+    return [f"BLC_{n}" for n in _BLOCOS_SOB_DEMANDA]
+
+
+def _indice_cda() -> dict:
+    """Índice do CACHE_DIR atual (chamar com _LOCK_INDICE_CDA)."""
+    if CACHE_DIR not in _INDICE_CDA:
+        meses = {}
+        try:
+            df = pd.read_parquet(os.path.join(CACHE_DIR, _ARQUIVO_INDICE_CDA))
+            for ym, cnpjs in df.groupby("yyyymm", sort=False)["cnpj"]:
+                meses[ym] = np.sort(cnpjs.to_numpy(dtype=np.int64))
         except Exception:
-            continue
+            pass
+        _INDICE_CDA[CACHE_DIR] = meses
+    return _INDICE_CDA[CACHE_DIR]
 
-    if df is None:
+
+def _salvar_indice_cda() -> None:
+    """Persiste o índice do CACHE_DIR atual (chamar com _LOCK_INDICE_CDA)."""
+    meses = _indice_cda()
+    df = pd.DataFrame({
+        "yyyymm": np.repeat(list(meses), [len(c) for c in meses.values()]).astype(str),
+        "cnpj": np.concatenate(list(meses.values())) if meses else np.array([], dtype=np.int64),
+    })
+    try:
+        _gravar_parquet_atomico(df, os.path.join(CACHE_DIR, _ARQUIVO_INDICE_CDA))
+    except Exception:
+        pass
+
+
+def _cnpjs_cache_cvm(cache_path: str, yyyymm: str) -> np.ndarray | None:
+    """Chaves int64 distintas dos fundos de um parquet de cache da CVM (mensal
+    ou o mês no anual compactado), lendo só a coluna do CNPJ; None se o mês
+    não está em cache."""
+    try:
+        import pyarrow.parquet as pq
+        grupos = None
+        if os.path.exists(cache_path):
+            pf = pq.ParquetFile(cache_path)
+            nomes = pf.schema_arrow.names
+        else:
+            m = _RE_CACHE_CVM.match(os.path.basename(cache_path))
+            anual = os.path.join(CACHE_DIR, f"cvm_{m.group(1)}_{yyyymm[:4]}.parquet")
+            info_arq = os.stat(anual)
+            meta, meses = _rodape_compactado(anual, info_arq.st_mtime_ns, info_arq.st_size)
+            pf = pq.ParquetFile(anual, metadata=meta)
+            nomes = meses[yyyymm]["colunas"]
+            grupos = list(range(*meses[yyyymm]["row_groups"]))
+        col = next((c for c in ("cnpj_norm", *_COLS_CNPJ_CVM) if c in nomes), None)
+        if col is None:
+            return np.array([], dtype=np.int64)
+        tabela = pf.read(columns=[col]) if grupos is None else pf.read_row_groups(grupos, columns=[col])
+        return np.unique(_cnpjs_arrow(tabela[col], inteiro=True).to_numpy())
+    except Exception:
         return None
-    df.to_parquet(cache_path, index=False)
-    return df
+
+
+def _indexar_mes_cda(yyyymm: str, caminhos: dict) -> bool:
+    """Registra no índice os fundos do mês ({bloco: parquet} com os blocos do
+    ZIP combinado). Só indexa se todos os blocos do índice foram lidos."""
+    partes = []
+    for bloco in _blocos_indice_cda():
+        if bloco not in caminhos:
+            continue  # bloco ausente do ZIP do mês: nenhum fundo nele
+        cnpjs = _cnpjs_cache_cvm(caminhos[bloco], yyyymm)
+        if cnpjs is None:
+            return False
+        partes.append(cnpjs)
+    if not partes:
+        return False
+    with _LOCK_INDICE_CDA:
+        _indice_cda()[yyyymm] = np.unique(np.concatenate(partes))
+        _salvar_indice_cda()
+    return True
+
+
+def _fundos_no_mes_cda(yyyymm: str, cnpjs: set) -> set | None:
+    """Os cnpjs que têm posição no mês segundo o índice; None se o índice não
+    sabe (mês não indexado, ou recente com cache vencido ou removido)."""
+    with _LOCK_INDICE_CDA:
+        presentes = _indice_cda().get(yyyymm)
+    if presentes is None:
+        return None
+    if _meses_desde(yyyymm) <= CVM_MESES_RECENTES:
+        path = _cache_cvm_path(_blocos_indice_cda()[0], yyyymm)
+        if not os.path.exists(path) or _cache_cvm_vencido(path, yyyymm):
+            return None
+    alvo = list(cnpjs)
+    chaves = np.array([_cnpj_int(c) for c in alvo], dtype=np.int64)
+    return {c for c, ok in zip(alvo, np.isin(chaves, presentes)) if ok}
+
+
+def indexar_cache_cda() -> int:
+    """Indexa os meses do CDA que já estavam em cache (mensais ou compactados)
+    antes do índice existir; retorna quantos meses entraram no índice."""
+    with _LOCK_INDICE_CDA:
+        indexados = set(_indice_cda())
+    periodos = {a["periodo"] for a in _arquivos_cache_cvm() if a["dataset"].startswith("blc")}
+    meses = set()
+    for periodo in periodos:
+        if len(periodo) == 6:
+            meses.add(periodo)
+        else:  # anual compactado: os meses estão no índice do rodapé
+            try:
+                anual = os.path.join(CACHE_DIR, f"cvm_blc4_{periodo}.parquet")
+                info_arq = os.stat(anual)
+                meses.update(_rodape_compactado(anual, info_arq.st_mtime_ns, info_arq.st_size)[1])
+            except Exception:
+                pass
+    novos = 0
+    for ym in sorted(meses - indexados):
+        caminhos = {b: _cache_cvm_path(b, ym) for b in _blocos_indice_cda()}
+        novos += _indexar_mes_cda(ym, caminhos)
+    return novos
 
 
 # ──────────────────────────────────────────────────────────────────────────────
-# Busca sob demanda de carteiras CVM (para explosão de fundos investidos)
+# Download e parse CVM BLC_n / PL
 # ──────────────────────────────────────────────────────────────────────────────
-_COLS_POSICOES = ["cnpj_fundo", "data", "ativo", "valor", "pl", "pct_pl", "setor", "fonte"]
+def _download_cvm_blc4(yyyymm: str, cnpjs: set | None = None) -> pd.DataFrame | None:
+    """Baixa e cacheia um mês de dados CVM BLC_4 (com cnpjs, só esses fundos)."""
+    return _download_cvm_blc(4, yyyymm, cnpjs)
+
+
+def _download_cvm_pl(yyyymm: str, cnpjs: set | None = None) -> pd.DataFrame | None:
+    """Baixa dados de PL (Patrimonio Liquido) do arquivo CDA PL da CVM."""
+    # PL só existe dentro do ZIP combinado
+    return _bloco_cda_mes("PL", yyyymm, cnpjs)
 
 
-def _processar_blc4_cnpjs(df_blc4: pd.DataFrame, cnpjs: set) -> pd.DataFrame:
-    """Extrai TODAS as posições do BLC_4 (demais ativos) para CNPJs específicos.
+def _download_cvm_blc(blc_num: int, yyyymm: str, cnpjs: set | None = None) -> pd.DataFrame | None:
+    """Baixa e cacheia um mês de dados CVM BLC_{blc_num} (genérico).
 
-    BLC_4 contém: ações, BDRs, ETFs, opções, warrants, recebíveis, etc.
-    Captura TUDO para permitir explosão 100%.
+    O cache guarda o bloco inteiro; com cnpjs, devolve só esses fundos.
     """
-    cnpj_col = "CNPJ_FUNDO_CLASSE" if "CNPJ_FUNDO_CLASSE" in df_blc4.columns else "CNPJ_FUNDO"
-    if cnpj_col not in df_blc4.columns or "VL_MERC_POS_FINAL" not in df_blc4.columns:
-        return pd.DataFrame()
+    blc_tag = f"BLC_{blc_num}"
 
-    df = df_blc4.copy()
-    df["cnpj_fundo"] = df[cnpj_col].apply(_normalizar_cnpj)
-    df = df[df["cnpj_fundo"].isin(cnpjs)].copy()
-    if df.empty:
-        return pd.DataFrame()
+    # ZIP combinado (formato novo): um download serve todos os blocos do mês
+    df = _bloco_cda_mes(blc_tag, yyyymm, cnpjs)
+    if df is not None:
+        return df
 
-    df = df[df["VL_MERC_POS_FINAL"] > 0].copy()
-    if df.empty:
-        return pd.DataFrame()
+    # ZIP individual do bloco (formato antigo)
+    url = (CVM_BLC4_ZIP_URL if blc_num == 4 else CVM_BLC_ZIP_URL).format(blc_num=blc_num, yyyymm=yyyymm)
+    cache_path = _cache_cvm_path(blc_tag, yyyymm)
 
-    # Classificar cada posição pelo TP_APLIC
-    tp_col = "TP_APLIC" if "TP_APLIC" in df.columns else None
-    cd_col = "CD_ATIVO" if "CD_ATIVO" in df.columns else None
-    ds_col = "DS_ATIVO" if "DS_ATIVO" in df.columns else None
-
-    def _make_ativo_setor(row):
-        tp = str(row[tp_col]).strip() if tp_col and pd.notna(row.get(tp_col)) else ""
-        cd = str(row[cd_col]).strip().upper() if cd_col and pd.notna(row.get(cd_col)) else ""
-        ds = str(row[ds_col]).strip() if ds_col and pd.notna(row.get(ds_col)) else ""
-
-        is_stock = bool(re.search(
-            r"A.{1,3}es|Brazilian Depository|Certificado|Units", tp, re.IGNORECASE))
-        if is_stock and cd and len(cd) >= 4:
-            return cd, classificar_setor(cd)
-        if re.search(r"Op..es|Termo|Futuro|Swap", tp, re.IGNORECASE):
-            return (f"DERIV {cd}" if cd else f"DERIV {ds[:20]}"), "Derivativos"
-        if cd and len(cd) >= 4:
-            return cd, classificar_setor(cd)
-        return (f"OUTROS {ds[:25]}" if ds else f"OUTROS {tp[:20]}"), "Outros"
-
-    result = df.apply(_make_ativo_setor, axis=1, result_type="expand")
-    df["ativo"] = result[0]
-    df["setor"] = result[1]
-    return df[["cnpj_fundo", "DT_COMPTC", "ativo", "VL_MERC_POS_FINAL", "setor"]].rename(
-        columns={"DT_COMPTC": "data", "VL_MERC_POS_FINAL": "valor"})
-
-
-def _processar_blc_generico_cnpjs(df_blc: pd.DataFrame, cnpjs: set,
-                                   setor_default: str, prefix: str) -> pd.DataFrame:
-    """Processa BLC genérico (5=depósitos, 6=debêntures, 7=agro, 8=exterior)."""
-    cnpj_col = "CNPJ_FUNDO_CLASSE" if "CNPJ_FUNDO_CLASSE" in df_blc.columns else "CNPJ_FUNDO"
-    if cnpj_col not in df_blc.columns or "VL_MERC_POS_FINAL" not in df_blc.columns:
-        return pd.DataFrame()
+    def gravar(zip_path):
+        with zipfile.ZipFile(zip_path) as zf:
+            csv_names = [n for n in zf.namelist()
+                         if blc_tag in n and n.endswith(".csv")]
+            if not csv_names:
+                return []
+            _gravar_csv_cvm_parquet(zf, csv_names[0], blc_tag, cache_path)
+        return [cache_path]
 
-    df = df_blc.copy()
-    df["cnpj_fundo"] = df[cnpj_col].apply(_normalizar_cnpj)
-    df = df[df["cnpj_fundo"].isin(cnpjs)].copy()
-    if df.empty:
-        return pd.DataFrame()
+    return _cache_cvm(cache_path, yyyymm, url, 180, gravar, cnpjs)
 
-    df = df[df["VL_MERC_POS_FINAL"] > 0].copy()
-    if df.empty:
-        return pd.DataFrame()
 
-    cd_col = "CD_ATIVO" if "CD_ATIVO" in df.columns else None
-    ds_col = "DS_ATIVO" if "DS_ATIVO" in df.columns else None
+# ──────────────────────────────────────────────────────────────────────────────
+# Busca sob demanda de carteiras CVM (para explosão de fundos investidos)
+# ──────────────────────────────────────────────────────────────────────────────
+_COLS_POSICOES = ["cnpj_fundo", "data", "ativo", "valor", "pl", "pct_pl", "setor", "fonte"]
 
-    def _make_ativo(row):
-        cd = str(row[cd_col]).strip() if cd_col and pd.notna(row.get(cd_col)) else ""
-        ds = str(row[ds_col]).strip()[:25] if ds_col and pd.notna(row.get(ds_col)) else ""
-        return f"{prefix} {cd}" if cd else (f"{prefix} {ds}" if ds else prefix)
 
-    df["ativo"] = df.apply(_make_ativo, axis=1)
-    df["setor"] = setor_default
-    return df[["cnpj_fundo", "DT_COMPTC", "ativo", "VL_MERC_POS_FINAL", "setor"]].rename(
-        columns={"DT_COMPTC": "data", "VL_MERC_POS_FINAL": "valor"})
+_RE_TP_ACAO = re.compile(r"A.{1,3}es|Brazilian Depository|Certificado|Units", re.IGNORECASE)
+_RE_TP_DERIVATIVO = re.compile(r"Op..es|Termo|Futuro|Swap", re.IGNORECASE)
 
 
-def _processar_blc2_cnpjs(df_blc2: pd.DataFrame, cnpjs: set) -> pd.DataFrame:
-    """Extrai cotas de fundos investidos (BLC_2) para CNPJs específicos."""
-    cnpj_col = "CNPJ_FUNDO_CLASSE" if "CNPJ_FUNDO_CLASSE" in df_blc2.columns else "CNPJ_FUNDO"
-    if cnpj_col not in df_blc2.columns or "VL_MERC_POS_FINAL" not in df_blc2.columns:
-        return pd.DataFrame()
+def _texto_coluna(df: pd.DataFrame, col: str) -> pd.Series:
+    """Coluna como texto sem espaços nas pontas ("" se nula ou ausente)."""
+    if col not in df.columns:
+        return pd.Series("", index=df.index, dtype=object)
+    serie = df[col]
+    return serie.where(serie.notna(), "").astype(str).str.strip()
 
-    df = df_blc2.copy()
-    df["cnpj_fundo"] = df[cnpj_col].apply(_normalizar_cnpj)
-    df = df[df["cnpj_fundo"].isin(cnpjs)].copy()
-    if df.empty:
-        return pd.DataFrame()
 
-    df = df[df["VL_MERC_POS_FINAL"] > 0].copy()
-    if df.empty:
-        return pd.DataFrame()
+def _tipos_com_padrao(codigos: np.ndarray, tipos: pd.Index, padrao: re.Pattern) -> np.ndarray:
+    """padrao.search em cada tipo distinto, espalhado para as linhas."""
+    return np.array([bool(padrao.search(t)) for t in tipos], dtype=bool)[codigos]
 
-    # CNPJ do fundo investido
-    cnpj_cota_col = None
-    for col in ["CNPJ_FUNDO_COTA", "CNPJ_FUNDO_INVEST"]:
-        if col in df.columns:
-            cnpj_cota_col = col
-            break
 
-    nm_col = "NM_FUNDO_COTA" if "NM_FUNDO_COTA" in df.columns else None
+def _classificar_ativos_blc4(df: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+    """(ativo, setor) de cada posição do BLC_4 pelo TP_APLIC e CD_ATIVO.
 
-    def _make_ativo(row):
-        if cnpj_cota_col and pd.notna(row.get(cnpj_cota_col)):
-            cnpj_inv = _normalizar_cnpj(str(row[cnpj_cota_col]))
-            if cnpj_inv and len(cnpj_inv) == 14 and cnpj_inv != row["cnpj_fundo"]:
-                return f"FUNDO {cnpj_inv}"
-        if nm_col and pd.notna(row.get(nm_col)):
-            return f"FUNDO {str(row[nm_col]).strip()[:40]}"
-        return "FUNDO DESCONHECIDO"
+    Ações/BDRs/units com código: o ticker e seu setor; opções, termo, futuro
+    e swap: DERIV <código ou descrição>; outros com código: o código; sem
+    código: OUTROS <descrição ou tipo>. TP_APLIC tem poucas dezenas de valores
+    distintos e os tickers se repetem entre fundos e meses: as regex rodam só
+    nos tipos distintos e classificar_setor só nos códigos distintos.
+    """
+    tp = _texto_coluna(df, "TP_APLIC")
+    cd = _texto_coluna(df, "CD_ATIVO").str.upper()
+    ds = _texto_coluna(df, "DS_ATIVO")
+
+    codigos_tp, tipos = pd.factorize(tp)
+    acao = _tipos_com_padrao(codigos_tp, tipos, _RE_TP_ACAO)
+    derivativo = _tipos_com_padrao(codigos_tp, tipos, _RE_TP_DERIVATIVO)
+    com_codigo = (cd.str.len() >= 4).to_numpy()
+    setor_codigo = cd.map({c: classificar_setor(c) for c in cd.unique() if len(c) >= 4})
+
+    condicoes = [acao & com_codigo, derivativo, com_codigo]
+    ativo_deriv = np.where(cd != "", "DERIV " + cd, "DERIV " + ds.str[:20])
+    ativo_outros = np.where(ds != "", "OUTROS " + ds.str[:25], "OUTROS " + tp.str[:20])
+    ativo = np.select(condicoes, [cd.to_numpy(object), ativo_deriv, cd.to_numpy(object)],
+                      default=ativo_outros)
+    setor = np.select(condicoes, [setor_codigo.to_numpy(object), "Derivativos", setor_codigo.to_numpy(object)],
+                      default="Outros")
+    return ativo, setor
+
+
+# Blocos do CDA na busca sob demanda, na ordem em que entram na carteira.
+# Rótulo do ativo: "<prefixo> <código>" (código da primeira coluna presente
+# em "codigo"), senão "<prefixo> <descrição cortada>", senão "sem_dados"
+# (padrão: o prefixo). codigo_cnpj: o código é o CNPJ do fundo investido e só
+# vale com 14 dígitos e diferente do próprio fundo. rotular: classificação
+# própria do bloco, (ativo, setor) por linha. Outro bloco (3, 7, 8) entra na
+# busca com uma linha aqui.
+_BLOCOS_SOB_DEMANDA = {
+    4: {"rotular": _classificar_ativos_blc4},  # ações, BDRs, ETFs, derivativos...
+    2: {"prefixo": "FUNDO", "codigo": ("CNPJ_FUNDO_COTA", "CNPJ_FUNDO_INVEST"), "codigo_cnpj": True,
+        "descricao": "NM_FUNDO_COTA", "corte": 40, "sem_dados": "FUNDO DESCONHECIDO",
+        "setor": "Cotas de Fundos"},
+    1: {"prefixo": "TITPUB", "codigo": ("CD_ATIVO", "CD_SELIC"), "descricao": "DS_ATIVO", "corte": 25,
+        "setor": "Renda Fixa"},  # títulos públicos
+    5: {"prefixo": "DEP", "codigo": ("CD_ATIVO",), "descricao": "DS_ATIVO", "corte": 25,
+        "setor": "Renda Fixa"},  # depósitos a prazo
+    6: {"prefixo": "DEB", "codigo": ("CD_ATIVO",), "descricao": "DS_ATIVO", "corte": 25,
+        "setor": "Renda Fixa"},  # debêntures
+}
 
-    df["ativo"] = df.apply(_make_ativo, axis=1)
-    df["setor"] = "Cotas de Fundos"
-    return df[["cnpj_fundo", "DT_COMPTC", "ativo", "VL_MERC_POS_FINAL", "setor"]].rename(
-        columns={"DT_COMPTC": "data", "VL_MERC_POS_FINAL": "valor"})
 
+def _rotulos_bloco(df: pd.DataFrame, spec: dict) -> tuple:
+    """(ativo, setor) das posições de um bloco segundo o spec do bloco."""
+    if "rotular" in spec:
+        return spec["rotular"](df)
+    prefixo = spec["prefixo"]
+    col_codigo = next((c for c in spec["codigo"] if c in df.columns), None)
+    if spec.get("codigo_cnpj"):
+        if col_codigo:
+            codigo = _cnpjs_normalizados(df[col_codigo])
+            valido = df[col_codigo].notna() & (codigo.str.len() == 14) & (codigo != df["cnpj_fundo"])
+        else:
+            codigo, valido = "", False
+    else:
+        codigo = _texto_coluna(df, col_codigo)
+        valido = codigo != ""
+    descricao = _texto_coluna(df, spec["descricao"]).str[:spec["corte"]]
+    ativo = np.where(valido, prefixo + " " + codigo,
+                     np.where(descricao != "", prefixo + " " + descricao, spec.get("sem_dados", prefixo)))
+    return ativo, spec["setor"]
 
-def _processar_blc1_cnpjs(df_blc1: pd.DataFrame, cnpjs: set) -> pd.DataFrame:
-    """Extrai títulos públicos (BLC_1) para CNPJs específicos."""
-    cnpj_col = "CNPJ_FUNDO_CLASSE" if "CNPJ_FUNDO_CLASSE" in df_blc1.columns else "CNPJ_FUNDO"
-    if cnpj_col not in df_blc1.columns or "VL_MERC_POS_FINAL" not in df_blc1.columns:
-        return pd.DataFrame()
 
-    df = df_blc1.copy()
-    df["cnpj_fundo"] = df[cnpj_col].apply(_normalizar_cnpj)
-    df = df[df["cnpj_fundo"].isin(cnpjs)].copy()
-    if df.empty:
+def _processar_bloco_cnpjs(df_blc: pd.DataFrame, cnpjs: set, spec: dict) -> pd.DataFrame:
+    """Posições de um bloco do CDA (mês nacional) só dos fundos em cnpjs, com
+    valor positivo, rotuladas pelo spec do bloco (_BLOCOS_SOB_DEMANDA).
+
+    O filtro vem antes de qualquer cópia: só as linhas dos fundos pedidos
+    saem do DataFrame do mês.
+    """
+    cnpj_col = "CNPJ_FUNDO_CLASSE" if "CNPJ_FUNDO_CLASSE" in df_blc.columns else "CNPJ_FUNDO"
+    if cnpj_col not in df_blc.columns or "VL_MERC_POS_FINAL" not in df_blc.columns:
         return pd.DataFrame()
 
-    df = df[df["VL_MERC_POS_FINAL"] > 0].copy()
-    if df.empty:
+    cnpj = _coluna_cnpj_norm(df_blc, cnpj_col)
+    linhas = cnpj.isin(cnpjs) & (df_blc["VL_MERC_POS_FINAL"] > 0)
+    if not linhas.any():
         return pd.DataFrame()
 
-    cod_col = "CD_ATIVO" if "CD_ATIVO" in df.columns else ("CD_SELIC" if "CD_SELIC" in df.columns else None)
-    ds_col = "DS_ATIVO" if "DS_ATIVO" in df.columns else None
+    df = df_blc[linhas].assign(cnpj_fundo=cnpj[linhas])
+    ativo, setor = _rotulos_bloco(df, spec)
+    return pd.DataFrame({"cnpj_fundo": df["cnpj_fundo"], "data": df["DT_COMPTC"], "ativo": ativo,
+                         "valor": df["VL_MERC_POS_FINAL"], "setor": setor}, index=df.index)
 
-    def _make_ativo(row):
-        cod = str(row[cod_col]).strip() if cod_col and pd.notna(row.get(cod_col)) else ""
-        ds = str(row[ds_col]).strip()[:25] if ds_col and pd.notna(row.get(ds_col)) else ""
-        return f"TITPUB {cod}" if cod else (f"TITPUB {ds}" if ds else "TITPUB")
 
-    df["ativo"] = df.apply(_make_ativo, axis=1)
-    df["setor"] = "Renda Fixa"
-    return df[["cnpj_fundo", "DT_COMPTC", "ativo", "VL_MERC_POS_FINAL", "setor"]].rename(
-        columns={"DT_COMPTC": "data", "VL_MERC_POS_FINAL": "valor"})
+def _com_pl_e_residuais(df_month: pd.DataFrame, df_pl_cvm: pd.DataFrame | None) -> pd.DataFrame:
+    """Posições de um mês com a coluna pl e uma linha "OUTROS RF/CAIXA" por
+    fundo cujo PL (arquivo PL do CDA) supera a soma das posições em mais de 1%.
+
+    O PL de cada fundo é o último VL_PATRIM_LIQ dele no arquivo; sem PL, vale
+    a soma das posições. Tudo por groupby/índice de CNPJ, uma passada só.
+    """
+    explicado = df_month.groupby("cnpj_fundo", sort=False)["valor"].sum()
+    pl_cda = pd.Series(dtype=float)
+    if df_pl_cvm is not None and not df_pl_cvm.empty:
+        pl_col = "CNPJ_FUNDO_CLASSE" if "CNPJ_FUNDO_CLASSE" in df_pl_cvm.columns else "CNPJ_FUNDO"
+        if pl_col in df_pl_cvm.columns and "VL_PATRIM_LIQ" in df_pl_cvm.columns:
+            pl_cda = pd.Series(df_pl_cvm["VL_PATRIM_LIQ"].to_numpy(dtype=float),
+                               index=_coluna_cnpj_norm(df_pl_cvm, pl_col).to_numpy())
+            pl_cda = pl_cda[~pl_cda.index.duplicated(keep="last")]
+            pl_cda = pl_cda.reindex(explicado.index[explicado.index.isin(pl_cda.index)])
+
+    residual = pl_cda - explicado.reindex(pl_cda.index)
+    residual = residual[(pl_cda > 0) & (residual > pl_cda * 0.01)]  # >1% do PL
+    if len(residual):
+        data_ref = df_month.drop_duplicates("cnpj_fundo").set_index("cnpj_fundo")["data"]
+        outros = pd.DataFrame({"cnpj_fundo": residual.index, "data": data_ref.reindex(residual.index).to_numpy(),
+                               "ativo": "OUTROS RF/CAIXA", "valor": residual.to_numpy(), "setor": "Caixa"})
+        df_month = pd.concat([df_month, outros], ignore_index=True)
+
+    pl_fundo = pd.concat([pl_cda, explicado[~explicado.index.isin(pl_cda.index)]])
+    df_month["pl"] = df_month["cnpj_fundo"].map(pl_fundo)
+    return df_month
 
 
 @st.cache_data(ttl=3600, show_spinner=False)
@@ -804,83 +2669,30 @@ def buscar_carteiras_cvm_sob_demanda(cnpjs_alvo: tuple, meses_max: int = 6) -> p
         cnpjs_pendentes = cnpjs_set - cnpjs_encontrados
         if not cnpjs_pendentes:
             break
+        presentes = _fundos_no_mes_cda(ym, cnpjs_pendentes)
+        if presentes is not None:
+            if not presentes:
+                _IO_CDA["meses_pulados"] += 1
+                continue  # nenhum fundo pendente tem posição neste mês
+            cnpjs_pendentes = presentes
 
         month_dfs = []
         month_found = set()
-
-        # BLC_4: Ações, BDRs, ETFs
-        df_blc4 = _download_cvm_blc4(ym)
-        if df_blc4 is not None and not df_blc4.empty:
-            recs4 = _processar_blc4_cnpjs(df_blc4, cnpjs_pendentes)
-            if not recs4.empty:
-                month_dfs.append(recs4)
-                month_found.update(recs4["cnpj_fundo"].unique())
-
-        # BLC_2: Cotas de fundos
-        df_blc2 = _download_cvm_blc(2, ym)
-        if df_blc2 is not None and not df_blc2.empty:
-            recs2 = _processar_blc2_cnpjs(df_blc2, cnpjs_pendentes)
-            if not recs2.empty:
-                month_dfs.append(recs2)
-                month_found.update(recs2["cnpj_fundo"].unique())
-
-        # BLC_1: Títulos públicos
-        df_blc1 = _download_cvm_blc(1, ym)
-        if df_blc1 is not None and not df_blc1.empty:
-            recs1 = _processar_blc1_cnpjs(df_blc1, cnpjs_pendentes)
-            if not recs1.empty:
-                month_dfs.append(recs1)
-                month_found.update(recs1["cnpj_fundo"].unique())
-
-        # BLC_5: Depósitos a prazo / BLC_6: Debêntures
-        for blc_n, setor_d, pref in [(5, "Renda Fixa", "DEP"), (6, "Renda Fixa", "DEB")]:
-            df_blc_n = _download_cvm_blc(blc_n, ym)
-            if df_blc_n is not None and not df_blc_n.empty:
-                recs_n = _processar_blc_generico_cnpjs(df_blc_n, cnpjs_pendentes, setor_d, pref)
-                if not recs_n.empty:
-                    month_dfs.append(recs_n)
-                    month_found.update(recs_n["cnpj_fundo"].unique())
+        # Os blocos do mês são baixados em paralelo
+        blocos = dict(_baixar_em_ordem(lambda n: _download_cvm_blc(n, ym, cnpjs_pendentes),
+                                       list(_BLOCOS_SOB_DEMANDA)))
+        for blc_n, spec in _BLOCOS_SOB_DEMANDA.items():
+            df_blc = blocos[blc_n]
+            if df_blc is None or df_blc.empty:
+                continue
+            recs = _processar_bloco_cnpjs(df_blc, cnpjs_pendentes, spec)
+            if not recs.empty:
+                month_dfs.append(recs)
+                month_found.update(recs["cnpj_fundo"].unique())
 
         if month_dfs:
-            df_month = pd.concat(month_dfs, ignore_index=True)
-
-            # PL real do arquivo CDA PL
-            df_pl_cvm = _download_cvm_pl(ym)
-            pl_map = {}
-            if df_pl_cvm is not None and not df_pl_cvm.empty:
-                pl_col = "CNPJ_FUNDO_CLASSE" if "CNPJ_FUNDO_CLASSE" in df_pl_cvm.columns else "CNPJ_FUNDO"
-                if pl_col in df_pl_cvm.columns and "VL_PATRIM_LIQ" in df_pl_cvm.columns:
-                    df_pl_cvm["_cnpj"] = df_pl_cvm[pl_col].apply(_normalizar_cnpj)
-                    for cnpj in month_found:
-                        pl_rows = df_pl_cvm[df_pl_cvm["_cnpj"] == cnpj]
-                        if not pl_rows.empty:
-                            pl_map[cnpj] = float(pl_rows["VL_PATRIM_LIQ"].iloc[-1])
-
-            # Fallback PL: soma de posições
-            pl_approx = df_month.groupby("cnpj_fundo")["valor"].sum().to_dict()
-
-            df_month["pl"] = df_month["cnpj_fundo"].map(
-                lambda c: pl_map.get(c, pl_approx.get(c, 0)))
-
-            # Adicionar entrada "Outros RF/Caixa" para o valor não explicado
-            for cnpj in month_found:
-                pl_total = pl_map.get(cnpj, 0)
-                if pl_total > 0:
-                    soma_explicada = df_month[df_month["cnpj_fundo"] == cnpj]["valor"].sum()
-                    residual = pl_total - soma_explicada
-                    if residual > pl_total * 0.01:  # >1% do PL
-                        dt_ref = df_month[df_month["cnpj_fundo"] == cnpj]["data"].iloc[0]
-                        month_dfs.append(pd.DataFrame([{
-                            "cnpj_fundo": cnpj, "data": dt_ref,
-                            "ativo": "OUTROS RF/CAIXA", "valor": residual,
-                            "setor": "Caixa",
-                        }]))
-
-            # Reconcat with residuals
-            df_month = pd.concat(month_dfs, ignore_index=True)
-            df_month["pl"] = df_month["cnpj_fundo"].map(
-                lambda c: pl_map.get(c, pl_approx.get(c, 0)))
-
+            df_month = _com_pl_e_residuais(pd.concat(month_dfs, ignore_index=True),
+                                           _download_cvm_pl(ym, month_found))
             all_dfs.append(df_month)
         cnpjs_encontrados.update(month_found)
 
@@ -898,57 +2710,158 @@ def buscar_carteiras_cvm_sob_demanda(cnpjs_alvo: tuple, meses_max: int = 6) -> p
 # ──────────────────────────────────────────────────────────────────────────────
 # Download e parse CVM inf_diario (cotas diárias)
 # ──────────────────────────────────────────────────────────────────────────────
-def _download_cvm_inf_diario(yyyymm: str, cnpjs_filtro: set | None = None) -> pd.DataFrame | None:
-    """Baixa e cacheia um mês de dados de cotas diárias (inf_diario).
-
-    Se cnpjs_filtro fornecido, salva apenas esses CNPJs no cache (muito menor).
+# Um arquivo por mês com todos os fundos, ordenado por (cnpj_norm, DT_COMPTC)
+# em row groups pequenos: a leitura de um subconjunto de CNPJs (cotas) lê só
+# os row groups que podem ter esses fundos (_ler_parquet_cnpjs), e o universo
+# lê o mesmo arquivo inteiro. Antes o cache _filtered guardava os fundos do
+# primeiro pedido e era reaproveitado por pedidos de outros fundos.
+#
+# O mês não é ordenado inteiro na memória: os lotes do CSV são juntados em
+# trechos de até _LINHAS_TRECHO_INF linhas, cada trecho é ordenado e gravado
+# num parquet temporário, e os trechos são intercalados (merge externo) um row
+# group de cada por vez. Um mês que cabe num trecho vai direto para o destino.
+_COLS_INF_DIARIO = ["cnpj_norm", "DT_COMPTC", "VL_QUOTA", "VL_PATRIM_LIQ"]
+_LINHAS_ROW_GROUP_INF = 5_000   # ~240 fundos por row group (21 dias úteis)
+_LINHAS_TRECHO_INF = 500_000    # linhas ordenadas na memória de cada vez (também no merge)
+_ORDEM_INF_DIARIO = [("cnpj_norm", "ascending"), ("DT_COMPTC", "ascending")]
+
+
+def _mesclar_trechos_inf(trechos: list, destino: str) -> None:
+    """Intercala os parquets de trechos (cada um ordenado por cnpj_norm,
+    DT_COMPTC) em destino, com row groups de _LINHAS_ROW_GROUP_INF linhas.
+
+    Cada trecho é lido alguns row groups por vez, de modo que os trechos
+    juntos tenham cerca de _LINHAS_TRECHO_INF linhas em memória. A cada passo
+    saem, de todos os trechos, as linhas com CNPJ menor que o menor último
+    CNPJ em memória dos trechos não esgotados: nenhum row group ainda não lido
+    pode ter um CNPJ menor que esse. O sort estável das partes (na ordem dos trechos)
+    deixa o resultado igual ao sort do mês inteiro.
     """
-    os.makedirs(CACHE_DIR, exist_ok=True)
-    suffix = "_filtered" if cnpjs_filtro else ""
-    cache_path = os.path.join(CACHE_DIR, f"cvm_inf_diario_{yyyymm}{suffix}.parquet")
-
-    if os.path.exists(cache_path):
-        age_hours = (datetime.now() - datetime.fromtimestamp(os.path.getmtime(cache_path))).total_seconds() / 3600
-        today = datetime.now()
-        ref_date = datetime(int(yyyymm[:4]), int(yyyymm[4:6]), 1)
-        months_old = (today.year - ref_date.year) * 12 + today.month - ref_date.month
-        if months_old > 3 or age_hours < 24:
-            try:
-                return pd.read_parquet(cache_path)
-            except Exception:
-                pass
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    arquivos = [pq.ParquetFile(p) for p in trechos]
+    por_leitura = max(1, _LINHAS_TRECHO_INF // (len(arquivos) * _LINHAS_ROW_GROUP_INF))
+    proximos = [0] * len(arquivos)
+    memoria = [arquivo.schema_arrow.empty_table() for arquivo in arquivos]
+
+    def esgotado(i):
+        return proximos[i] >= arquivos[i].num_row_groups
+
+    def carregar(i):
+        grupos = range(proximos[i], min(proximos[i] + por_leitura, arquivos[i].num_row_groups))
+        proximos[i] = grupos.stop
+        memoria[i] = pa.concat_tables([memoria[i], arquivos[i].read_row_groups(grupos)])
+
+    writer = pq.ParquetWriter(destino, arquivos[0].schema_arrow)
+    pendente = arquivos[0].schema_arrow.empty_table()
+
+    def emitir(partes):
+        nonlocal pendente
+        partes = [t for t in partes if t.num_rows]
+        if partes:
+            pendente = pa.concat_tables([pendente, pa.concat_tables(partes).sort_by(_ORDEM_INF_DIARIO)])
+        prontas = pendente.num_rows - pendente.num_rows % _LINHAS_ROW_GROUP_INF
+        if prontas:
+            writer.write_table(pendente.slice(0, prontas), row_group_size=_LINHAS_ROW_GROUP_INF)
+            pendente = pendente.slice(prontas)
 
-    url = CVM_INF_DIARIO_URL.format(yyyymm=yyyymm)
     try:
-        resp = requests.get(url, timeout=120)
-        if resp.status_code != 200:
-            return None
-        with zipfile.ZipFile(io.BytesIO(resp.content)) as zf:
-            csv_names = [n for n in zf.namelist() if n.endswith(".csv")]
-            if not csv_names:
-                return None
-            with zf.open(csv_names[0]) as csvfile:
-                df = pd.read_csv(csvfile, sep=";", encoding="latin-1", low_memory=False)
-    except Exception:
-        return None
+        for i in range(len(arquivos)):
+            carregar(i)
+        while True:
+            restantes = [i for i in range(len(arquivos)) if not esgotado(i)]
+            if not restantes:
+                emitir(memoria)
+                break
+            ultimos = {i: memoria[i].column("cnpj_norm")[-1].as_py() for i in restantes}
+            i_limite = min(ultimos, key=ultimos.get)
+            partes = []
+            for i, tabela in enumerate(memoria):
+                # Ordenado por CNPJ: as linhas abaixo do limite são um prefixo
+                n = pc.sum(pc.less(tabela.column("cnpj_norm"), ultimos[i_limite])).as_py() or 0
+                partes.append(tabela.slice(0, n))
+                memoria[i] = tabela.slice(n)
+            emitir(partes)
+            carregar(i_limite)
+        if pendente.num_rows:
+            writer.write_table(pendente)
+    finally:
+        writer.close()
+
+
+def _gravar_inf_diario_ordenado(zf: zipfile.ZipFile, nome: str, destino: str) -> bool:
+    """Grava o CSV do mês ordenado por (cnpj_norm, DT_COMPTC), em row groups de
+    _LINHAS_ROW_GROUP_INF linhas (escrita atômica). False se não há CNPJ."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tmp = _caminho_temporario(destino)
+    trechos = []
+
+    def gravar_trechos(motor):
+        for path in trechos:  # restos do motor anterior
+            _remover_download(path)
+        trechos.clear()
+        pendentes, n_pendentes, esquema = [], 0, None
+
+        def descarregar(ultimo=False):
+            nonlocal pendentes, n_pendentes
+            tabela = pa.concat_tables(pendentes).sort_by(_ORDEM_INF_DIARIO)
+            pendentes, n_pendentes = [], 0
+            if ultimo and not trechos:  # o mês coube num trecho: já é o arquivo final
+                trechos.append(tmp)
+                pq.write_table(tabela, tmp, row_group_size=_LINHAS_ROW_GROUP_INF)
+                return
+            trechos.append(f"{tmp}.{len(trechos)}")
+            pq.write_table(tabela, trechos[-1], row_group_size=_LINHAS_ROW_GROUP_INF,
+                           compression="none")  # só vai e volta do disco
+
+        for lote in _lotes_csv_cvm(zf, nome, "INF_DIARIO", motor=motor):
+            if "cnpj_norm" not in lote.columns:
+                return False
+            cols = [c for c in _COLS_INF_DIARIO if c in lote.columns]
+            pendentes.append(pa.Table.from_pandas(lote[cols], preserve_index=False, schema=esquema))
+            esquema = pendentes[0].schema
+            n_pendentes += len(lote)
+            if n_pendentes >= _LINHAS_TRECHO_INF:
+                descarregar()
+        if pendentes:
+            descarregar(ultimo=True)
+        return bool(trechos)
 
-    # Normalizar coluna CNPJ
-    cnpj_col = "CNPJ_FUNDO_CLASSE" if "CNPJ_FUNDO_CLASSE" in df.columns else "CNPJ_FUNDO"
-    if cnpj_col not in df.columns:
-        return None
-    df["cnpj_norm"] = df[cnpj_col].apply(_normalizar_cnpj)
+    try:
+        if not _com_motor_reserva(gravar_trechos):
+            return False
+        if trechos != [tmp]:
+            _mesclar_trechos_inf(trechos, tmp)
+        os.replace(tmp, destino)
+    finally:
+        for path in trechos:
+            _remover_download(path)
+        _remover_download(tmp)
+    return True
 
-    # Filtrar se solicitado
-    if cnpjs_filtro:
-        df = df[df["cnpj_norm"].isin(cnpjs_filtro)].copy()
 
-    # Manter apenas colunas úteis
-    cols_keep = ["cnpj_norm", "DT_COMPTC", "VL_QUOTA", "VL_PATRIM_LIQ"]
-    cols_available = [c for c in cols_keep if c in df.columns]
-    df = df[cols_available].copy()
+def _download_cvm_inf_diario(yyyymm: str, cnpjs_filtro: set | None = None) -> pd.DataFrame | None:
+    """Baixa e cacheia um mês de dados de cotas diárias (inf_diario).
 
-    df.to_parquet(cache_path, index=False)
-    return df
+    O cache é um só por mês (todos os fundos); com cnpjs_filtro, lê dele só
+    os row groups desses CNPJs.
+    """
+    cache_path = _cache_cvm_path("INF_DIARIO", yyyymm)
+
+    def gravar(zip_path):
+        with zipfile.ZipFile(zip_path) as zf:
+            csv_names = [n for n in zf.namelist() if n.endswith(".csv")]
+            if not csv_names or not _gravar_inf_diario_ordenado(zf, csv_names[0], cache_path):
+                return []
+        _invalidar_cache_cvm(_cache_cvm_path("INF_DIARIO", yyyymm, "_filtered"))  # formato anterior
+        return [cache_path]
+
+    return _cache_cvm(cache_path, yyyymm, CVM_INF_DIARIO_URL.format(yyyymm=yyyymm), 120, gravar,
+                      cnpjs_filtro or None)
 
 
 @st.cache_data(ttl=3600, show_spinner="Baixando cotas dos fundos (CVM inf_diario)...")
@@ -983,9 +2896,9 @@ def carregar_cotas_fundos(cnpjs: tuple, meses: int = 36) -> pd.DataFrame:
     all_dfs = []
     progress = st.progress(0, text="Baixando cotas CVM...")
 
-    for idx, ym in enumerate(meses_list):
+    baixar = functools.partial(_download_cvm_inf_diario, cnpjs_filtro=cnpjs_set)
+    for idx, (ym, df) in enumerate(_baixar_em_ordem(baixar, meses_list)):
         progress.progress((idx + 1) / len(meses_list), text=f"Cotas {ym[:4]}/{ym[4:]}...")
-        df = _download_cvm_inf_diario(ym, cnpjs_filtro=cnpjs_set)
         if df is not None and not df.empty:
             all_dfs.append(df)
 
@@ -1014,6 +2927,29 @@ def carregar_cotas_fundos(cnpjs: tuple, meses: int = 36) -> pd.DataFrame:
     return df_all.reset_index(drop=True)
 
 
+def _universo_stats_mes(ym: str) -> pd.DataFrame | None:
+    """Estatísticas diárias de retorno de todos os fundos de um mês (inf_diario)."""
+    df = _download_cvm_inf_diario(ym, cnpjs_filtro=None)
+    if df is None or df.empty:
+        return None
+    # Calcular retorno diário para todos os fundos deste mês
+    df = df.rename(columns={"DT_COMPTC": "data", "VL_QUOTA": "vl_quota", "cnpj_norm": "cnpj"})
+    df["data"] = pd.to_datetime(df["data"])
+    df = df.sort_values(["cnpj", "data"])
+    df["ret"] = df.groupby("cnpj")["vl_quota"].transform(lambda s: s.pct_change())
+    # Agregar: por data, calcular stats
+    return df.groupby("data")["ret"].agg(
+        media_ret="mean",
+        std_ret="std",
+        p10=lambda x: np.nanpercentile(x, 10),
+        p25=lambda x: np.nanpercentile(x, 25),
+        p50=lambda x: np.nanpercentile(x, 50),
+        p75=lambda x: np.nanpercentile(x, 75),
+        p90=lambda x: np.nanpercentile(x, 90),
+        n_fundos="count",
+    ).reset_index()
+
+
 @st.cache_data(ttl=3600, show_spinner="Calculando estatisticas do universo de fundos...")
 def carregar_universo_stats(meses: int = 36) -> pd.DataFrame:
     """Carrega estatísticas agregadas do universo de fundos RV.
@@ -1044,28 +2980,10 @@ def carregar_universo_stats(meses: int = 36) -> pd.DataFrame:
     all_dfs = []
     progress = st.progress(0, text="Baixando universo CVM...")
 
-    for idx, ym in enumerate(meses_list):
+    for idx, (ym, daily_stats) in enumerate(_baixar_em_ordem(_universo_stats_mes, meses_list)):
         progress.progress((idx + 1) / len(meses_list), text=f"Universo {ym[:4]}/{ym[4:]}...")
-        df = _download_cvm_inf_diario(ym, cnpjs_filtro=None)
-        if df is None or df.empty:
-            continue
-        # Calcular retorno diário para todos os fundos deste mês
-        df = df.rename(columns={"DT_COMPTC": "data", "VL_QUOTA": "vl_quota", "cnpj_norm": "cnpj"})
-        df["data"] = pd.to_datetime(df["data"])
-        df = df.sort_values(["cnpj", "data"])
-        df["ret"] = df.groupby("cnpj")["vl_quota"].transform(lambda s: s.pct_change())
-        # Agregar: por data, calcular stats
-        daily_stats = df.groupby("data")["ret"].agg(
-            media_ret="mean",
-            std_ret="std",
-            p10=lambda x: np.nanpercentile(x, 10),
-            p25=lambda x: np.nanpercentile(x, 25),
-            p50=lambda x: np.nanpercentile(x, 50),
-            p75=lambda x: np.nanpercentile(x, 75),
-            p90=lambda x: np.nanpercentile(x, 90),
-            n_fundos="count",
-        ).reset_index()
-        all_dfs.append(daily_stats)
+        if daily_stats is not None:
+            all_dfs.append(daily_stats)
 
     progress.empty()
 
@@ -1077,6 +2995,73 @@ def carregar_universo_stats(meses: int = 36) -> pd.DataFrame:
     return df_stats.reset_index(drop=True)
 
 
+def _cvm_posicoes_mes(ym: str, cnpjs_alvo: set) -> pd.DataFrame | None:
+    """Posições em ações/BDRs de um mês do CDA (BLC_4 + PL) para os CNPJs alvo."""
+    df_cvm = _download_cvm_blc4(ym, cnpjs_alvo)
+    if df_cvm is None or df_cvm.empty:
+        return None
+
+    # Tratar mudança de nome da coluna CNPJ
+    cnpj_col = "CNPJ_FUNDO_CLASSE" if "CNPJ_FUNDO_CLASSE" in df_cvm.columns else "CNPJ_FUNDO"
+    if cnpj_col not in df_cvm.columns:
+        return None
+
+    df_cvm["cnpj_norm"] = _coluna_cnpj_norm(df_cvm, cnpj_col)
+
+    # Filtrar para CNPJs alvo
+    df_filtered = df_cvm[df_cvm["cnpj_norm"].isin(cnpjs_alvo)].copy()
+    if df_filtered.empty:
+        return None
+
+    # Verificar colunas necessárias
+    needed = ["DT_COMPTC", "CD_ATIVO", "VL_MERC_POS_FINAL"]
+    if not all(c in df_filtered.columns for c in needed):
+        return None
+
+    # PL real: tentar obter do arquivo CDA PL (VL_PATRIM_LIQ)
+    df_pl = _download_cvm_pl(ym, cnpjs_alvo)
+    pl_real = {}
+    if df_pl is not None and not df_pl.empty:
+        pl_cnpj_col = "CNPJ_FUNDO_CLASSE" if "CNPJ_FUNDO_CLASSE" in df_pl.columns else "CNPJ_FUNDO"
+        if pl_cnpj_col in df_pl.columns and "VL_PATRIM_LIQ" in df_pl.columns:
+            df_pl["cnpj_norm"] = _coluna_cnpj_norm(df_pl, pl_cnpj_col)
+            df_pl_filtered = df_pl[df_pl["cnpj_norm"].isin(cnpjs_alvo)]
+            pl_real = dict(zip(df_pl_filtered["cnpj_norm"], df_pl_filtered["VL_PATRIM_LIQ"]))
+
+    # Fallback: PL aproximado pela soma de TODAS as posições no BLC_4
+    pl_approx = df_filtered.groupby("cnpj_norm")["VL_MERC_POS_FINAL"].sum()
+
+    # Filtrar apenas posições em ações/BDRs/certificados (exclui debêntures, opções, futuros)
+    mask = df_filtered["VL_MERC_POS_FINAL"] > 0
+    if "TP_APLIC" in df_filtered.columns:
+        tp_aplic_patterns = r"^A.{1,3}es(?:\s|$)|Brazilian Depository|Certificado"
+        mask = mask & df_filtered["TP_APLIC"].str.contains(tp_aplic_patterns, case=False, na=False)
+    df_stocks = df_filtered[mask].copy()
+    df_stocks = df_stocks[df_stocks["CD_ATIVO"].notna()].copy()
+    df_stocks["CD_ATIVO"] = df_stocks["CD_ATIVO"].str.strip().str.upper()
+    df_stocks = df_stocks[df_stocks["CD_ATIVO"].str.len() >= 4].copy()
+
+    if df_stocks.empty:
+        return None
+
+    # Usar PL real (do arquivo PL) quando disponível, senão fallback
+    tem_pl_real = df_stocks["cnpj_norm"].isin(list(pl_real))
+    df_stocks["pl"] = df_stocks["cnpj_norm"].map(pl_real).where(
+        tem_pl_real, df_stocks["cnpj_norm"].map(pl_approx).fillna(0))
+    df_stocks["pct_pl"] = (df_stocks["VL_MERC_POS_FINAL"] / df_stocks["pl"] * 100).fillna(0)
+    df_stocks["setor"] = df_stocks["CD_ATIVO"].map(lambda t: classificar_setor(t))
+    df_stocks["fonte"] = "CVM"
+
+    month_records = df_stocks.rename(columns={
+        "cnpj_norm": "cnpj_fundo",
+        "DT_COMPTC": "data",
+        "CD_ATIVO": "ativo",
+        "VL_MERC_POS_FINAL": "valor",
+    })[["cnpj_fundo", "data", "ativo", "valor", "pl", "pct_pl", "setor", "fonte"]].copy()
+    month_records["data"] = pd.to_datetime(month_records["data"])
+    return month_records
+
+
 @st.cache_data(ttl=3600, show_spinner="Baixando dados CVM (pode levar alguns minutos na primeira vez)...")
 def carregar_dados_cvm(cnpjs_interesse: tuple, cnpjs_com_xml: tuple, meses: int = 36) -> pd.DataFrame:
     """Baixa dados CVM para fundos sem XML."""
@@ -1097,71 +3082,11 @@ def carregar_dados_cvm(cnpjs_interesse: tuple, cnpjs_com_xml: tuple, meses: int
     all_records = []
     progress = st.progress(0, text="Baixando dados CVM...")
 
-    for idx, ym in enumerate(meses_list):
+    baixar = functools.partial(_cvm_posicoes_mes, cnpjs_alvo=cnpjs_alvo)
+    for idx, (ym, month_records) in enumerate(_baixar_em_ordem(baixar, meses_list)):
         progress.progress((idx + 1) / len(meses_list), text=f"CVM {ym[:4]}/{ym[4:]}...")
-        df_cvm = _download_cvm_blc4(ym)
-        if df_cvm is None or df_cvm.empty:
-            continue
-
-        # Tratar mudança de nome da coluna CNPJ
-        cnpj_col = "CNPJ_FUNDO_CLASSE" if "CNPJ_FUNDO_CLASSE" in df_cvm.columns else "CNPJ_FUNDO"
-        if cnpj_col not in df_cvm.columns:
-            continue
-
-        df_cvm["cnpj_norm"] = df_cvm[cnpj_col].apply(_normalizar_cnpj)
-
-        # Filtrar para CNPJs alvo
-        df_filtered = df_cvm[df_cvm["cnpj_norm"].isin(cnpjs_alvo)].copy()
-        if df_filtered.empty:
-            continue
-
-        # Verificar colunas necessárias
-        needed = ["DT_COMPTC", "CD_ATIVO", "VL_MERC_POS_FINAL"]
-        if not all(c in df_filtered.columns for c in needed):
-            continue
-
-        # PL real: tentar obter do arquivo CDA PL (VL_PATRIM_LIQ)
-        df_pl = _download_cvm_pl(ym)
-        pl_real = {}
-        if df_pl is not None and not df_pl.empty:
-            pl_cnpj_col = "CNPJ_FUNDO_CLASSE" if "CNPJ_FUNDO_CLASSE" in df_pl.columns else "CNPJ_FUNDO"
-            if pl_cnpj_col in df_pl.columns and "VL_PATRIM_LIQ" in df_pl.columns:
-                df_pl["cnpj_norm"] = df_pl[pl_cnpj_col].apply(_normalizar_cnpj)
-                df_pl_filtered = df_pl[df_pl["cnpj_norm"].isin(cnpjs_alvo)]
-                pl_real = dict(zip(df_pl_filtered["cnpj_norm"], df_pl_filtered["VL_PATRIM_LIQ"]))
-
-        # Fallback: PL aproximado pela soma de TODAS as posições no BLC_4
-        pl_approx = df_filtered.groupby("cnpj_norm")["VL_MERC_POS_FINAL"].sum()
-
-        # Filtrar apenas posições em ações/BDRs/certificados (exclui debêntures, opções, futuros)
-        mask = df_filtered["VL_MERC_POS_FINAL"] > 0
-        if "TP_APLIC" in df_filtered.columns:
-            tp_aplic_patterns = r"^A.{1,3}es(?:\s|$)|Brazilian Depository|Certificado"
-            mask = mask & df_filtered["TP_APLIC"].str.contains(tp_aplic_patterns, case=False, na=False)
-        df_stocks = df_filtered[mask].copy()
-        df_stocks = df_stocks[df_stocks["CD_ATIVO"].notna()].copy()
-        df_stocks["CD_ATIVO"] = df_stocks["CD_ATIVO"].str.strip().str.upper()
-        df_stocks = df_stocks[df_stocks["CD_ATIVO"].str.len() >= 4].copy()
-
-        if df_stocks.empty:
-            continue
-
-        # Usar PL real (do arquivo PL) quando disponível, senão fallback
-        df_stocks["pl"] = df_stocks["cnpj_norm"].map(
-            lambda x: pl_real.get(x, pl_approx.get(x, 0))
-        )
-        df_stocks["pct_pl"] = (df_stocks["VL_MERC_POS_FINAL"] / df_stocks["pl"] * 100).fillna(0)
-        df_stocks["setor"] = df_stocks["CD_ATIVO"].map(lambda t: classificar_setor(t))
-        df_stocks["fonte"] = "CVM"
-
-        month_records = df_stocks.rename(columns={
-            "cnpj_norm": "cnpj_fundo",
-            "DT_COMPTC": "data",
-            "CD_ATIVO": "ativo",
-            "VL_MERC_POS_FINAL": "valor",
-        })[["cnpj_fundo", "data", "ativo", "valor", "pl", "pct_pl", "setor", "fonte"]].copy()
-        month_records["data"] = pd.to_datetime(month_records["data"])
-        all_records.append(month_records)
+        if month_records is not None:
+            all_records.append(month_records)
 
     progress.empty()
 
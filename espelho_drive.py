@@ -0,0 +1,197 @@
+"""
+Espelho local das pastas do Google Drive (XMLs de fechamento, Mellon e PDFs BTG).
+
+A latência do drive de rede domina o tempo de parse numa execução fria. A
+sincronização copia para cache/espelho só os arquivos cujo tamanho ou mtime
+mudou (o mtime da origem é preservado na cópia, então a comparação é só um
+stat de cada lado) e remove do espelho o que sumiu da origem. Depois,
+apontar_para_espelho() faz data_loader e pdf_parser lerem da cópia local.
+
+A cópia é retomável: cada arquivo é escrito em <nome>.<tamanho>_<mtime>.parcial
+e só vira o arquivo final (os.replace) quando completo. Se a sincronização for
+interrompida, a próxima continua o .parcial do ponto em que parou, desde que
+o arquivo na origem não tenha mudado.
+
+Uso:
+    python espelho_drive.py                 # sincroniza xml, mellon e pdf
+    python espelho_drive.py --pastas xml    # só os XMLs de fechamento
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import data_loader
+import pdf_parser
+
+_BLOCO_COPIA = 1024 * 1024
+
+# nome -> (pasta na rede, extensões espelhadas). Capturado na importação:
+# depois de apontar_para_espelho() os módulos passam a apontar para a cópia.
+PASTAS_ESPELHO = {
+    "xml": (data_loader.XML_BASE_PATH, (".xml", ".zip")),  # meses compactados (AAAA/MM.zip)
+    "mellon": (data_loader.XML_MELLON_PATH, (".xml",)),
+    "pdf": (pdf_parser.PDF_BASE_DIR, (".pdf",)),
+}
+
+
+def caminho_espelho(nome: str) -> str:
+    # Sob o CACHE_DIR do momento (export_data pode apontá-lo para a saída)
+    return os.path.join(data_loader.CACHE_DIR, "espelho", nome)
+
+
+def _espelhavel(nome: str, extensoes: tuple) -> bool:
+    return nome.lower().endswith(extensoes) and not nome.startswith("~")
+
+
+def _varrer(pasta: str, extensoes: tuple, stats: dict, falhas: list):
+    """Gera (caminho relativo, os.stat_result) dos arquivos espelháveis.
+
+    Usa scandir: no Windows o stat vem junto da listagem da pasta, sem uma
+    ida extra à rede por arquivo. Pastas que não puderam ser listadas (e
+    entradas sem stat) vão para falhas, como caminho relativo: o que está
+    embaixo delas é desconhecido, não removido da origem.
+    """
+    pendentes = [""]
+    while pendentes:
+        rel_pasta = pendentes.pop()
+        try:
+            with os.scandir(os.path.join(pasta, rel_pasta)) as it:
+                entradas = list(it)
+        except OSError:
+            stats["erros"] += 1
+            falhas.append(rel_pasta)
+            continue
+        for entrada in entradas:
+            rel = os.path.join(rel_pasta, entrada.name)
+            try:
+                if entrada.is_dir():
+                    pendentes.append(rel)
+                elif _espelhavel(entrada.name, extensoes):
+                    yield rel, entrada.stat()
+            except OSError:
+                stats["erros"] += 1
+                falhas.append(rel)
+
+
+def _sob_falha(rel: str, falhas: list) -> bool:
+    """True se rel está numa pasta (ou é uma entrada) que a varredura não leu."""
+    return any(f == "" or rel == f or rel.startswith(f + os.sep) for f in falhas)
+
+
+def _parcial(destino: str, info: os.stat_result) -> str:
+    return f"{destino}.{info.st_size}_{info.st_mtime_ns}.parcial"
+
+
+def _copiar_retomavel(origem: str, destino: str, info: os.stat_result) -> tuple[int, bool]:
+    """Copia origem -> destino retomando um .parcial da mesma versão da origem.
+
+    Retorna (bytes transferidos, retomado).
+    """
+    parcial = _parcial(destino, info)
+    inicio = os.path.getsize(parcial) if os.path.exists(parcial) else 0
+    if inicio > info.st_size:
+        inicio = 0
+    transferidos = 0
+    with open(origem, "rb") as f_in, open(parcial, "ab" if inicio else "wb") as f_out:
+        f_in.seek(inicio)
+        while True:
+            bloco = f_in.read(_BLOCO_COPIA)
+            if not bloco:
+                break
+            f_out.write(bloco)
+            transferidos += len(bloco)
+    os.utime(parcial, ns=(info.st_atime_ns, info.st_mtime_ns))
+    os.replace(parcial, destino)
+    return transferidos, inicio > 0
+
+
+def sincronizar_pasta(origem: str, destino: str, extensoes: tuple) -> dict:
+    """Sincroniza origem -> destino (só arquivos com tamanho/mtime diferente).
+
+    Retorna {"arquivos", "copiados", "retomados", "removidos", "bytes", "erros"}.
+    """
+    stats = {"arquivos": 0, "copiados": 0, "retomados": 0, "removidos": 0, "bytes": 0, "erros": 0}
+    if not os.path.isdir(origem):
+        return stats
+
+    vistos = set()
+    falhas = []
+    for rel, info in _varrer(origem, extensoes, stats, falhas):
+        stats["arquivos"] += 1
+        destino_arq = os.path.join(destino, rel)
+        vistos.add(destino_arq)
+        try:
+            atual = os.stat(destino_arq)
+            if atual.st_size == info.st_size and atual.st_mtime_ns == info.st_mtime_ns:
+                continue
+        except OSError:
+            pass
+        # Se a cópia falhar no meio, o .parcial fica para a próxima execução
+        vistos.add(_parcial(destino_arq, info))
+        try:
+            os.makedirs(os.path.dirname(destino_arq), exist_ok=True)
+            transferidos, retomado = _copiar_retomavel(os.path.join(origem, rel), destino_arq, info)
+        except OSError:
+            stats["erros"] += 1
+            continue
+        stats["copiados"] += 1
+        stats["retomados"] += int(retomado)
+        stats["bytes"] += transferidos
+
+    # Remover do espelho o que não existe mais na origem (e .parcial de
+    # versões antigas); o .parcial da versão atual de cada arquivo é mantido.
+    # Nada é removido sob uma pasta que falhou na listagem: uma queda do
+    # drive no meio da varredura não pode apagar o mês da cópia local.
+    for raiz, _, arquivos in os.walk(destino):
+        for nome in arquivos:
+            path = os.path.join(raiz, nome)
+            if path in vistos or _sob_falha(os.path.relpath(path, destino), falhas):
+                continue
+            if nome.endswith(".parcial") or _espelhavel(nome, extensoes):
+                try:
+                    os.remove(path)
+                    stats["removidos"] += 1
+                except OSError:
+                    stats["erros"] += 1
+    return stats
+
+
+def sincronizar_espelho(pastas: list[str] | None = None) -> dict:
+    """Sincroniza as pastas de PASTAS_ESPELHO; retorna {nome: stats}."""
+    resultado = {}
+    for nome in pastas or list(PASTAS_ESPELHO):
+        origem, extensoes = PASTAS_ESPELHO[nome]
+        resultado[nome] = sincronizar_pasta(origem, caminho_espelho(nome), extensoes)
+    return resultado
+
+
+def apontar_para_espelho() -> None:
+    """Faz data_loader e pdf_parser lerem da cópia local."""
+    data_loader.XML_BASE_PATH = caminho_espelho("xml")
+    data_loader.XML_MELLON_PATH = caminho_espelho("mellon")
+    pdf_parser.PDF_BASE_DIR = caminho_espelho("pdf")
+
+
+def formatar_stats(nome: str, stats: dict) -> str:
+    return (f"{nome}: {stats['arquivos']} arquivos, {stats['copiados']} copiados "
+            f"({stats['retomados']} retomados), {stats['removidos']} removidos, "
+            f"{stats['bytes'] / 1e6:.2f} MB transferidos, {stats['erros']} erros")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pastas", nargs="+", choices=list(PASTAS_ESPELHO),
+                        default=list(PASTAS_ESPELHO))
+    args = parser.parse_args()
+
+    t0 = time.time()
+    for nome, stats in sincronizar_espelho(args.pastas).items():
+        print(f"  {formatar_stats(nome, stats)}")
+    print(f"  -> {time.time()-t0:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
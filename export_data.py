@@ -3,7 +3,7 @@ Script de exportação INCREMENTAL de dados para deploy cloud.
 
 Na primeira vez, baixa tudo (36 meses CVM + todos XMLs).
 Nas próximas execuções:
-  - XMLs: só processa novos arquivos (compara com data mais recente no parquet)
+  - XMLs: só parseia arquivos novos/alterados (manifesto em cache/xml_manifesto*.parquet)
   - CVM: só baixa meses que ainda não estão no parquet
   - Reconstrói consolidado com dedup
 
@@ -11,13 +11,25 @@ Modos de execução:
     python export_data.py          # incremental (padrão)
     python export_data.py --full   # força reprocessamento completo
     python export_data.py --ci     # modo CI/GitHub Actions (sem XMLs/Excel)
-
-Os parquets ficam em data/ e devem ser commitados no repo.
+    python export_data.py --full --processos 1   # parse serial dos XMLs (depuração)
+    python export_data.py --espelho # lê XMLs/PDFs de uma cópia local sincronizada do Drive
+    python export_data.py --compactar-xml 2   # meses fechados de XML -> AAAA/MM.zip
+    python export_data.py --full --gravar-cvm fixtures/cvm   # grava os ZIPs da CVM usados
+    python export_data.py --cvm-fixtures fixtures/cvm        # CVM reproduzida, sem rede
+
+Ao final, os meses antigos do cache da CVM são compactados num parquet por
+ano e o cache é podado até CVM_CACHE_LIMITE_MB (ver cache_cvm.py).
+
+Os parquets ficam em data/ e devem ser commitados no repo. Com --cvm-fixtures
+(fixtures gravadas ou de fixtures_cvm.py gerar), a CVM vem de um servidor
+local, o modo é o CI e cache e saída são recriados em <pasta>/reproducao: o
+tempo medido é sempre o de uma execução a frio e data/ não é tocado.
 """
 
 import os
 import sys
 import argparse
+import functools
 from datetime import datetime
 
 # Garantir diretório correto
@@ -61,12 +73,18 @@ from data_loader import (
     carregar_cotas_fundos,
     carregar_universo_stats,
     buscar_carteiras_cvm_sob_demanda,
-    _download_cvm_blc4,
-    _download_cvm_pl,
-    _normalizar_cnpj,
+    _cvm_posicoes_mes,
+    _baixar_em_ordem,
+    compactar_meses_fechados,
+    estatisticas_io_xml,
+    estatisticas_cda,
+    estatisticas_revalidacao,
+    compactar_cache_cvm,
+    liberar_cache_cvm,
+    indexar_cache_cda,
     BENCHMARK_CNPJS,
+    _xml_indice_pastas_path,
 )
-from sector_map import classificar_setor
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
 
@@ -136,16 +154,95 @@ def _dedup_consolidado(df_posicoes, df_fundos):
     return df_posicoes.sort_values(["cnpj_fundo", "data", "ativo"])
 
 
+def _print_io_xml():
+    """Resumo de aberturas/bytes lidos por arquivo na carga de XMLs."""
+    io_xml = estatisticas_io_xml()
+    if io_xml.empty:
+        print("  -> E/S: nenhum XML lido (tudo do manifesto)")
+        return
+    print(f"  -> E/S: {len(io_xml)} arquivos lidos, {io_xml['aberturas'].sum()} aberturas "
+          f"(máx {io_xml['aberturas'].max()}/arquivo), "
+          f"{io_xml['bytes_lidos'].sum() / 1e6:.1f} MB "
+          f"(média {io_xml['bytes_lidos'].mean() / 1e3:.0f} KB/arquivo)")
+
+
+def _print_io_cda():
+    """Downloads do ZIP combinado do CDA e o que a deduplicação por mês evitou."""
+    io_cda = estatisticas_cda()
+    if io_cda["downloads"]:
+        print(f"  -> CDA: {io_cda['downloads']} ZIPs baixados "
+              f"({io_cda['bytes_baixados'] / 1e6:.1f} MB), "
+              f"{io_cda['bytes_evitados'] / 1e6:.1f} MB poupados por bloco/PL do mesmo mês")
+
+
+def _print_revalidacao_cvm():
+    """Arquivos da CVM revalidados com 304 (cache vencido, mas sem mudança)."""
+    rev = estatisticas_revalidacao()
+    if rev["nao_modificados"]:
+        print(f"  -> CVM: {rev['nao_modificados']} arquivos sem mudança (304), "
+              f"{rev['bytes_evitados'] / 1e6:.1f} MB não baixados")
+
+
+def _governar_cache_cvm():
+    """Indexa os meses do CDA ainda fora do índice de CNPJs, compacta os meses
+    antigos do cache da CVM e aplica CVM_CACHE_LIMITE_MB."""
+    indexados = indexar_cache_cda()  # antes da poda: o índice sobrevive aos parquets
+    compactados = compactar_cache_cvm()
+    liberado = liberar_cache_cvm()
+    meses = sum(r["compactados"] for r in compactados.values())
+    economia = sum(r["bytes_antes"] - r["bytes_depois"] for r in compactados.values())
+    print(f"\nCache CVM: {liberado['bytes_total'] / 1e6:.1f} MB; {meses} meses compactados "
+          f"em {len(compactados)} arquivos anuais ({economia / 1e6:.1f} MB a menos), "
+          f"{liberado['removidos']} arquivos removidos pelo limite "
+          f"({liberado['bytes_liberados'] / 1e6:.1f} MB); {indexados} meses do CDA indexados")
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--full", action="store_true", help="Força reprocessamento completo")
     parser.add_argument("--ci", action="store_true", help="Modo CI/GitHub Actions (sem XMLs/Excel)")
+    parser.add_argument("--processos", type=int, default=os.cpu_count() or 1,
+                        help="Processos para o parse dos XMLs (1 = serial, para depuração)")
+    parser.add_argument("--espelho", action="store_true",
+                        help="Sincroniza o espelho local do Drive e lê XMLs/PDFs dele")
+    parser.add_argument("--compactar-xml", type=int, metavar="MESES_ABERTOS", default=None,
+                        help="Compacta em AAAA/MM.zip os meses de XML anteriores aos últimos N "
+                             "(desligado por padrão; vale no drive de rede, não em disco local)")
+    parser.add_argument("--gravar-cvm", metavar="PASTA", default=None,
+                        help="Grava em PASTA cada ZIP baixado da CVM (cache frio em PASTA/cache)")
+    parser.add_argument("--cvm-fixtures", metavar="PASTA", default=None,
+                        help="Reproduz a CVM a partir dos ZIPs de PASTA (sem rede; implica --ci)")
     args = parser.parse_args()
 
+    global DATA_DIR
+    t_inicio = time.time()
+    srv_cvm = None
+    if args.cvm_fixtures:
+        import shutil
+        import data_loader
+        import fixtures_cvm
+        args.ci = True
+        saida = os.path.join(args.cvm_fixtures, "reproducao")
+        shutil.rmtree(saida, ignore_errors=True)
+        DATA_DIR = os.path.join(saida, "data")
+        data_loader.CACHE_DIR = os.path.join(saida, "cache")
+        os.makedirs(DATA_DIR, exist_ok=True)
+        if os.path.exists(os.path.join(args.cvm_fixtures, "fundos_rv.parquet")):
+            shutil.copyfile(os.path.join(args.cvm_fixtures, "fundos_rv.parquet"),
+                            os.path.join(DATA_DIR, "fundos_rv.parquet"))
+        srv_cvm = fixtures_cvm.reproduzir(args.cvm_fixtures)
+    elif args.gravar_cvm:
+        import data_loader
+        data_loader.CVM_FIXTURES_GRAVAR = args.gravar_cvm
+        os.makedirs(args.gravar_cvm, exist_ok=True)
+        data_loader.CACHE_DIR = os.path.join(args.gravar_cvm, "cache")
+
     os.makedirs(DATA_DIR, exist_ok=True)
 
     print("=" * 60)
-    if args.ci:
+    if args.cvm_fixtures:
+        mode = f"CVM REPRODUZIDA DE {args.cvm_fixtures}"
+    elif args.ci:
         mode = "CI/GITHUB ACTIONS"
     elif args.full:
         mode = "COMPLETO"
@@ -154,6 +251,24 @@ def main():
     print(f"EXPORTACAO DE DADOS ({mode})")
     print("=" * 60)
 
+    # ── 0. Compactação dos meses fechados e espelho local (opcionais) ──
+    if args.compactar_xml is not None and not args.ci:
+        print(f"\n[0/8] Compactando meses de XML fechados (mantendo {args.compactar_xml} soltos)...")
+        t0 = time.time()
+        meses = compactar_meses_fechados(meses_abertos=args.compactar_xml)
+        for mes_path, stats in meses.items():
+            print(f"  {mes_path}: {stats['arquivos']} XMLs, {stats['bytes_soltos'] / 1e6:.1f} MB"
+                  f" -> {stats['bytes_zip'] / 1e6:.1f} MB, {stats['removidos']} soltos removidos")
+        print(f"  -> {len(meses)} meses em {time.time()-t0:.1f}s")
+    if args.espelho and not args.ci:
+        import espelho_drive
+        print("\n[0/8] Sincronizando espelho local do Drive...")
+        t0 = time.time()
+        for nome, stats in espelho_drive.sincronizar_espelho().items():
+            print(f"  {espelho_drive.formatar_stats(nome, stats)}")
+        espelho_drive.apontar_para_espelho()
+        print(f"  -> {time.time()-t0:.1f}s")
+
     # ── 1. Fundos RV ──
     fundos_path = os.path.join(DATA_DIR, "fundos_rv.parquet")
     if args.ci:
@@ -170,6 +285,8 @@ def main():
         df_fundos = carregar_fundos_rv()
         print(f"  -> {len(df_fundos)} fundos em {time.time()-t0:.1f}s")
         df_fundos.to_parquet(fundos_path, index=False)
+    if args.gravar_cvm:
+        df_fundos.to_parquet(os.path.join(args.gravar_cvm, "fundos_rv.parquet"), index=False)
 
     cnpjs_direto = set(df_fundos["cnpj_norm"].dropna().tolist())
     cnpjs_foco = set(df_fundos["cnpj_foco_norm"].dropna().tolist()) - {""}
@@ -195,22 +312,34 @@ def main():
         print(f"  Dados existentes ate: {old_max_date}")
 
         t0 = time.time()
-        df_xml_new = carregar_dados_xml(todos_cnpjs)
+        # Histórico inteiro, sem janela: CNPJs novos na Base Geral, XMLs
+        # antigos corrigidos e CNPJs que saíram do universo só aparecem numa
+        # releitura completa. Manifesto: só arquivos novos/alterados (tamanho,
+        # mtime) são parseados; os demais vêm do cache.
+        df_xml_new = carregar_dados_xml(todos_cnpjs, n_processos=args.processos,
+                                        usar_manifesto=True)
         new_max_date = df_xml_new["data"].max() if not df_xml_new.empty else old_max_date
 
-        if new_max_date > old_max_date or len(df_xml_new) != len(df_xml_old):
+        # Um XML corrigido muda valores sem mudar a contagem nem a última data
+        if (new_max_date > old_max_date or len(df_xml_new) != len(df_xml_old)
+                or not df_xml_new.equals(df_xml_old)):
             df_xml = df_xml_new
             print(f"  -> Novos dados! {len(df_xml)} registros (era {len(df_xml_old)})")
             df_xml.to_parquet(xml_path, index=False)
         else:
             df_xml = df_xml_old
             print(f"  -> Sem mudancas ({len(df_xml)} registros)")
+        _print_io_xml()
         print(f"  -> {time.time()-t0:.1f}s")
     else:
-        print("\n[2/8] Processando todos os XMLs...")
+        print(f"\n[2/8] Processando todos os XMLs ({args.processos} processos)...")
         t0 = time.time()
-        df_xml = carregar_dados_xml(todos_cnpjs)
+        # Completo: relistar todas as pastas (descarta o índice de pastas)
+        if os.path.exists(_xml_indice_pastas_path()):
+            os.remove(_xml_indice_pastas_path())
+        df_xml = carregar_dados_xml(todos_cnpjs, n_processos=args.processos)
         print(f"  -> {len(df_xml)} registros XML em {time.time()-t0:.1f}s")
+        _print_io_xml()
         df_xml.to_parquet(xml_path, index=False)
 
     # ── 3. CVM (incremental: só meses novos) ──
@@ -254,61 +383,12 @@ def main():
             cnpjs_alvo = set(todos_cnpjs) - set(cnpjs_com_xml_recente)
             new_records = []
 
-            for ym in meses_a_baixar:
-                df_cvm_month = _download_cvm_blc4(ym)
-                if df_cvm_month is None or df_cvm_month.empty:
-                    continue
-
-                cnpj_col = "CNPJ_FUNDO_CLASSE" if "CNPJ_FUNDO_CLASSE" in df_cvm_month.columns else "CNPJ_FUNDO"
-                df_cvm_month["cnpj_norm"] = df_cvm_month[cnpj_col].apply(_normalizar_cnpj)
-                df_filtered = df_cvm_month[df_cvm_month["cnpj_norm"].isin(cnpjs_alvo)].copy()
-                if df_filtered.empty:
-                    continue
-
-                needed = ["DT_COMPTC", "CD_ATIVO", "VL_MERC_POS_FINAL"]
-                if not all(c in df_filtered.columns for c in needed):
-                    continue
-
-                # PL real do arquivo CDA PL
-                df_pl = _download_cvm_pl(ym)
-                pl_real = {}
-                if df_pl is not None and not df_pl.empty:
-                    pl_cnpj_col = "CNPJ_FUNDO_CLASSE" if "CNPJ_FUNDO_CLASSE" in df_pl.columns else "CNPJ_FUNDO"
-                    if pl_cnpj_col in df_pl.columns and "VL_PATRIM_LIQ" in df_pl.columns:
-                        df_pl["cnpj_norm"] = df_pl[pl_cnpj_col].apply(_normalizar_cnpj)
-                        df_pl_f = df_pl[df_pl["cnpj_norm"].isin(cnpjs_alvo)]
-                        pl_real = dict(zip(df_pl_f["cnpj_norm"], df_pl_f["VL_PATRIM_LIQ"]))
-
-                # Fallback: PL aproximado
-                pl_approx = df_filtered.groupby("cnpj_norm")["VL_MERC_POS_FINAL"].sum()
-
-                mask = df_filtered["VL_MERC_POS_FINAL"] > 0
-                if "TP_APLIC" in df_filtered.columns:
-                    tp_aplic_patterns = r"^A.{1,3}es(?:\s|$)|Brazilian Depository|Certificado"
-                    mask = mask & df_filtered["TP_APLIC"].str.contains(tp_aplic_patterns, case=False, na=False)
-                df_stocks = df_filtered[mask].copy()
-                df_stocks = df_stocks[df_stocks["CD_ATIVO"].notna()].copy()
-                df_stocks["CD_ATIVO"] = df_stocks["CD_ATIVO"].str.strip().str.upper()
-                df_stocks = df_stocks[df_stocks["CD_ATIVO"].str.len() >= 4].copy()
-
-                if df_stocks.empty:
-                    continue
-
-                df_stocks["pl"] = df_stocks["cnpj_norm"].map(
-                    lambda x: pl_real.get(x, pl_approx.get(x, 0))
-                )
-                df_stocks["pct_pl"] = (df_stocks["VL_MERC_POS_FINAL"] / df_stocks["pl"] * 100).fillna(0)
-                df_stocks["setor"] = df_stocks["CD_ATIVO"].map(lambda t: classificar_setor(t))
-                df_stocks["fonte"] = "CVM"
-
-                month_records = df_stocks.rename(columns={
-                    "cnpj_norm": "cnpj_fundo",
-                    "DT_COMPTC": "data",
-                    "CD_ATIVO": "ativo",
-                    "VL_MERC_POS_FINAL": "valor",
-                })[["cnpj_fundo", "data", "ativo", "valor", "pl", "pct_pl", "setor", "fonte"]].copy()
-                month_records["data"] = pd.to_datetime(month_records["data"])
-                new_records.append(month_records)
+            # Meses baixados em paralelo (ordem preservada), mesmo processamento
+            # por mês de carregar_dados_cvm
+            baixar = functools.partial(_cvm_posicoes_mes, cnpjs_alvo=cnpjs_alvo)
+            for ym, month_records in _baixar_em_ordem(baixar, meses_a_baixar):
+                if month_records is not None:
+                    new_records.append(month_records)
 
             if new_records:
                 df_new = pd.concat(new_records, ignore_index=True)
@@ -332,6 +412,7 @@ def main():
         df_cvm = carregar_dados_cvm(todos_cnpjs, cnpjs_com_xml_recente, meses=36)
         print(f"  -> {len(df_cvm)} registros CVM em {time.time()-t0:.1f}s")
         df_cvm.to_parquet(cvm_path, index=False)
+    _print_io_cda()
 
     # ── 4. Consolidar com dedup ──
     print("\n[4/8] Consolidando com deduplicacao...")
@@ -387,6 +468,7 @@ def main():
         print(f"  -> {len(df_stats)} datas com stats em {time.time()-t0:.1f}s")
     else:
         print(f"  -> Sem dados de universo (cache pode estar indisponivel)")
+    _print_revalidacao_cvm()
 
     # ── 7. Explosão: dados dos PDFs BTG para modo cloud ──
     print("\n[7/8] Exportando dados de Explosao (PDFs BTG)...")
@@ -482,13 +564,19 @@ def main():
         print(f"  -> yahoo_finance.db nao encontrado em {YAHOO_DB} (pulando)")
     print(f"  -> {time.time()-t0:.1f}s")
 
+    _governar_cache_cvm()
+    if srv_cvm is not None:
+        print(f"CVM reproduzida: {srv_cvm.requisicoes} requisições, "
+              f"{srv_cvm.bytes_enviados / 1e6:.1f} MB servidos")
+
     # Resumo
     total_size = sum(
         os.path.getsize(os.path.join(DATA_DIR, f))
         for f in os.listdir(DATA_DIR) if f.endswith(".parquet")
     )
     print(f"\n{'=' * 60}")
-    print(f"CONCLUIDO! Total: {total_size / 1e6:.1f} MB em data/")
+    print(f"CONCLUIDO em {time.time()-t_inicio:.1f}s! Total: {total_size / 1e6:.1f} MB em "
+          f"{'data/' if srv_cvm is None else DATA_DIR}")
     for f in sorted(os.listdir(DATA_DIR)):
         if f.endswith(".parquet"):
             size = os.path.getsize(os.path.join(DATA_DIR, f))
@@ -0,0 +1,312 @@
+"""
+Fixtures offline da CVM: gravação, reprodução e geração sintética.
+
+Os caminhos da CVM (CDA, blocos BLC_n, PL, inf_diario) dependem de
+dados.cvm.gov.br, o que torna as medições de tempo irreprodutíveis. Aqui:
+
+- gravação: com data_loader.CVM_FIXTURES_GRAVAR (ou export_data.py
+  --gravar-cvm PASTA), cada ZIP baixado da CVM é copiado para a pasta com o
+  nome da URL e o mtime do Last-Modified;
+- reprodução: ServidorCVM serve os ZIPs de uma pasta por HTTP local (com
+  ETag/Last-Modified, 304, Range) e reproduzir() aponta as URLs da CVM do
+  data_loader para ele; um arquivo ausente responde 404, como um mês ainda
+  não publicado;
+- geração: ZIPs sintéticos no layout dos dados abertos, em escala 1x, 10x ou
+  100x (100x ~ universo real do inf_diario), mais um fundos_rv.parquet com
+  fundos RV que existem nos ZIPs.
+
+Uso:
+    python fixtures_cvm.py gerar fixtures/cvm --escala 10   # ZIPs sintéticos
+    python fixtures_cvm.py servir fixtures/cvm              # CVM local (imprime a URL)
+    python export_data.py --full --gravar-cvm fixtures/cvm  # grava a CVM real
+    python export_data.py --cvm-fixtures fixtures/cvm       # exportação sem rede
+"""
+
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+from email.utils import formatdate, parsedate_to_datetime
+
+import data_loader
+
+_TICKERS = ["PETR4", "VALE3", "ITUB4", "BBDC4", "WEGE3", "ABEV3", "B3SA3", "RENT3",
+            "SUZB3", "EQTL3", "PRIO3", "RDOR3", "LREN3", "RADL3", "BBAS3", "GGBR4"]
+FUNDOS_ESCALA_1 = 400          # fundos na escala 1x (100x ~ 40 mil classes, como a CVM)
+POSICOES_POR_FUNDO = 30        # linhas do BLC_4 por fundo no CDA
+FUNDOS_RV = 40                 # fundos do fundos_rv.parquet sintético
+MES_LAYOUT_175 = "202410"      # meses anteriores saem com CNPJ_FUNDO (layout antigo)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ZIPs sintéticos no formato dos dados abertos
+# ──────────────────────────────────────────────────────────────────────────────
+def _cnpj_formatado(cnpj: str) -> str:
+    return f"{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}"
+
+
+def gerar_zip_cda(path: str, ym: str, cnpjs: list[str], n_por_fundo: int, extra_mb: int = 0,
+                  col_cnpj: str = "CNPJ_FUNDO_CLASSE"):
+    """cda_fi_AAAAMM.zip com BLC_4 (ações, com todas as colunas do layout da
+    CVM), os demais blocos (títulos, cotas, depósitos, debêntures...) e o PL.
+
+    extra_mb: membro não usado pelo pipeline (como os CSVs CONFID/FIE do ZIP
+    real), incompressível, para o ZIP ter o tamanho de um mês real.
+    col_cnpj: CNPJ_FUNDO_CLASSE (RCVM 175) ou CNPJ_FUNDO (layout antigo).
+    """
+    import zipfile
+    dt = f"{ym[:4]}-{ym[4:]}-28"
+    blc4 = [f"TP_FUNDO_CLASSE;{col_cnpj};DENOM_SOCIAL;DT_COMPTC;ID_DOC;TP_APLIC;TP_ATIVO;"
+            "EMISSOR_LIGADO;TP_NEGOC;QT_VENDA_NEGOC;VL_VENDA_NEGOC;QT_AQUIS_NEGOC;VL_AQUIS_NEGOC;"
+            "QT_POS_FINAL;VL_MERC_POS_FINAL;VL_CUSTO_POS_FINAL;DT_CONFID_APLIC;CD_ATIVO;DS_ATIVO;"
+            "DT_INI_VIGENCIA;DT_FIM_VIGENCIA"]
+    pl = [f"TP_FUNDO_CLASSE;{col_cnpj};DENOM_SOCIAL;DT_COMPTC;VL_PATRIM_LIQ"]
+    for k, cnpj in enumerate(cnpjs):
+        total = 0.0
+        for i in range(n_por_fundo):
+            ticker = _TICKERS[(i + k) % len(_TICKERS)]
+            valor = 1000.0 * (i + 1) + k
+            total += valor
+            blc4.append(f"FI;{_cnpj_formatado(cnpj)};FUNDO DE INVESTIMENTO {k} FIA;{dt};{1000000 + k};"
+                        f"Ações;Ação ordinária;N;Para negociação;0;0.00;{i};{valor / 2:.2f};"
+                        f"{i * 100};{valor:.2f};{valor * 0.9:.2f};;{ticker};{ticker} ON NM;"
+                        f"2020-01-01;")
+        pl.append(f"FI;{_cnpj_formatado(cnpj)};FUNDO {k};{dt};{total * 1.05:.2f}")
+    outros = {n: [f"TP_FUNDO_CLASSE;{col_cnpj};DENOM_SOCIAL;DT_COMPTC;TP_APLIC;"
+                  "CD_ATIVO;DS_ATIVO;CNPJ_FUNDO_COTA;VL_MERC_POS_FINAL"] for n in (1, 2, 3, 5, 6, 7, 8)}
+    for k, cnpj in enumerate(cnpjs):
+        for n, linhas in outros.items():
+            for i in range(max(1, n_por_fundo // 5)):
+                cota = _cnpj_formatado(cnpjs[(k + i + 1) % len(cnpjs)]) if n == 2 else ""
+                linhas.append(f"FI;{_cnpj_formatado(cnpj)};FUNDO {k};{dt};Bloco {n};"
+                              f"A{n}{i:03d};Ativo {n}-{i};{cota};{100.0 * (i + 1):.2f}")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(f"cda_fi_BLC_4_{ym}.csv", "\n".join(blc4).encode("latin-1"))
+        for n, linhas in outros.items():
+            zf.writestr(f"cda_fi_BLC_{n}_{ym}.csv", "\n".join(linhas).encode("latin-1"))
+        zf.writestr(f"cda_fi_PL_{ym}.csv", "\n".join(pl).encode("latin-1"))
+        if extra_mb:
+            with zf.open(f"cda_fie_CONFID_{ym}.csv", "w") as extra:
+                for _ in range(extra_mb):
+                    extra.write(os.urandom(1024 * 1024))
+
+
+def gerar_zip_inf_diario(path: str, ym: str, cnpjs: list[str], dias: int = 21,
+                         col_cnpj: str = "CNPJ_FUNDO_CLASSE"):
+    """inf_diario_fi_AAAAMM.zip: uma linha por fundo e dia útil, layout da CVM."""
+    import zipfile
+    linhas = [f"TP_FUNDO_CLASSE;{col_cnpj};ID_SUBCLASSE;DT_COMPTC;VL_TOTAL;VL_QUOTA;"
+              "VL_PATRIM_LIQ;CAPTC_DIA;RESG_DIA;NR_COTST"]
+    for k, cnpj in enumerate(cnpjs):
+        cota = 1.0 + (k % 97) / 100
+        for d in range(1, dias + 1):
+            cota *= 1 + ((k * 7 + d * 13) % 21 - 10) / 1000
+            pl = 1e6 * (1 + k % 50)
+            linhas.append(f"FI;{_cnpj_formatado(cnpj)};;{ym[:4]}-{ym[4:]}-{d:02d};{pl * 1.01:.2f};"
+                          f"{cota:.8f};{pl:.2f};0.00;0.00;{100 + k % 900}")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(f"inf_diario_fi_{ym}.csv", "\n".join(linhas).encode("latin-1"))
+
+
+def _meses(n: int) -> list[str]:
+    """Mês atual e os n anteriores (as janelas de export_data cabem nisso)."""
+    hoje = datetime.now()
+    return sorted({(hoje - timedelta(days=30 * i)).strftime("%Y%m") for i in range(n + 1)})
+
+
+def gerar_fixtures(pasta: str, escala: int = 1, meses_cda: int = 36, meses_inf: int = 120) -> dict:
+    """cda_fi_AAAAMM.zip (meses_cda meses) e inf_diario_fi_AAAAMM.zip
+    (meses_inf meses) com FUNDOS_ESCALA_1 * escala fundos, e fundos_rv.parquet
+    com FUNDOS_RV deles. Retorna {"arquivos", "bytes", "fundos"}."""
+    import pandas as pd
+
+    os.makedirs(pasta, exist_ok=True)
+    cnpjs = [f"{12345678000100 + 7 * k:014d}" for k in range(FUNDOS_ESCALA_1 * escala)]
+    paths = []
+    for ym in _meses(meses_cda):
+        col_cnpj = "CNPJ_FUNDO" if ym < MES_LAYOUT_175 else "CNPJ_FUNDO_CLASSE"
+        paths.append(os.path.join(pasta, f"cda_fi_{ym}.zip"))
+        gerar_zip_cda(paths[-1], ym, cnpjs, POSICOES_POR_FUNDO, col_cnpj=col_cnpj)
+    for ym in _meses(meses_inf):
+        col_cnpj = "CNPJ_FUNDO" if ym < MES_LAYOUT_175 else "CNPJ_FUNDO_CLASSE"
+        paths.append(os.path.join(pasta, f"inf_diario_fi_{ym}.zip"))
+        gerar_zip_inf_diario(paths[-1], ym, cnpjs, col_cnpj=col_cnpj)
+
+    rv = cnpjs[:FUNDOS_RV]
+    pd.DataFrame({
+        "nome": [f"FUNDO DE INVESTIMENTO {k} FIA" for k in range(len(rv))],
+        "cnpj": [_cnpj_formatado(c) for c in rv],
+        "categoria": "RV Long Biased",
+        "tier": 1,
+        "master": "-",
+        "cnpj_foco": [_cnpj_formatado(c) for c in rv],
+        "enquadramento": "Não enquadrado",
+        "geri": "Não",
+        "cnpj_norm": rv,
+        "cnpj_foco_norm": rv,
+    }).to_parquet(os.path.join(pasta, "fundos_rv.parquet"), index=False)
+    return {"arquivos": len(paths), "bytes": sum(os.path.getsize(p) for p in paths), "fundos": len(cnpjs)}
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Reprodução: servidor HTTP local no lugar da CVM
+# ──────────────────────────────────────────────────────────────────────────────
+class ServidorCVM:
+    """Servidor HTTP local que serve os ZIPs de uma pasta (substituto da CVM).
+
+    latencia_ms: atraso por requisição; falhas: quantas vezes cada arquivo
+    responde 503 antes de ser servido (exercita retry/backoff); cortes:
+    quantas vezes cada arquivo tem a conexão derrubada no meio do corpo
+    (exercita a retomada via Range, que o servidor atende com 206). Cada
+    arquivo sai com ETag/Last-Modified e pedidos condicionais de uma versão
+    que não mudou recebem 304; bytes_enviados soma os corpos servidos.
+    """
+
+    def __init__(self, pasta: str, latencia_ms: float = 0, falhas: int = 0, cortes: int = 0):
+        import threading
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        servidor = self
+        self.requisicoes = 0
+        self.retomadas = 0
+        self.nao_modificados = 0
+        self.bytes_enviados = 0
+        self._falhas_restantes = {}
+        self._cortes_restantes = {}
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _sem_corpo(self, status: int):
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                time.sleep(latencia_ms / 1000)
+                nome = os.path.basename(self.path)
+                path = os.path.join(pasta, nome)
+                faixa = self.headers.get("Range", "")
+                with servidor._lock:
+                    servidor.requisicoes += 1
+                    servidor.retomadas += bool(faixa)
+                    restantes = servidor._falhas_restantes.setdefault(nome, falhas)
+                    if restantes:
+                        servidor._falhas_restantes[nome] = restantes - 1
+                    cortar = servidor._cortes_restantes.setdefault(nome, cortes)
+                    if not restantes and cortar:
+                        servidor._cortes_restantes[nome] = cortar - 1
+                if not os.path.exists(path):
+                    self._sem_corpo(404)
+                    return
+                if restantes:
+                    self._sem_corpo(503)
+                    return
+                info = os.stat(path)
+                etag = f'"{info.st_size:x}-{info.st_mtime_ns:x}"'
+                modificado = formatdate(int(info.st_mtime), usegmt=True)
+                desde = self.headers.get("If-Modified-Since")
+                if (self.headers.get("If-None-Match") == etag
+                        or (desde and "If-None-Match" not in self.headers
+                            and int(info.st_mtime) <= parsedate_to_datetime(desde).timestamp())):
+                    with servidor._lock:
+                        servidor.nao_modificados += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                if self.headers.get("If-Range") not in (None, etag, modificado):
+                    faixa = ""  # arquivo mudou desde o início do download: vai inteiro
+                with open(path, "rb") as f:
+                    conteudo = f.read()
+                inicio = int(faixa[6:].rstrip("-")) if faixa.startswith("bytes=") else 0
+                self.send_response(206 if inicio else 200)
+                if inicio:
+                    self.send_header("Content-Range",
+                                     f"bytes {inicio}-{len(conteudo) - 1}/{len(conteudo)}")
+                self.send_header("Content-Length", str(len(conteudo) - inicio))
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", modificado)
+                self.end_headers()
+                corpo = conteudo[inicio:]
+                with servidor._lock:
+                    servidor.bytes_enviados += len(corpo) // 2 if cortar else len(corpo)
+                if cortar:
+                    self.wfile.write(corpo[: len(corpo) // 2])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    self.connection.shutdown(2)
+                    return
+                self.wfile.write(corpo)
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def apontar_cvm_para(url_base: str, cache_dir: str | None = None):
+    """Redireciona as URLs da CVM do data_loader para o servidor local (e o
+    cache, se cache_dir)."""
+    data_loader.CVM_ZIP_URL = url_base + "/cda_fi_{yyyymm}.zip"
+    data_loader.CVM_BLC4_ZIP_URL = url_base + "/cda_fi_BLC_4_{yyyymm}.zip"
+    data_loader.CVM_BLC_ZIP_URL = url_base + "/cda_fi_BLC_{blc_num}_{yyyymm}.zip"
+    data_loader.CVM_INF_DIARIO_URL = url_base + "/inf_diario_fi_{yyyymm}.zip"
+    if cache_dir:
+        data_loader.CACHE_DIR = cache_dir
+
+
+def reproduzir(pasta: str, latencia_ms: float = 0) -> ServidorCVM:
+    """Sobe um ServidorCVM com os ZIPs de pasta (até o fim do processo) e
+    aponta as URLs da CVM do data_loader para ele."""
+    srv = ServidorCVM(pasta, latencia_ms).__enter__()
+    apontar_cvm_para(srv.url)
+    return srv
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_gerar = sub.add_parser("gerar", help="ZIPs sintéticos do CDA e do inf_diario")
+    p_gerar.add_argument("pasta")
+    p_gerar.add_argument("--escala", type=int, choices=[1, 10, 100], default=1,
+                         help=f"{FUNDOS_ESCALA_1} fundos x escala")
+    p_gerar.add_argument("--meses-cda", type=int, default=36)
+    p_gerar.add_argument("--meses-inf", type=int, default=120)
+    p_servir = sub.add_parser("servir", help="Serve os ZIPs de uma pasta no lugar da CVM")
+    p_servir.add_argument("pasta")
+    p_servir.add_argument("--latencia-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    t0 = time.time()
+    if args.comando == "gerar":
+        r = gerar_fixtures(args.pasta, args.escala, args.meses_cda, args.meses_inf)
+        print(f"  {r['arquivos']} ZIPs, {r['fundos']} fundos, {r['bytes'] / 1e6:.1f} MB em {args.pasta}")
+        print(f"  -> {time.time()-t0:.1f}s")
+        return 0
+    with ServidorCVM(args.pasta, args.latencia_ms) as srv:
+        print(f"  CVM local em {srv.url} (Ctrl+C para sair)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        print(f"  {srv.requisicoes} requisições, {srv.nao_modificados} 304, "
+              f"{srv.bytes_enviados / 1e6:.1f} MB servidos")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import streamlit as st
+
+# Os módulos do projeto ficam na raiz do repositório (sem pacote instalável)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Monkey-patch streamlit antes de importar data_loader (mesmo esquema do
+# export_data.py): sem cache entre chamadas, cada teste vê o próprio estado
+def _mock_cache_data(*args, **kwargs):
+    def decorator(func):
+        return func
+    if args and callable(args[0]):
+        return args[0]
+    return decorator
+
+
+st.cache_data = _mock_cache_data
+os.environ["FORCE_LOCAL_MODE"] = "1"
@@ -0,0 +1,62 @@
+import os
+import time
+
+import pytest
+
+import data_loader
+
+
+@pytest.fixture
+def cache_cvm(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_loader, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(data_loader, "CVM_CACHE_LIMITE_MB", 1.0)
+    monkeypatch.setattr(data_loader, "_ACESSOS_CVM", {})
+    monkeypatch.setattr(data_loader, "_BYTES_CACHE_CVM", {})
+    return tmp_path
+
+
+def _parquet(pasta, nome: str, kb: int, idade_h: float) -> str:
+    """Parquet de cache falso (só o nome e o tamanho importam), com mtime de idade_h atrás."""
+    path = os.path.join(str(pasta), nome)
+    with open(path, "wb") as f:
+        f.write(b"\0" * kb * 1024)
+    quando = time.time() - idade_h * 3600
+    os.utime(path, (quando, quando))
+    return path
+
+
+def test_blocos_sem_leitor_saem_antes_dos_lidos(cache_cvm):
+    # blc4 mais antigo que os blocos 3/7/8, mas só os sem leitor devem sair
+    _parquet(cache_cvm, "cvm_blc4_202401.parquet", 300, idade_h=48)
+    _parquet(cache_cvm, "cvm_pl_202401.parquet", 300, idade_h=47)
+    for n in (3, 7, 8):
+        _parquet(cache_cvm, f"cvm_blc{n}_202401.parquet", 200, idade_h=1)
+    r = data_loader.liberar_cache_cvm(limite_mb=0.8)
+    assert r["removidos"] == 3
+    assert sorted(os.listdir(cache_cvm)) == ["cvm_acessos.parquet", "cvm_blc4_202401.parquet",
+                                             "cvm_pl_202401.parquet"]
+
+
+def test_lidos_saem_do_menos_usado_para_o_mais_usado(cache_cvm):
+    _parquet(cache_cvm, "cvm_blc4_202401.parquet", 400, idade_h=3)
+    _parquet(cache_cvm, "cvm_blc4_202402.parquet", 400, idade_h=2)
+    _parquet(cache_cvm, "cvm_blc4_202403.parquet", 400, idade_h=1)
+    r = data_loader.liberar_cache_cvm(limite_mb=1.0)
+    assert r["removidos"] == 1
+    assert not os.path.exists(os.path.join(cache_cvm, "cvm_blc4_202401.parquet"))
+
+
+def test_download_so_varre_o_cache_ao_passar_do_limite(cache_cvm):
+    novo = _parquet(cache_cvm, "cvm_blc4_202401.parquet", 100, idade_h=0)
+    # Primeiro download do processo: total ainda desconhecido, varre
+    assert data_loader._limite_cache_cvm_excedido([novo])
+    data_loader.liberar_cache_cvm()
+    # Depois, só soma os gravados até passar de CVM_CACHE_LIMITE_MB
+    for mes in range(2, 10):
+        novo = _parquet(cache_cvm, f"cvm_blc4_2024{mes:02d}.parquet", 100, idade_h=0)
+        assert not data_loader._limite_cache_cvm_excedido([novo])
+    novo = _parquet(cache_cvm, "cvm_blc4_202410.parquet", 100, idade_h=0)
+    assert data_loader._limite_cache_cvm_excedido([novo])
+    r = data_loader.liberar_cache_cvm()
+    assert r["removidos"] == 1
+    assert not data_loader._limite_cache_cvm_excedido([])
@@ -0,0 +1,70 @@
+import itertools
+import re
+
+import pandas as pd
+import pytest
+
+import data_loader
+
+
+def _ativo_setor_por_linha(row):
+    """Classificação do BLC_4 linha a linha (implementação anterior, referência)."""
+    tp = str(row["TP_APLIC"]).strip() if pd.notna(row.get("TP_APLIC")) else ""
+    cd = str(row["CD_ATIVO"]).strip().upper() if pd.notna(row.get("CD_ATIVO")) else ""
+    ds = str(row["DS_ATIVO"]).strip() if pd.notna(row.get("DS_ATIVO")) else ""
+
+    is_stock = bool(re.search(
+        r"A.{1,3}es|Brazilian Depository|Certificado|Units", tp, re.IGNORECASE))
+    if is_stock and cd and len(cd) >= 4:
+        return cd, data_loader.classificar_setor(cd)
+    if re.search(r"Op..es|Termo|Futuro|Swap", tp, re.IGNORECASE):
+        return (f"DERIV {cd}" if cd else f"DERIV {ds[:20]}"), "Derivativos"
+    if cd and len(cd) >= 4:
+        return cd, data_loader.classificar_setor(cd)
+    return (f"OUTROS {ds[:25]}" if ds else f"OUTROS {tp[:20]}"), "Outros"
+
+
+# Tipos, códigos e descrições cruzados: nulos, vazios, espaços nas pontas,
+# minúsculas, códigos curtos e descrições longas (cortadas em 20/25)
+_TIPOS = [None, "", " Ações ", "ações", "Ações e outros TVM cedidos em empréstimo",
+          "Brazilian Depository Receipt", "Certificado ou recibo de depósito de valores mobiliários",
+          "Units", "Opções - Posições titulares", "Opções - Posições lançadas",
+          "Mercado Futuro - Posições compradas", "Termo - Posições vendidas", "Swap - Diferencial a receber",
+          "Debêntures", "Outros valores mobiliários registrados na CVM", "Investimento no Exterior"]
+_CODIGOS = [None, "", "PETR4", " vale3 ", "ITUB4", "ABC", "BOVA11", "XPTO11", "petr4x", "AB", "FUNDO X"]
+_DESCRICOES = [None, "", "PETROBRAS PN EDJ N2 - DESCRIÇÃO LONGA DO ATIVO", " desc curta "]
+
+
+def _referencia(dtype) -> pd.DataFrame:
+    return pd.DataFrame(list(itertools.product(_TIPOS, _CODIGOS, _DESCRICOES)),
+                        columns=["TP_APLIC", "CD_ATIVO", "DS_ATIVO"]).astype(dtype)
+
+
+@pytest.mark.parametrize("dtype", ["str", object])
+def test_colunar_igual_ao_apply_linha_a_linha(dtype):
+    df = _referencia(dtype)
+    esperado = df.apply(_ativo_setor_por_linha, axis=1, result_type="expand")
+    ativo, setor = data_loader._classificar_ativos_blc4(df)
+    assert ativo.tolist() == esperado[0].tolist()
+    assert setor.tolist() == esperado[1].tolist()
+
+
+def test_colunas_ausentes():
+    df = pd.DataFrame({"CD_ATIVO": ["PETR4", "", "AB"]})
+    esperado = df.apply(_ativo_setor_por_linha, axis=1, result_type="expand")
+    ativo, setor = data_loader._classificar_ativos_blc4(df)
+    assert ativo.tolist() == esperado[0].tolist()
+    assert setor.tolist() == esperado[1].tolist()
+
+
+def test_exemplos_fixos():
+    df = pd.DataFrame({
+        "TP_APLIC": ["Ações", "Opções - Posições titulares", "Debêntures", "Debêntures", None],
+        "CD_ATIVO": [" petr4 ", None, "ABC", "", None],
+        "DS_ATIVO": ["", "CALL PETR", "DEB ABC", "DEBENTURE XYZ", None],
+    })
+    ativo, setor = data_loader._classificar_ativos_blc4(df)
+    assert ativo.tolist() == ["PETR4", "DERIV CALL PETR", "OUTROS DEB ABC",
+                              "OUTROS DEBENTURE XYZ", "OUTROS "]
+    assert setor.tolist()[1:] == ["Derivativos", "Outros", "Outros", "Outros"]
+    assert setor[0] == data_loader.classificar_setor("PETR4")
@@ -0,0 +1,76 @@
+import zipfile
+
+import pandas as pd
+import pytest
+
+import data_loader
+from fixtures_cvm import gerar_zip_cda, gerar_zip_inf_diario
+
+_YM = "202401"
+_CNPJS = [f"{22222222000100 + k:014d}" for k in range(400)]
+_ALVO = set(_CNPJS[::37])
+
+
+@pytest.fixture(autouse=True)
+def lotes_pequenos(monkeypatch):
+    # Vários lotes por CSV: o filtro tem de valer em cada um
+    monkeypatch.setattr(data_loader, "_BLOCO_CSV", 16 * 1024)
+    monkeypatch.setattr(data_loader, "_LINHAS_LOTE_CSV", 500)
+
+
+@pytest.mark.parametrize("motor", ["pyarrow", "c"])
+@pytest.mark.parametrize("col_cnpj", ["CNPJ_FUNDO_CLASSE", "CNPJ_FUNDO"])
+def test_filtro_na_leitura_igual_a_ler_tudo_e_filtrar(tmp_path, motor, col_cnpj):
+    inf, cda = str(tmp_path / "inf.zip"), str(tmp_path / "cda.zip")
+    gerar_zip_inf_diario(inf, _YM, _CNPJS, col_cnpj=col_cnpj)
+    gerar_zip_cda(cda, _YM, _CNPJS, 5, col_cnpj=col_cnpj)
+    for zip_path, membro, tipo in ((inf, f"inf_diario_fi_{_YM}.csv", "INF_DIARIO"),
+                                   (cda, f"cda_fi_BLC_4_{_YM}.csv", "BLC_4")):
+        with zipfile.ZipFile(zip_path) as zf:
+            lotes = list(data_loader._lotes_csv_cvm(zf, membro, tipo, motor=motor))
+            filtrados = list(data_loader._lotes_csv_cvm(zf, membro, tipo, _ALVO, motor=motor))
+        assert len(lotes) > 1
+        tudo = pd.concat(lotes, ignore_index=True)
+        esperado = tudo[tudo["cnpj_norm"].isin(_ALVO)].reset_index(drop=True)
+        obtido = pd.concat(filtrados, ignore_index=True)
+        assert set(obtido["cnpj_norm"]) == _ALVO
+        assert obtido.equals(esperado)
+
+
+def _zip_inf_diario_embaralhado(path: str, n_fundos: int) -> str:
+    """inf_diario com linhas fora de ordem, datas repetidas no mesmo fundo e
+    datas vazias (o sort estável decide a ordem dos empates)."""
+    import random
+    linhas = [(k, d) for k in range(n_fundos) for d in range(1, 22)]
+    linhas += [(k, 5) for k in range(0, n_fundos, 7)] + [(k, None) for k in range(0, n_fundos, 11)]
+    random.Random(3).shuffle(linhas)
+    texto = ["TP_FUNDO_CLASSE;CNPJ_FUNDO_CLASSE;DT_COMPTC;VL_QUOTA;VL_PATRIM_LIQ"]
+    for i, (k, d) in enumerate(linhas):
+        cnpj = f"{33333333000100 + 7 * k:014d}"
+        cnpj = f"{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}" if k % 2 else cnpj
+        data = f"{_YM[:4]}-{_YM[4:]}-{d:02d}" if d else ""
+        texto.append(f"FI;{cnpj};{data};{1 + i / 1e6:.8f};{1e6 + k:.2f}")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(f"inf_diario_fi_{_YM}.csv", "\n".join(texto).encode("latin-1"))
+    return path
+
+
+@pytest.mark.parametrize("linhas_trecho", [10**9, 7_000, 1_000])
+def test_inf_diario_ordenado_por_trechos_igual_ao_sort_do_mes(tmp_path, monkeypatch, linhas_trecho):
+    import pyarrow.parquet as pq
+    monkeypatch.setattr(data_loader, "_LINHAS_TRECHO_INF", linhas_trecho)
+    monkeypatch.setattr(data_loader, "_LINHAS_ROW_GROUP_INF", 500)
+    zip_path = _zip_inf_diario_embaralhado(str(tmp_path / "inf.zip"), 1500)
+    destino = str(tmp_path / "cvm_inf_diario_202401.parquet")
+    with zipfile.ZipFile(zip_path) as zf:
+        membro = f"inf_diario_fi_{_YM}.csv"
+        assert data_loader._gravar_inf_diario_ordenado(zf, membro, destino)
+        tudo = pd.concat(data_loader._lotes_csv_cvm(zf, membro, "INF_DIARIO"), ignore_index=True)
+    esperado = (tudo[data_loader._COLS_INF_DIARIO]
+                .sort_values(["cnpj_norm", "DT_COMPTC"], kind="stable", na_position="last")
+                .reset_index(drop=True))
+    pf = pq.ParquetFile(destino)
+    tamanhos = [pf.metadata.row_group(i).num_rows for i in range(pf.metadata.num_row_groups)]
+    assert all(n == 500 for n in tamanhos[:-1]) and 0 < tamanhos[-1] <= 500
+    assert pd.read_parquet(destino).equals(esperado)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["cvm_inf_diario_202401.parquet", "inf.zip"]
@@ -0,0 +1,286 @@
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+import requests
+
+import data_loader
+from fixtures_cvm import ServidorCVM, gerar_zip_cda
+
+_NOME = "cda_fi_202401.zip"
+
+
+@pytest.fixture
+def cvm_local(tmp_path, monkeypatch):
+    """Pasta com um "ZIP" servido localmente; sem intervalo por host e com
+    backoff curto, para que os testes de retry levem milissegundos."""
+    pasta = tmp_path / "cvm"
+    pasta.mkdir()
+    conteudo = os.urandom(300 * 1024)
+    (pasta / _NOME).write_bytes(conteudo)
+    monkeypatch.setattr(data_loader, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(data_loader, "CVM_INTERVALO_HOST", 0)
+    monkeypatch.setattr(data_loader, "CVM_BACKOFF_BASE", 0.01)
+    return str(pasta), conteudo
+
+
+def _esperas(monkeypatch) -> list:
+    """Registra os time.sleep do backoff (sem dormir de fato). O módulo time é
+    o mesmo do ServidorCVM, cuja latência zero chega aqui como sleep(0)."""
+    esperas = []
+    monkeypatch.setattr(data_loader.time, "sleep", lambda s: s > 0 and esperas.append(s))
+    return esperas
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# _http_get: retry e backoff
+# ──────────────────────────────────────────────────────────────────────────────
+def test_http_get_repete_503_ate_obter_o_arquivo(cvm_local):
+    pasta, conteudo = cvm_local
+    with ServidorCVM(pasta, falhas=2) as srv:
+        resp = data_loader._http_get(f"{srv.url}/{_NOME}", timeout=5)
+    assert resp.status_code == 200
+    assert resp.content == conteudo
+    assert srv.requisicoes == 3
+
+
+def test_http_get_devolve_o_erro_na_ultima_tentativa(cvm_local):
+    pasta, _ = cvm_local
+    with ServidorCVM(pasta, falhas=data_loader.CVM_TENTATIVAS + 1) as srv:
+        resp = data_loader._http_get(f"{srv.url}/{_NOME}", timeout=5)
+    assert resp.status_code == 503
+    assert srv.requisicoes == data_loader.CVM_TENTATIVAS
+
+
+def test_http_get_nao_repete_404(cvm_local):
+    pasta, _ = cvm_local
+    with ServidorCVM(pasta) as srv:
+        resp = data_loader._http_get(f"{srv.url}/cda_fi_209912.zip", timeout=5)
+    assert resp.status_code == 404
+    assert srv.requisicoes == 1
+
+
+def test_backoff_dobra_a_cada_tentativa(cvm_local, monkeypatch):
+    pasta, _ = cvm_local
+    esperas = _esperas(monkeypatch)
+    with ServidorCVM(pasta, falhas=3) as srv:
+        resp = data_loader._http_get(f"{srv.url}/{_NOME}", timeout=5)
+    assert resp.status_code == 200
+    base = data_loader.CVM_BACKOFF_BASE
+    assert len(esperas) == 3
+    for tentativa, espera in enumerate(esperas):
+        # base * 2^t com até +50% de jitter
+        assert base * 2 ** tentativa <= espera <= base * 2 ** tentativa * 1.5
+
+
+def test_erro_de_conexao_repete_e_propaga(cvm_local, monkeypatch):
+    esperas = _esperas(monkeypatch)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        porta = s.getsockname()[1]  # porta fechada ao sair do with
+    with pytest.raises(requests.ConnectionError):
+        data_loader._http_get(f"http://127.0.0.1:{porta}/{_NOME}", timeout=5)
+    assert len(esperas) == data_loader.CVM_TENTATIVAS - 1
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# _baixar_em_ordem: paralelo, mas na ordem dos itens
+# ──────────────────────────────────────────────────────────────────────────────
+def test_baixar_em_ordem_preserva_a_ordem_com_downloads_simultaneos():
+    itens = list(range(8))
+    lock = threading.Lock()
+    ativos, pico = 0, 0
+
+    def baixar(i):
+        nonlocal ativos, pico
+        with lock:
+            ativos += 1
+            pico = max(pico, ativos)
+        time.sleep(0.02 * (len(itens) - i))  # os primeiros terminam por último
+        with lock:
+            ativos -= 1
+        return i * 10
+
+    resultado = list(data_loader._baixar_em_ordem(baixar, itens, max_workers=4))
+    assert resultado == [(i, i * 10) for i in itens]
+    assert pico > 1
+
+
+def test_baixar_em_ordem_serial_com_um_worker():
+    chamadas = []
+    resultado = list(data_loader._baixar_em_ordem(
+        lambda i: chamadas.append(i) or -i, [3, 1, 2], max_workers=1))
+    assert resultado == [(3, -3), (1, -1), (2, -2)]
+    assert chamadas == [3, 1, 2]
+
+
+def test_meses_paralelos_e_em_serie_dao_o_mesmo_resultado(cvm_local):
+    pasta, _ = cvm_local
+    meses = [f"2024{m:02d}" for m in range(1, 7)]
+    for ym in meses:
+        with open(os.path.join(pasta, f"cda_fi_{ym}.zip"), "wb") as f:
+            f.write(ym.encode() * 1000)
+
+    def baixar(ym):
+        resp = data_loader._http_get(f"{srv.url}/cda_fi_{ym}.zip", timeout=5)
+        return resp.content
+
+    with ServidorCVM(pasta, latencia_ms=20, falhas=1) as srv:
+        serie = list(data_loader._baixar_em_ordem(baixar, meses, max_workers=1))
+    with ServidorCVM(pasta, latencia_ms=20, falhas=1) as srv:
+        paralelo = list(data_loader._baixar_em_ordem(baixar, meses, max_workers=4))
+    assert paralelo == serie
+    assert [conteudo[:6].decode() for _, conteudo in paralelo] == meses
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# _baixar_para_disco: retomada via Range
+# ──────────────────────────────────────────────────────────────────────────────
+def _ler_e_remover(path: str) -> bytes:
+    with open(path, "rb") as f:
+        conteudo = f.read()
+    data_loader._remover_download(path)
+    return conteudo
+
+
+def test_queda_no_meio_retoma_do_ultimo_byte(cvm_local):
+    pasta, conteudo = cvm_local
+    with ServidorCVM(pasta, cortes=2) as srv:
+        path, validadores = data_loader._baixar_para_disco(f"{srv.url}/{_NOME}", timeout=5)
+    assert _ler_e_remover(path) == conteudo
+    assert srv.retomadas == 2
+    assert srv.requisicoes == 3
+    assert validadores[0] and validadores[2] == len(conteudo)
+
+
+def test_falhas_e_quedas_juntas(cvm_local):
+    pasta, conteudo = cvm_local
+    with ServidorCVM(pasta, falhas=1, cortes=1) as srv:
+        path, _ = data_loader._baixar_para_disco(f"{srv.url}/{_NOME}", timeout=5)
+    assert _ler_e_remover(path) == conteudo
+    assert srv.retomadas == 1
+
+
+def test_quedas_demais_desistem_sem_deixar_parcial(cvm_local):
+    pasta, _ = cvm_local
+    with ServidorCVM(pasta, cortes=data_loader.CVM_TENTATIVAS) as srv:
+        with pytest.raises(requests.ConnectionError, match="download incompleto"):
+            data_loader._baixar_para_disco(f"{srv.url}/{_NOME}", timeout=5)
+    assert not any(n.endswith(".parcial") for n in os.listdir(data_loader.CACHE_DIR))
+
+
+def test_arquivo_inexistente_volta_none(cvm_local):
+    pasta, _ = cvm_local
+    with ServidorCVM(pasta) as srv:
+        path, _ = data_loader._baixar_para_disco(f"{srv.url}/cda_fi_209912.zip", timeout=5)
+    assert path is None
+    assert os.listdir(data_loader.CACHE_DIR) == []
+
+
+def test_versao_inalterada_volta_nao_modificado(cvm_local):
+    pasta, _ = cvm_local
+    with ServidorCVM(pasta) as srv:
+        url = f"{srv.url}/{_NOME}"
+        path, (etag, _, _) = data_loader._baixar_para_disco(url, timeout=5)
+        data_loader._remover_download(path)
+        resultado, _ = data_loader._baixar_para_disco(
+            url, timeout=5, condicional={"If-None-Match": etag})
+    assert resultado is data_loader._NAO_MODIFICADO
+    assert srv.nao_modificados == 1
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# _cache_cvm: revalidação do mês recente (304) e download único por URL
+# ──────────────────────────────────────────────────────────────────────────────
+@pytest.fixture
+def cda_local(tmp_path, monkeypatch):
+    """ZIP combinado do CDA do mês passado (recente: revalidado após o prazo),
+    com cache, metadados e contadores do data_loader isolados por teste."""
+    ym = (datetime.now().replace(day=1) - timedelta(days=1)).strftime("%Y%m")
+    pasta = tmp_path / "cvm"
+    pasta.mkdir()
+    gerar_zip_cda(str(pasta / f"cda_fi_{ym}.zip"), ym,
+                  [f"{44444444000100 + k:014d}" for k in range(30)], 5)
+    monkeypatch.setattr(data_loader, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(data_loader, "CVM_INTERVALO_HOST", 0)
+    for nome, vazio in (("_METADADOS_CVM", {}), ("_LOCKS_URL_CVM", defaultdict(threading.Lock)),
+                        ("_ACESSOS_CVM", {}), ("_BYTES_CACHE_CVM", {}), ("_INDICE_CDA", {}),
+                        ("_MESES_CDA_BAIXADOS", {}), ("_IO_CDA", dict(data_loader._IO_CDA)),
+                        ("_IO_REVALIDACAO", dict(data_loader._IO_REVALIDACAO))):
+        monkeypatch.setattr(data_loader, nome, vazio)
+    return str(pasta), ym
+
+
+def _apontar(monkeypatch, srv: ServidorCVM) -> None:
+    """apontar_cvm_para, mas desfeito no fim do teste."""
+    monkeypatch.setattr(data_loader, "CVM_ZIP_URL", srv.url + "/cda_fi_{yyyymm}.zip")
+    monkeypatch.setattr(data_loader, "CVM_BLC4_ZIP_URL", srv.url + "/cda_fi_BLC_4_{yyyymm}.zip")
+    monkeypatch.setattr(data_loader, "CVM_BLC_ZIP_URL", srv.url + "/cda_fi_BLC_{blc_num}_{yyyymm}.zip")
+
+
+def _validadores() -> pd.DataFrame:
+    return pd.read_parquet(os.path.join(data_loader.CACHE_DIR, "cvm_validadores.parquet"))
+
+
+def test_mes_recente_vencido_e_revalidado_com_304(cda_local, monkeypatch):
+    pasta, ym = cda_local
+    cache_path = data_loader._cache_cvm_path("BLC_4", ym)
+    with ServidorCVM(pasta) as srv:
+        _apontar(monkeypatch, srv)
+        df = data_loader._download_cvm_blc4(ym)
+        assert srv.requisicoes == 1 and not df.empty
+        assert data_loader._download_cvm_blc4(ym).equals(df)
+        assert srv.requisicoes == 1  # dentro do prazo: nem pergunta à CVM
+
+        # Um dia depois, noutro processo: metadados relidos do disco
+        with data_loader._LOCK_METADADOS:
+            for meta in data_loader._metadados_cvm().values():
+                meta["verificado_em"] -= (data_loader.CVM_PRAZO_CACHE_HORAS + 1) * 3600
+            data_loader._salvar_metadados_cvm()
+        data_loader._METADADOS_CVM.clear()
+        antes, mtime_cache = _validadores(), os.stat(cache_path).st_mtime_ns
+        assert data_loader._cache_cvm_vencido(cache_path, ym)
+
+        assert data_loader._download_cvm_blc4(ym).equals(df)
+    assert srv.requisicoes == 2
+    assert srv.nao_modificados == 1
+    assert data_loader.estatisticas_revalidacao()["nao_modificados"] == 1
+
+    # O 304 só renova a hora da verificação (de todos os blocos do mês); o
+    # parquet e os validadores ficam como estavam
+    depois = _validadores()
+    assert os.stat(cache_path).st_mtime_ns == mtime_cache
+    assert (depois["verificado_em"] > antes["verificado_em"]).all()
+    colunas = [c for c in antes.columns if c != "verificado_em"]
+    assert depois[colunas].equals(antes[colunas])
+    assert not data_loader._cache_cvm_vencido(cache_path, ym)
+
+
+def test_mesmo_mes_em_varias_threads_baixa_uma_vez(cda_local, monkeypatch):
+    pasta, ym = cda_local
+    n_threads = 6
+    barreira = threading.Barrier(n_threads)
+    resultados = [None] * n_threads
+
+    def baixar(i):
+        barreira.wait()
+        resultados[i] = data_loader._download_cvm_blc4(ym)
+
+    with ServidorCVM(pasta, latencia_ms=100) as srv:
+        _apontar(monkeypatch, srv)
+        threads = [threading.Thread(target=baixar, args=(i,)) for i in range(n_threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert srv.requisicoes == 1
+    assert not resultados[0].empty
+    assert all(df.equals(resultados[0]) for df in resultados)
+    nomes = os.listdir(data_loader.CACHE_DIR)
+    assert [n for n in nomes if n.startswith(f"cvm_blc4_{ym}")] == [f"cvm_blc4_{ym}.parquet"]
+    assert not [n for n in nomes if n.endswith((".tmp", ".parcial"))]
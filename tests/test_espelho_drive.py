@@ -0,0 +1,58 @@
+import os
+
+import data_loader
+import espelho_drive
+
+
+def _escrever(path: str, conteudo: str = "<xml/>"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(conteudo)
+
+
+def test_falha_ao_listar_pasta_nao_apaga_o_espelho(tmp_path, monkeypatch):
+    origem, destino = str(tmp_path / "drive"), str(tmp_path / "espelho")
+    _escrever(os.path.join(origem, "2024", "01", "a.xml"))
+    _escrever(os.path.join(origem, "2024", "02", "b.xml"))
+    stats = espelho_drive.sincronizar_pasta(origem, destino, (".xml",))
+    assert stats["copiados"] == 2
+
+    # Queda do drive ao listar 2024/02; 2024/01/a.xml saiu da origem
+    os.remove(os.path.join(origem, "2024", "01", "a.xml"))
+    scandir = os.scandir
+    inacessivel = os.path.join(origem, "2024", "02")
+
+    def scandir_falho(path):
+        if os.path.normpath(path) == inacessivel:
+            raise OSError("rede indisponível")
+        return scandir(path)
+
+    monkeypatch.setattr(espelho_drive.os, "scandir", scandir_falho)
+    stats = espelho_drive.sincronizar_pasta(origem, destino, (".xml",))
+    assert stats["erros"] == 1
+    assert stats["removidos"] == 1
+    assert os.path.exists(os.path.join(destino, "2024", "02", "b.xml"))
+    assert not os.path.exists(os.path.join(destino, "2024", "01", "a.xml"))
+
+
+def test_falha_na_raiz_nao_remove_nada(tmp_path, monkeypatch):
+    origem, destino = str(tmp_path / "drive"), str(tmp_path / "espelho")
+    _escrever(os.path.join(origem, "2024", "01", "a.xml"))
+    espelho_drive.sincronizar_pasta(origem, destino, (".xml",))
+
+    def scandir_falho(path):
+        raise OSError("rede indisponível")
+
+    monkeypatch.setattr(espelho_drive.os, "scandir", scandir_falho)
+    stats = espelho_drive.sincronizar_pasta(origem, destino, (".xml",))
+    assert stats == {**stats, "erros": 1, "removidos": 0}
+    assert os.path.exists(os.path.join(destino, "2024", "01", "a.xml"))
+
+
+def test_caminhos_derivados_seguem_o_cache_dir(tmp_path, monkeypatch):
+    # export_data e fixtures_cvm trocam CACHE_DIR depois da importação
+    monkeypatch.setattr(data_loader, "CACHE_DIR", str(tmp_path))
+    assert espelho_drive.caminho_espelho("xml") == os.path.join(str(tmp_path), "espelho", "xml")
+    for path in (data_loader._xml_indice_pastas_path(), data_loader._xml_manifesto_path(),
+                 data_loader._xml_manifesto_posicoes_path()):
+        assert os.path.dirname(path) == str(tmp_path)
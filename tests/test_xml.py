@@ -0,0 +1,293 @@
+import io
+import os
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import data_loader
+from data_loader import NS_DOC, NS_GALGO
+
+_A = "11111111000191"
+_B = "22222222000191"
+_FORA = "99999999000191"  # fundo não acompanhado (só no <cnpj> de YYYYMMDD_*.xml)
+_TICKERS = ["PETR4", "VALE3", "ITUB4", "BBDC4", "WEGE3", "ABEV3", "B3SA3"]
+
+
+def _xml_old(cnpj: str, data: str, pl: float, n: int) -> str:
+    """arquivoposicao_4_01 com n ações, uma cota, um título e caixa."""
+    acoes = "".join(
+        f"<acoes><codativo>{_TICKERS[i % len(_TICKERS)]}</codativo>"
+        f"<valorfindisp>{1000.0 * (i + 1) + pl / 1e6:.2f}</valorfindisp></acoes>"
+        for i in range(n))
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><arquivoposicao_4_01><fundo><header>'
+        f"<cnpj>{cnpj}</cnpj><dtposicao>{data}</dtposicao><patliq>{pl:.2f}</patliq></header>"
+        f"{acoes}"
+        "<cotas><isin>BRCOTA000001</isin><cnpjfundo>33333333000191</cnpjfundo>"
+        "<qtdisponivel>10</qtdisponivel><puposicao>1.5</puposicao><valorfindisp>0</valorfindisp></cotas>"
+        "<titpublico><isin>BRSTN0000001</isin><dtvencimento>20300101</dtvencimento>"
+        "<valorfindisp>500.00</valorfindisp></titpublico>"
+        "<caixa><saldo>123.45</saldo></caixa></fundo></arquivoposicao_4_01>"
+    )
+
+
+def _xml_galgo(cnpj: str, data: str, pl: float, n: int) -> str:
+    """ISO 20022 / Galgo com n BalForSubAcct (um LOAN, que não entra)."""
+    def othr(id_val, tp):
+        return f"<OthrId><Id>{id_val}</Id><Tp>{tp}</Tp></OthrId>"
+
+    subs = "".join(
+        "<BalForSubAcct><FinInstrmId>"
+        + othr(_TICKERS[i % len(_TICKERS)], "<Cd>BVMF</Cd>")
+        + othr("LOAN" if i == 1 else "EQUI", "<Prtry>TABELA NIVEL 1</Prtry>")
+        + "</FinInstrmId><AggtBal><ShrtLngInd>LONG</ShrtLngInd></AggtBal>"
+        + f'<AcctBaseCcyAmts><HldgVal><Amt Ccy="BRL">{2000.0 * (i + 1):.2f}</Amt></HldgVal>'
+        + "</AcctBaseCcyAmts></BalForSubAcct>"
+        for i in range(n))
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?><GalgoAssBalStmt xmlns="{NS_GALGO}"><BsnsMsg>'
+        f'<Document xmlns="{NS_DOC}"><SctiesBalAcctgRpt>'
+        f"<StmtGnlDtls><StmtDtTm><Dt>{data[:4]}-{data[4:6]}-{data[6:]}</Dt></StmtDtTm></StmtGnlDtls>"
+        f"<BalForAcct><FinInstrmId>{othr(cnpj, '<Cd>CNPJ</Cd>')}</FinInstrmId>"
+        f'<AcctBaseCcyAmts><HldgVal><Amt Ccy="BRL">{pl:.2f}</Amt></HldgVal></AcctBaseCcyAmts>'
+        f"</BalForAcct><SubAcctDtls>{subs}</SubAcctDtls>"
+        "</SctiesBalAcctgRpt></Document></BsnsMsg></GalgoAssBalStmt>"
+    )
+
+
+def _gravar(path: str, conteudo: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(conteudo)
+
+
+@pytest.fixture
+def arvore_xml(tmp_path, monkeypatch):
+    """Pasta de fechamento + Mellon com formato antigo e Galgo, prévia de PL
+    menor, fundo não acompanhado, arquivo truncado e mês em AAAA/MM.zip."""
+    base, mellon = str(tmp_path / "fechamento"), str(tmp_path / "mellon")
+    monkeypatch.setattr(data_loader, "XML_BASE_PATH", base)
+    monkeypatch.setattr(data_loader, "XML_MELLON_PATH", mellon)
+    monkeypatch.setattr(data_loader, "CACHE_DIR", str(tmp_path / "cache"))
+    jan, dez = os.path.join(base, "2024", "01"), os.path.join(base, "2023", "12")
+    _gravar(os.path.join(jan, "20240102_FUNDO_A.xml"), _xml_old(_A, "20240102", 1e8, 5))
+    _gravar(os.path.join(jan, "20240102_FUNDO_A_PREVIA.xml"), _xml_old(_A, "20240102", 9e7, 2000))
+    # Maior PL, mas truncado: o merge cai para o próximo candidato
+    cortado = _xml_old(_A, "20240103", 2e8, 40)
+    _gravar(os.path.join(jan, "20240103_FUNDO_A_CORTADO.xml"), cortado[:len(cortado) * 2 // 3])
+    _gravar(os.path.join(jan, "20240103_FUNDO_A.xml"), _xml_old(_A, "20240103", 1e8, 4))
+    _gravar(os.path.join(jan, f"FD{_B}_20240102.xml"), _xml_galgo(_B, "20240102", 5e7, 4))
+    _gravar(os.path.join(jan, f"FD{_B}_20240102_PREVIA.xml"), _xml_galgo(_B, "20240102", 4e7, 2))
+    _gravar(os.path.join(jan, "20240102_OUTRO.xml"), _xml_old(_FORA, "20240102", 3e8, 3))
+    _gravar(os.path.join(jan, "20240103_OUTRO.xml"), _xml_old(_FORA, "20240103", 3e8, 3))
+    _gravar(os.path.join(dez, "20231228_FUNDO_A.xml"), _xml_old(_A, "20231228", 1e8, 6))
+    _gravar(os.path.join(dez, f"FD{_B}_20231228.xml"), _xml_galgo(_B, "20231228", 5e7, 3))
+    _gravar(os.path.join(dez, "20231228_OUTRO.xml"), _xml_old(_FORA, "20231228", 3e8, 2))
+    assert data_loader.compactar_mes_xml(dez)["arquivos"] == 3
+    _gravar(os.path.join(mellon, "20240104", f"FD{_B}_20240104.xml"),
+            _xml_galgo(_B, "20240104", 6e7, 5))
+    return tmp_path
+
+
+def _fora_do_universo(df_io: pd.DataFrame) -> list:
+    return sorted(p for p in df_io["path"] if "OUTRO" in os.path.basename(p))
+
+
+def test_xml_fora_do_universo_nao_e_reaberto_com_manifesto(arvore_xml):
+    primeira = data_loader.carregar_dados_xml((_A, _B), usar_manifesto=True)
+    assert len(_fora_do_universo(data_loader.estatisticas_io_xml())) == 3
+    assert _FORA not in set(primeira["cnpj_fundo"])
+
+    # Nada mudou: todos os arquivos, inclusive os não acompanhados, saem do manifesto
+    segunda = data_loader.carregar_dados_xml((_A, _B), usar_manifesto=True)
+    io_segunda = data_loader.estatisticas_io_xml()
+    assert _fora_do_universo(io_segunda) == []
+    assert io_segunda["aberturas"].sum() == 0
+    assert segunda.equals(primeira)
+
+    # O fundo passa a ser acompanhado: só os arquivos dele são lidos (parse
+    # completo a partir do cabeçalho do manifesto)
+    terceira = data_loader.carregar_dados_xml((_A, _B, _FORA), usar_manifesto=True)
+    io_terceira = data_loader.estatisticas_io_xml()
+    assert sorted(io_terceira["path"]) == _fora_do_universo(io_terceira)
+    assert len(io_terceira) == 3
+    assert terceira.equals(data_loader.carregar_dados_xml((_A, _B, _FORA)))
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Referência: ET.parse da árvore inteira e merge sequencial (implementação anterior)
+# ──────────────────────────────────────────────────────────────────────────────
+def _ref_old(raiz) -> dict:
+    fundo = raiz.find("fundo")
+    header = fundo.find("header")
+    acoes = [{"ativo": a.findtext("codativo").strip().upper(),
+              "valor": float(a.findtext("valorfindisp"))}
+             for a in fundo.findall("acoes") if float(a.findtext("valorfindisp", "0")) > 0]
+    for c in fundo.findall("cotas"):
+        valor = float(c.findtext("valorfindisp", "0")) or (
+            float(c.findtext("qtdisponivel", "0")) * float(c.findtext("puposicao", "0")))
+        acoes.append({"ativo": f"FUNDO {c.findtext('cnpjfundo')}", "valor": valor})
+    for t in fundo.findall("titpublico"):
+        acoes.append({"ativo": f"TITPUB {t.findtext('isin')} ({t.findtext('dtvencimento')[:4]})",
+                      "valor": float(t.findtext("valorfindisp"))})
+    for cx in fundo.findall("caixa"):
+        acoes.append({"ativo": "CAIXA", "valor": float(cx.findtext("saldo"))})
+    return {"cnpj": header.findtext("cnpj"), "pl": float(header.findtext("patliq")),
+            "data": datetime.strptime(header.findtext("dtposicao"), "%Y%m%d"), "acoes": acoes}
+
+
+def _ref_galgo(raiz) -> dict:
+    ns = {"g": NS_GALGO, "d": NS_DOC}
+    rpt = raiz.find("g:BsnsMsg/d:Document/d:SctiesBalAcctgRpt", ns)
+    acct = rpt.find("d:BalForAcct", ns)
+    acoes = []
+    for sub in rpt.findall("d:SubAcctDtls/d:BalForSubAcct", ns):
+        ids = {o.findtext("d:Tp/d:Cd", "", ns) or o.findtext("d:Tp/d:Prtry", "", ns):
+               o.findtext("d:Id", "", ns) for o in sub.findall("d:FinInstrmId/d:OthrId", ns)}
+        if ids.get("TABELA NIVEL 1") == "EQUI":
+            acoes.append({"ativo": ids["BVMF"],
+                          "valor": float(sub.findtext("d:AcctBaseCcyAmts/d:HldgVal/d:Amt", "", ns))})
+    return {"cnpj": acct.findtext("d:FinInstrmId/d:OthrId/d:Id", "", ns),
+            "pl": float(acct.findtext("d:AcctBaseCcyAmts/d:HldgVal/d:Amt", "", ns)),
+            "data": datetime.strptime(rpt.findtext("d:StmtGnlDtls/d:StmtDtTm/d:Dt", "", ns), "%Y-%m-%d"),
+            "acoes": acoes}
+
+
+def _essencial(parsed: dict) -> dict:
+    """Só o que entra no frame (os parsers também devolvem tipo, isin, ...)."""
+    return {**parsed, "acoes": [{"ativo": a["ativo"], "valor": a["valor"]} for a in parsed["acoes"]]}
+
+
+def _referencia(pasta, cnpjs: tuple) -> pd.DataFrame:
+    """Todos os XMLs (soltos e dentro de .zip) parseados por inteiro com
+    ET.parse; maior PL por (cnpj, data)."""
+    conteudos = []
+    for raiz, _, nomes in os.walk(str(pasta)):
+        for nome in sorted(nomes):
+            path = os.path.join(raiz, nome)
+            if nome.endswith(".zip"):
+                with zipfile.ZipFile(path) as zf:
+                    conteudos += [(m, zf.read(m)) for m in zf.namelist()]
+            elif nome.endswith(".xml"):
+                with open(path, "rb") as f:
+                    conteudos.append((nome, f.read()))
+    melhores = {}
+    for nome, conteudo in conteudos:
+        try:
+            raiz = ET.parse(io.BytesIO(conteudo)).getroot()
+        except ET.ParseError:
+            continue
+        parsed = _ref_old(raiz) if raiz.tag == "arquivoposicao_4_01" else _ref_galgo(raiz)
+        m = re.match(r"FD(\d{14})_", nome)
+        cnpj = m.group(1) if m else parsed["cnpj"]
+        chave = (cnpj, parsed["data"])
+        if cnpj in cnpjs and (chave not in melhores or parsed["pl"] > melhores[chave]["pl"]):
+            melhores[chave] = parsed
+    linhas = [(cnpj, data, a["ativo"], a["valor"], p["pl"])
+              for (cnpj, data), p in melhores.items() for a in p["acoes"]]
+    return _ordenado(pd.DataFrame(linhas, columns=["cnpj_fundo", "data", "ativo", "valor", "pl"]))
+
+
+def _ordenado(df: pd.DataFrame) -> pd.DataFrame:
+    colunas = ["cnpj_fundo", "data", "ativo", "valor", "pl"]
+    df = df[colunas].astype({"cnpj_fundo": object, "ativo": object, "data": "datetime64[ns]"})
+    return df.sort_values(colunas).reset_index(drop=True)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Carga completa: serial, em pool e pelo manifesto dão o mesmo frame
+# ──────────────────────────────────────────────────────────────────────────────
+def test_carga_igual_a_referencia_serial_paralela_e_manifesto(arvore_xml):
+    cnpjs = (_A, _B)
+    serial = data_loader.carregar_dados_xml(cnpjs)
+    pd.testing.assert_frame_equal(_ordenado(serial), _referencia(arvore_xml, cnpjs))
+    # Prévia de PL menor descartada; o truncado (maior PL) cai para o próximo
+    pls = serial.groupby(["cnpj_fundo", "data"])["pl"].first()
+    assert pls[(_A, pd.Timestamp("2024-01-02"))] == 1e8
+    assert pls[(_A, pd.Timestamp("2024-01-03"))] == 1e8
+    assert pls[(_B, pd.Timestamp("2024-01-02"))] == 5e7
+    assert {pd.Timestamp("2023-12-28"), pd.Timestamp("2024-01-04")} <= set(serial["data"])
+
+    assert data_loader.carregar_dados_xml(cnpjs, n_processos=2).equals(serial)
+    assert data_loader.carregar_dados_xml(cnpjs, usar_manifesto=True).equals(serial)
+    assert data_loader.carregar_dados_xml(cnpjs, usar_manifesto=True).equals(serial)
+    assert data_loader.estatisticas_io_xml().empty
+
+
+def test_uma_abertura_por_arquivo_e_por_zip(arvore_xml):
+    data_loader.carregar_dados_xml((_A, _B))
+    df_io = data_loader.estatisticas_io_xml()
+    no_zip = df_io["path"].str.contains(re.escape("12.zip" + os.sep))
+    assert no_zip.sum() == 3
+    assert df_io.loc[no_zip, "aberturas"].sum() == 1  # o mês compactado é aberto uma vez
+    assert (df_io.loc[~no_zip, "aberturas"] == 1).all()
+    # Prévia superada: só o cabeçalho foi lido
+    tamanho = df_io.set_index("path")["bytes_lidos"]
+    previa = os.path.join(str(arvore_xml), "fechamento", "2024", "01", "20240102_FUNDO_A_PREVIA.xml")
+    assert tamanho[previa] < os.path.getsize(previa) // 10
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Parsers, sondagem do cabeçalho e releitura do mesmo arquivo aberto
+# ──────────────────────────────────────────────────────────────────────────────
+@pytest.mark.parametrize("gerar,parser", [(_xml_old, data_loader._parse_xml_old),
+                                          (_xml_galgo, data_loader._parse_xml_new)])
+def test_parsers_iterparse_e_sondagem_do_cabecalho(tmp_path, gerar, parser):
+    path = str(tmp_path / "x.xml")
+    _gravar(path, gerar(_A, "20240102", 1e8, 3000))
+    completo = parser(path)
+    with open(path, "rb") as f:
+        referencia = (_ref_old if gerar is _xml_old else _ref_galgo)(ET.parse(f).getroot())
+    assert _essencial(completo) == referencia
+
+    with open(path, "rb") as f:
+        arquivo = data_loader._ReleituraXml(f)
+        cab = parser(arquivo, somente_cabecalho=True)
+        assert _essencial(cab) == {**referencia, "acoes": []}
+        # O cabeçalho está no início: a sondagem não lê o arquivo inteiro
+        assert arquivo.bytes_lidos < os.path.getsize(path) // 10
+        assert _essencial(parser(arquivo.do_inicio(guardar=False))) == referencia
+        assert arquivo.bytes_lidos == os.path.getsize(path)
+
+    truncado = gerar(_A, "20240102", 1e8, 50)
+    _gravar(path, truncado[:len(truncado) // 2])
+    assert parser(path) is None
+    assert parser(path, somente_cabecalho=True)["pl"] == 1e8
+
+
+def _ler_ate(arquivo, n: int, bloco: int = 64) -> bytes:
+    """Leituras curtas (o prefixo guardado volta sozinho), como faz o iterparse."""
+    lido = b""
+    while len(lido) < n and (parte := arquivo.read(min(bloco, n - len(lido)))):
+        lido += parte
+    return lido
+
+
+def test_releitura_guarda_o_prefixo_e_le_cada_byte_uma_vez():
+    dados = os.urandom(50_000)
+    arquivo = data_loader._ReleituraXml(io.BytesIO(dados))
+    assert _ler_ate(arquivo, 100) == dados[:100]
+    assert _ler_ate(arquivo.do_inicio(), 300) == dados[:300]
+    assert _ler_ate(arquivo.do_inicio(guardar=False), len(dados) + 1) == dados
+    assert arquivo.bytes_lidos == len(dados)
+
+
+def test_indice_de_pastas_so_relista_as_alteradas(arvore_xml):
+    por_nome, a_identificar = data_loader._descobrir_xmls_por_cnpj((_A, _B))
+    assert data_loader._VARREDURA_XML["listadas"] == data_loader._VARREDURA_XML["pastas"]
+    membros = [p for p in por_nome[_B] + a_identificar if ".zip" + os.sep in p]
+    assert sorted(os.path.basename(p) for p in membros) == [
+        "20231228_FUNDO_A.xml", "20231228_OUTRO.xml", f"FD{_B}_20231228.xml"]
+
+    assert data_loader._descobrir_xmls_por_cnpj((_A, _B)) == (por_nome, a_identificar)
+    assert data_loader._VARREDURA_XML["listadas"] == 0
+
+    novo = os.path.join(str(arvore_xml), "fechamento", "2024", "01", "20240105_FUNDO_A.xml")
+    _gravar(novo, _xml_old(_A, "20240105", 1e8, 2))
+    _, a_identificar = data_loader._descobrir_xmls_por_cnpj((_A, _B))
+    assert data_loader._VARREDURA_XML["listadas"] == 1
+    assert novo in a_identificar